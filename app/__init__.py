@@ -1,5 +1,5 @@
-
 import os
+import time
 from flask import Flask
 from flask_pymongo import PyMongo
 from flask_login import LoginManager
@@ -8,20 +8,143 @@ from dotenv import load_dotenv
 mongo = PyMongo()
 login_manager = LoginManager()
 
+def _env_flag(name, default="0"):
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
 def create_app():
+    started = time.perf_counter()
     load_dotenv()
 
     app = Flask(__name__)
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
     app.config["MONGO_URI"] = os.getenv("MONGO_URI")
+    # Pooled Mongo connections kept open (pymongo's minPoolSize; also opened by the warm-up)
+    app.config["MONGO_MIN_POOL_SIZE"] = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    # Report missing/unused indexes on startup (see app/indexes.py)
+    app.config["VERIFY_INDEXES"] = _env_flag("VERIFY_INDEXES")
+    # Log an error on startup while packagings remain in the old per-level
+    # collections (see app/packagings.py; `flask migrate-packagings` moves them)
+    app.config["CHECK_LEGACY_PACKAGINGS"] = _env_flag("CHECK_LEGACY_PACKAGINGS")
+    # Dashboard packaging metrics: "python" (reference), "pipeline" (server-side aggregation, MongoDB 5.0+),
+    # "rollup" (maintained packaging_rollups collection; run `flask rebuild-rollups` first)
+    # or "numpy" (vectorized; falls back to "python" when numpy is not installed)
+    app.config["DASHBOARD_ENGINE"] = os.getenv("DASHBOARD_ENGINE", "python")
+    # Data setup lists cache (see app/reference_data.py); TTL 0 disables it.
+    # SHARED keeps gunicorn workers consistent through the per-tenant data version.
+    app.config["REFERENCE_CACHE_TTL"] = int(os.getenv("REFERENCE_CACHE_TTL", "300"))
+    app.config["REFERENCE_CACHE_SIZE"] = int(os.getenv("REFERENCE_CACHE_SIZE", "256"))
+    app.config["REFERENCE_CACHE_SHARED"] = _env_flag("REFERENCE_CACHE_SHARED")
+    # Activity log writer (see app/activity_log.py): "async" batches inserts in a
+    # background thread, "sync" inserts inline (handy for tests and scripts)
+    app.config["ACTIVITY_LOG_MODE"] = os.getenv("ACTIVITY_LOG_MODE", "async")
+    app.config["ACTIVITY_LOG_BATCH_SIZE"] = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "100"))
+    app.config["ACTIVITY_LOG_FLUSH_INTERVAL"] = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "0.5"))
+    app.config["ACTIVITY_LOG_MAX_QUEUE"] = int(os.getenv("ACTIVITY_LOG_MAX_QUEUE", "10000"))
+    app.config["ACTIVITY_LOG_SPILL_PATH"] = os.getenv("ACTIVITY_LOG_SPILL_PATH", "activities.spill.jsonl")
+    # Retention, enforced by `flask apply-activity-retention`: "ttl" lets Mongo
+    # expire entries, "archive" moves them to activities_archive. 0 days keeps everything.
+    app.config["ACTIVITY_RETENTION_DAYS"] = float(os.getenv("ACTIVITY_RETENTION_DAYS", "0"))
+    app.config["ACTIVITY_RETENTION_MODE"] = os.getenv("ACTIVITY_RETENTION_MODE", "ttl")
+
+    # Flask-Login user_loader cache (see app/user_cache.py); TTL 0 disables it.
+    # USER_CACHE_IN_SESSION also keeps the username in the signed session cookie.
+    app.config["USER_CACHE_TTL"] = int(os.getenv("USER_CACHE_TTL", "60"))
+    app.config["USER_CACHE_SIZE"] = int(os.getenv("USER_CACHE_SIZE", "1024"))
+    app.config["USER_CACHE_IN_SESSION"] = _env_flag("USER_CACHE_IN_SESSION")
+
+    # Per-tenant search index cache (see app/search.py)
+    app.config["SEARCH_INDEX_TTL"] = int(os.getenv("SEARCH_INDEX_TTL", "300"))
+    app.config["SEARCH_INDEX_SIZE"] = int(os.getenv("SEARCH_INDEX_SIZE", "64"))
+    # Comma-separated usernames allowed to read the worker-wide /stats counters (none by default)
+    app.config["STATS_USERS"] = {name.strip() for name in os.getenv("STATS_USERS", "").split(",") if name.strip()}
+    # Rows per page of the products page tables (see app/tables.py)
+    app.config["TABLE_PAGE_SIZE"] = int(os.getenv("TABLE_PAGE_SIZE", "50"))
+    # Serialized responses of the versioned JSON endpoints kept per worker (see app/data_version.py)
+    app.config["RESPONSE_CACHE_SIZE"] = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+    # Characters per chunk of the streamed pages (see app/streaming.py)
+    app.config["STREAM_BUFFER_SIZE"] = int(os.getenv("STREAM_BUFFER_SIZE", "8192"))
+    # Cursor batch size for /export and `flask export-data`
+    app.config["EXPORT_BATCH_SIZE"] = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    # app.json encoder (see app/json_provider.py): "orjson" (falls back to
+    # "stdlib" when orjson is not installed) or "stdlib"
+    app.config["JSON_PROVIDER"] = os.getenv("JSON_PROVIDER", "orjson")
+    # Startup warm-up (see app/warmup.py): compile every template, open the Mongo
+    # pool and serve one request before the worker takes traffic. JINJA_CACHE_DIR
+    # keeps compiled templates on disk (default instance/jinja_cache with WARMUP)
+    app.config["WARMUP"] = _env_flag("WARMUP")
+    app.config["JINJA_CACHE_DIR"] = os.getenv("JINJA_CACHE_DIR", "")
+    # Response compression (see app/compression.py). COMPRESS_LEVELS overrides the
+    # per-mimetype levels ("text/html:6,application/json:4"; 0 turns a type off).
+    # COMPRESS_STATIC: "dynamic", "precompressed" (run `flask compress-static`) or "off"
+    app.config["COMPRESS_ENABLED"] = _env_flag("COMPRESS_ENABLED", "1")
+    app.config["COMPRESS_ALGORITHMS"] = os.getenv("COMPRESS_ALGORITHMS", "br,zstd,gzip")
+    app.config["COMPRESS_MIN_SIZE"] = int(os.getenv("COMPRESS_MIN_SIZE", "500"))
+    app.config["COMPRESS_STATIC"] = os.getenv("COMPRESS_STATIC", "dynamic")
+    from .compression import DEFAULT_LEVELS, parse_levels
+    app.config["COMPRESS_LEVELS"] = dict(DEFAULT_LEVELS, **parse_levels(os.getenv("COMPRESS_LEVELS", "")))
+
+    from .warmup import init_template_cache
+    init_template_cache(app)
 
-    mongo.init_app(app)
+    mongo.init_app(app, minPoolSize=app.config["MONGO_MIN_POOL_SIZE"])
+    # After PyMongo, which installs its own extended-JSON provider
+    from .json_provider import init_json
+    init_json(app)
 
     login_manager.init_app(app)
     login_manager.login_view = "main.login"  # blueprint endpoint
 
+    from .reference_data import init_reference_cache
+    init_reference_cache(app)
+    from .activity_log import init_activity_writer
+    init_activity_writer(app)
+    from .user_cache import init_user_cache
+    init_user_cache(app)
+    from .search import init_search_index
+    init_search_index(app)
+    from .data_version import init_response_cache
+    init_response_cache(app)
+    from .recyclability import init_form_fragments
+    init_form_fragments(app)
+    from .compression import init_compression
+    init_compression(app)
+    from .streaming import init_streaming
+    init_streaming(app)
+
     # routes blueprint
     from .routes import main_bp
     app.register_blueprint(main_bp)
 
+    # flask CLI commands (ensure-indexes, ...)
+    from .cli import register_cli
+    register_cli(app)
+
+    if app.config["CHECK_LEGACY_PACKAGINGS"]:
+        from .packagings import legacy_packaging_counts
+        try:
+            pending = legacy_packaging_counts(mongo.db)
+            if pending:
+                app.logger.error(
+                    "Packagings still in the per-level collections are missing from every list, "
+                    "search and export (%s): run `flask migrate-packagings`", pending
+                )
+        except Exception as e:
+            app.logger.warning("Legacy packaging check skipped: %s", e)
+
+    if app.config["VERIFY_INDEXES"]:
+        from .indexes import check_indexes
+        try:
+            report = check_indexes(mongo.db)
+            for coll_name, name in report["missing"]:
+                app.logger.warning("Missing index %s.%s (run `flask ensure-indexes`)", coll_name, name)
+            for coll_name, name in report["changed"]:
+                app.logger.warning("Index %s.%s differs from its declaration (run `flask ensure-indexes`)", coll_name, name)
+            for coll_name, name in report["unused"]:
+                app.logger.info("Index %s.%s has no recorded use", coll_name, name)
+        except Exception as e:
+            app.logger.warning("Index verification skipped: %s", e)
+
+    from .warmup import init_startup
+    init_startup(app, started)
+
     return app
@@ -0,0 +1,284 @@
+# app/activity_log.py
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from bson import json_util
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+from pymongo.write_concern import WriteConcern
+from . import mongo
+from .indexes import INDEXES
+
+TTL_INDEX_NAME = "timestamp_ttl"
+ARCHIVE_COLLECTION = "activities_archive"
+ARCHIVE_SCAN_INDEX = "timestamp_id"
+
+
+class ActivityWriter:
+    """
+    Buffers activity docs and writes them to `activities` with insert_many.
+
+    mode="async": docs go into a bounded queue drained by a background thread,
+    flushed every `batch_size` docs or `flush_interval` seconds, whichever comes
+    first. A full queue drops the event (counted). mode="sync": each doc is
+    inserted inline, like the old _log_activity.
+    In both modes a failed write is appended to `spill_path` as JSON lines;
+    `flask replay-activities` loads them back.
+    """
+
+    def __init__(self, mode="async", batch_size=100, flush_interval=0.5, max_queue=10000, spill_path=None, logger=None):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.logger = logger
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0, "written": 0, "dropped": 0, "spilled": 0,
+            "flushes": 0, "flush_ms_total": 0.0, "flush_ms_max": 0.0,
+        }
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    # --- Producer side ---
+
+    def submit(self, doc):
+        if self.mode == "sync":
+            self._flush([doc])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(doc)
+            self._count(enqueued=1)
+        except queue.Full:
+            self._count(dropped=1)
+
+    def _ensure_started(self):
+        # Threads don't survive a fork (gunicorn --preload), so start once per process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="activity-writer", daemon=True)
+            self._thread.start()
+
+    # --- Writer thread ---
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._flush(self._next_batch())
+        # Drain whatever arrived before stop()
+        while True:
+            batch = self._next_batch(block=False)
+            if not batch:
+                break
+            self._flush(batch)
+
+    def _next_batch(self, block=True):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            mongo.db.activities.insert_many(batch, ordered=False)
+            self._count(written=len(batch))
+        except BulkWriteError as e:
+            # Unordered: everything but the reported docs made it in
+            failed = [batch[err["index"]] for err in e.details.get("writeErrors", [])]
+            self._count(written=len(batch) - len(failed))
+            self._spill(failed, e)
+        except Exception as e:
+            self._spill(batch, e)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.stats["flushes"] += 1
+            self.stats["flush_ms_total"] += elapsed_ms
+            self.stats["flush_ms_max"] = max(self.stats["flush_ms_max"], elapsed_ms)
+
+    def _spill(self, batch, error):
+        if self.logger:
+            self.logger.warning("Failed to write %d activities: %s", len(batch), error)
+        if not self.spill_path:
+            self._count(dropped=len(batch))
+            return
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for doc in batch:
+                    doc.pop("_id", None)  # insert_many may have assigned one
+                    f.write(json_util.dumps(doc) + "\n")
+            self._count(spilled=len(batch))
+        except OSError as e:
+            if self.logger:
+                self.logger.error("Could not spill activities to %s: %s", self.spill_path, e)
+            self._count(dropped=len(batch))
+
+    def stop(self, timeout=5.0):
+        """Flushes everything queued so far; registered with atexit."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._stop.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def snapshot_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["mode"] = self.mode
+        stats["queue_depth"] = self._queue.qsize()
+        stats["flush_ms_avg"] = round(stats["flush_ms_total"] / stats["flushes"], 3) if stats["flushes"] else None
+        stats["flush_ms_total"] = round(stats["flush_ms_total"], 3)
+        stats["flush_ms_max"] = round(stats["flush_ms_max"], 3)
+        return stats
+
+
+def replay_spilled(db, spill_path):
+    """Inserts spilled activities back into Mongo and truncates the file. Returns the count."""
+    if not os.path.exists(spill_path):
+        return 0
+    with open(spill_path, encoding="utf-8") as f:
+        docs = [json_util.loads(line) for line in f if line.strip()]
+    if docs:
+        db.activities.insert_many(docs, ordered=False)
+    open(spill_path, "w").close()
+    return len(docs)
+
+
+# --- Feed pagination ---
+# The feed is ordered by (timestamp, _id) descending; a cursor is the last
+# row's "<ISO timestamp>,<_id>", so the next page starts strictly after it.
+
+def encode_cursor(activity):
+    return f"{activity['timestamp'].isoformat()},{activity['_id']}"
+
+
+def parse_cursor(value):
+    """Returns (timestamp, ObjectId), or raises ValueError."""
+    timestamp, _, oid = (value or "").rpartition(",")
+    if not ObjectId.is_valid(oid):
+        raise ValueError("invalid cursor")
+    parsed = datetime.fromisoformat(timestamp)
+    # Stored timestamps come back naive (UTC)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed, ObjectId(oid)
+
+
+def activity_page(db, owner_oid, before=None, limit=100, projection=None):
+    """
+    Returns (activities, next cursor or None), newest first.
+    Served by the owner_timestamp_id index without an in-memory sort.
+    """
+    query = {"owner": owner_oid}
+    if before:
+        timestamp, oid = before
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": oid}},
+        ]
+    rows = list(db.activities.find(query, projection).sort([("timestamp", -1), ("_id", -1)]).limit(limit + 1))
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+
+# --- Retention ---
+
+def apply_retention(db, days, mode="ttl", batch_size=1000):
+    """
+    Enforces ACTIVITY_RETENTION_DAYS. mode="ttl" (re)creates a TTL index so the
+    server expires old entries itself; mode="archive" moves entries older than
+    the cutoff into a zstd-compressed activities_archive collection (run it
+    periodically, e.g. from cron). Returns the number of entries moved.
+    """
+    if mode == "ttl":
+        seconds = int(days * 86400)
+        existing = db.activities.index_information().get(TTL_INDEX_NAME)
+        if existing and existing.get("expireAfterSeconds") != seconds:
+            db.command("collMod", "activities", index={"name": TTL_INDEX_NAME, "expireAfterSeconds": seconds})
+        elif not existing:
+            db.activities.create_index([("timestamp", ASCENDING)], name=TTL_INDEX_NAME, expireAfterSeconds=seconds)
+        return 0
+
+    if mode != "archive":
+        raise ValueError(f"Unknown retention mode: {mode}")
+    if TTL_INDEX_NAME in db.activities.index_information():
+        # A TTL index would delete entries before they could be archived
+        db.activities.drop_index(TTL_INDEX_NAME)
+    db.activities.create_indexes([m for m in INDEXES["activities"] if m.document["name"] == ARCHIVE_SCAN_INDEX])
+    try:
+        db.create_collection(ARCHIVE_COLLECTION, storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}})
+    except (CollectionInvalid, OperationFailure):
+        pass  # Already exists (or the storage engine ignores the option)
+    archive = db[ARCHIVE_COLLECTION].with_options(write_concern=WriteConcern("majority"))
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    moved = 0
+    while True:
+        # Oldest first along (timestamp, _id); archived rows leave the front of the index
+        batch = list(
+            db.activities.find({"timestamp": {"$lt": cutoff}})
+            .sort([("timestamp", ASCENDING), ("_id", ASCENDING)])
+            .hint(ARCHIVE_SCAN_INDEX)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+        ids = [doc["_id"] for doc in batch]
+        try:
+            archive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Duplicates are rows copied by an interrupted earlier run
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        # Only rows read back from the archive are removed
+        archived = [doc["_id"] for doc in archive.find({"_id": {"$in": ids}}, {"_id": 1})]
+        if len(archived) != len(ids):
+            raise RuntimeError(f"{len(ids) - len(archived)} activities were not archived; nothing was deleted")
+        db.activities.delete_many({"_id": {"$in": archived}})
+        moved += len(batch)
+    return moved
+
+
+def init_activity_writer(app):
+    writer = ActivityWriter(
+        mode=app.config["ACTIVITY_LOG_MODE"],
+        batch_size=app.config["ACTIVITY_LOG_BATCH_SIZE"],
+        flush_interval=app.config["ACTIVITY_LOG_FLUSH_INTERVAL"],
+        max_queue=app.config["ACTIVITY_LOG_MAX_QUEUE"],
+        spill_path=app.config["ACTIVITY_LOG_SPILL_PATH"],
+        logger=app.logger,
+    )
+    app.extensions["activity_writer"] = writer
+    atexit.register(writer.stop)
+
+
+def activity_writer() -> ActivityWriter:
+    return current_app.extensions["activity_writer"]
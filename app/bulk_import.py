@@ -0,0 +1,220 @@
+# app/bulk_import.py
+import csv
+import io
+import os
+import time
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from .catalog import SHAPE_DIMENSIONS, COMPONENT_FIELDS, build_product, build_packaging
+from .packagings import PACKAGING_LEVELS
+from .rollups import rollups_enabled, rebuild_rollups
+from .sales import new_sale
+
+try:
+    import openpyxl
+except ImportError:  # Optional: only needed for .xlsx files
+    openpyxl = None
+
+# Bulk import of products, packagings or sales from CSV/XLSX.
+#
+# Rows are streamed and written in insert_many batches, so memory stays flat
+# however long the file is; only the owner's code -> id lookups are held.
+# Column names (first row, case-insensitive):
+#   products:   product_code, material, secondary_product_code, product_category,
+#               product_description, product_shape, length, width, height, radius,
+#               volume, product_volume, primary_package, secondary_package,
+#               tertiary_package (package codes, linked both ways)
+#   packagings: level, package_code, recyclability, package_shape, the dimension
+#               columns, quantity_primary_in_secondary_unit,
+#               quantity_secondary_in_tertiary_unit, and per component the
+#               COMPONENT_FIELDS columns, either bare (one component) or
+#               suffixed _1, _2, ...
+#   sales:      product_code, year, month, quantity, sku_price
+
+IMPORT_KINDS = ("products", "packagings", "sales")
+MAX_REPORTED_ERRORS = 1000
+
+
+# --- Readers ---
+
+def _cell(value):
+    """Spreadsheet cell -> the string a form would have posted."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _normalize(header):
+    return [(name or "").strip().lower() for name in header]
+
+
+def read_rows(stream, filename):
+    """
+    Yields (row number, {column: value}) from a binary CSV or XLSX stream.
+    Row numbers match the spreadsheet: the header is row 1.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".xlsx":
+        if openpyxl is None:
+            raise ValueError("Reading .xlsx files requires openpyxl (pip install openpyxl)")
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = _normalize(next(rows, None) or [])
+            for number, values in enumerate(rows, start=2):
+                cells = [_cell(v) for v in values]
+                if any(cells):
+                    yield number, dict(zip(header, cells))
+        finally:
+            workbook.close()
+    elif extension in (".csv", ".txt"):
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+        reader = csv.reader(text)
+        header = _normalize(next(reader, None) or [])
+        for values in reader:
+            cells = [v.strip() for v in values]
+            if any(cells):
+                yield reader.line_num, dict(zip(header, cells))
+        text.detach()  # Leave the caller's stream open
+    else:
+        raise ValueError("Unsupported file type (expected .csv or .xlsx)")
+
+
+# --- Row -> document ---
+
+def _component_columns(row):
+    """Groups the component columns of a packaging row by suffix."""
+    groups = {}
+    for column, value in row.items():
+        for field in COMPONENT_FIELDS:
+            if column == field:
+                groups.setdefault(0, {})[field] = value
+            elif column.startswith(field + "_") and column[len(field) + 1:].isdigit():
+                groups.setdefault(int(column[len(field) + 1:]), {})[field] = value
+    return [groups[key] for key in sorted(groups)]
+
+
+class _Importer:
+    def __init__(self, db, owner_oid, kind):
+        self.db = db
+        self.owner = owner_oid
+        self.kind = kind
+        self.created_at = datetime.now(timezone.utc)
+        if kind == "products":
+            # (level, package_code) -> id; the first one wins for duplicate codes
+            self.packages = {}
+            for pkg in self.db.packagings.find({"owner": owner_oid}, {"level": 1, "package_code": 1}).sort("_id", 1):
+                self.packages.setdefault((pkg.get("level"), pkg.get("package_code")), pkg["_id"])
+        elif kind == "sales":
+            self.products = {}
+            for product in self.db.products.find({"owner": owner_oid}, {"product_code": 1}).sort("_id", 1):
+                self.products.setdefault(product.get("product_code"), product["_id"])
+
+    def build(self, row):
+        if self.kind == "products":
+            shape = row.get("product_shape")
+            product = build_product(self.owner, {
+                **row,
+                "dimensions": {dim: row.get(dim) for dim in SHAPE_DIMENSIONS.get(shape, ())},
+            }, self.created_at)
+            for level in PACKAGING_LEVELS:
+                key = f"{level.lower()}_package"
+                code = row.get(key)
+                if code:
+                    package_oid = self.packages.get((level, code))
+                    if package_oid is None:
+                        raise ValueError(f"Unknown {level} packaging code: {code}")
+                    product["connections"][key] = str(package_oid)
+            return product
+
+        if self.kind == "packagings":
+            if row.get("level"):
+                row["level"] = row["level"].capitalize()
+            shape = row.get("package_shape")
+            return build_packaging(self.owner, {
+                **row,
+                "dimensions": {dim: row.get(dim) for dim in SHAPE_DIMENSIONS.get(shape, ())},
+                "components": _component_columns(row),
+            }, self.created_at)
+
+        # Same checks as add_product_sales
+        if not all([row.get("year"), row.get("month"), row.get("quantity")]):
+            raise ValueError("Year, Month, and Quantity are required")
+        product_oid = self.products.get(row.get("product_code"))
+        if product_oid is None:
+            raise ValueError(f"Unknown product code: {row.get('product_code')}")
+        return new_sale(self.owner, product_oid, row)
+
+    def write(self, docs):
+        """Inserts one batch; returns the positions that failed with their messages."""
+        failed = {}
+        try:
+            self.db[self.kind].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                failed[err["index"]] = err.get("errmsg", "Write failed")
+        if self.kind == "products":
+            self._link_packagings([doc for i, doc in enumerate(docs) if i not in failed])
+        return failed
+
+    def _link_packagings(self, products):
+        """The packaging side of the product -> packaging links, one $push per packaging."""
+        links = {}
+        for product in products:
+            link = {"_id": str(product["_id"]), "product_code": product["product_code"]}
+            for package_id in product["connections"].values():
+                if package_id:
+                    links.setdefault(package_id, []).append(link)
+        if links:
+            self.db.packagings.bulk_write([
+                UpdateOne({"_id": ObjectId(package_id), "owner": self.owner},
+                          {"$push": {"connections": {"$each": package_links}}})
+                for package_id, package_links in links.items()
+            ], ordered=False)
+
+
+def import_rows(db, owner_oid, kind, rows, batch_size=1000):
+    """
+    Validates and inserts (row number, row) pairs for one owner.
+    Returns {"kind", "rows", "inserted", "failed", "errors": [{"row", "message"}],
+    "duration_ms"}; at most MAX_REPORTED_ERRORS errors are listed.
+    """
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    started = time.perf_counter()
+    importer = _Importer(db, owner_oid, kind)
+    report = {"kind": kind, "rows": 0, "inserted": 0, "failed": 0, "errors": []}
+
+    def fail(number, message):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "message": message})
+
+    def flush(batch):
+        failed = importer.write([doc for _, doc in batch])
+        for index, message in sorted(failed.items()):
+            fail(batch[index][0], message)
+        report["inserted"] += len(batch) - len(failed)
+
+    batch = []
+    for number, row in rows:
+        report["rows"] += 1
+        try:
+            batch.append((number, importer.build(row)))
+        except ValueError as e:
+            fail(number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    if kind == "sales" and report["inserted"] and rollups_enabled():
+        rebuild_rollups(db, owner_oid)
+    report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
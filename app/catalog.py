@@ -0,0 +1,169 @@
+# app/catalog.py
+import math
+from datetime import datetime, timezone
+from .packagings import PACKAGING_LEVELS
+from .utils import _safe_float
+
+# Product/packaging document builders shared by the add_*/update_* routes and the bulk import.
+
+# Dimension inputs per shape. The modals name some of them differently
+# (cylHeight, cylRadius, sphRadius); FORM_DIMENSION_FIELDS maps those.
+SHAPE_DIMENSIONS = {
+    "rectangular": ("length", "width", "height"),
+    "cylinder": ("height", "radius"),
+    "sphere": ("radius",),
+    "other": ("volume",),
+}
+FORM_DIMENSION_FIELDS = {
+    "cylinder": {"height": "cylHeight", "radius": "cylRadius"},
+    "sphere": {"radius": "sphRadius"},
+}
+
+# Per-component packaging fields; the numeric ones go through _safe_float
+COMPONENT_FIELDS = (
+    "package_component", "material", "weight_grams", "recycled_content",
+    "thickness_microns", "adhesive_type", "food_contact", "coating"
+)
+NUMERIC_COMPONENT_FIELDS = ("weight_grams", "recycled_content", "thickness_microns")
+# Modal form list names, in COMPONENT_FIELDS order
+FORM_COMPONENT_FIELDS = (
+    "packageComponent[]", "material[]", "weightGrams[]", "recycledContent[]",
+    "thicknessMicrons[]", "adhesiveType[]", "foodContact[]", "coatingType[]"
+)
+
+
+def calculate_volume(shape, dimensions):
+    """Return volume in cm^3 for supported shapes, or None if inputs are incomplete."""
+    if shape == 'rectangular':
+        length = _safe_float(dimensions.get('length'))
+        width = _safe_float(dimensions.get('width'))
+        height = _safe_float(dimensions.get('height'))
+        if None not in (length, width, height):
+            return length * width * height
+    elif shape == 'cylinder':
+        radius = _safe_float(dimensions.get('radius'))
+        height = _safe_float(dimensions.get('height'))
+        if None not in (radius, height):
+            return math.pi * (radius ** 2) * height
+    elif shape == 'sphere':
+        radius = _safe_float(dimensions.get('radius'))
+        if radius is not None:
+            return (4 / 3) * math.pi * (radius ** 3)
+    elif shape == 'other':
+        volume = _safe_float(dimensions.get('volume'))
+        if volume is not None:
+            return volume
+    return None
+
+
+def form_dimensions(form, shape):
+    """Dimension values for `shape` from a modal form (or any mapping with .get)."""
+    names = FORM_DIMENSION_FIELDS.get(shape, {})
+    return {dim: form.get(names.get(dim, dim)) for dim in SHAPE_DIMENSIONS.get(shape, ())}
+
+
+def form_components(form):
+    """Raw component dicts from the packaging modal's parallel `...[]` lists."""
+    columns = [form.getlist(name) for name in FORM_COMPONENT_FIELDS]
+    return [
+        {field: column[i] for field, column in zip(COMPONENT_FIELDS, columns)}
+        for i in range(len(columns[0]))
+    ]
+
+
+def build_product(owner_oid, data, created_at=None):
+    """
+    New product document from add_product-style input: product_code,
+    secondary_product_code, product_category, product_description, material,
+    product_shape, dimensions, product_volume. Raises ValueError if invalid.
+    """
+    product_code = data.get('product_code')
+    product_material = data.get('material')
+    if not product_code or not product_material:
+        raise ValueError('Product Code and Material are required.')
+
+    product = {
+        'product_code': product_code,
+        'secondary_product_code': data.get('secondary_product_code'),
+        'product_category': data.get('product_category'),
+        'product_description': data.get('product_description'),
+        'product_material': product_material,
+        'owner': owner_oid,
+        'creation_time': created_at or datetime.now(timezone.utc),
+        'dimensions': {},
+        'connections': {
+            'primary_package': '',
+            'secondary_package': '',
+            'tertiary_package': ''
+        }
+    }
+
+    if product_material == 'solid':
+        product_shape = data.get('product_shape')
+        dimensions = data.get('dimensions') or {}
+        product['product_shape'] = product_shape
+        product['dimensions'] = dimensions
+        product['volume_cm3'] = calculate_volume(product_shape, dimensions)
+    elif product_material == 'liquid/gas':
+        product['product_volume'] = data.get('product_volume')
+    return product
+
+
+def build_packaging(owner_oid, data, created_at=None):
+    """
+    New packaging document from add_packaging-style input: level, package_code,
+    recyclability, package_shape, dimensions, components (raw COMPONENT_FIELDS
+    dicts) and the level's quantity field. Raises ValueError if invalid.
+    """
+    level = data.get('level')
+    package_code = data.get('package_code')
+    if not all([level, package_code]):
+        raise ValueError('Level and Code are required.')
+    if level not in PACKAGING_LEVELS:
+        raise ValueError(f'Invalid packaging level: {level}')
+
+    materials_list = []
+    for component in data.get('components') or []:
+        if not component.get('package_component'):
+            continue  # Skip empty component rows
+        materials_list.append({
+            field: _safe_float(component.get(field)) if field in NUMERIC_COMPONENT_FIELDS else component.get(field)
+            for field in COMPONENT_FIELDS
+        })
+
+    package_shape = data.get('package_shape')
+    dimensions = data.get('dimensions') or {}
+    doc = {
+        'package_code': package_code,
+        'package_shape': package_shape,
+        'dimensions': dimensions,
+        'materials': materials_list,
+        'recyclability': data.get('recyclability'),
+        'volume_cm3': calculate_volume(package_shape, dimensions),
+        'level': level,
+        'owner': owner_oid,
+        'creation_time': created_at or datetime.now(timezone.utc)
+    }
+    if level == 'Secondary':
+        doc['quantity_primary_in_secondary_unit'] = _safe_float(data.get('quantity_primary_in_secondary_unit'))
+    elif level == 'Tertiary':
+        doc['quantity_secondary_in_tertiary_unit'] = _safe_float(data.get('quantity_secondary_in_tertiary_unit'))
+    return doc
+
+
+# Set on every product edit so switching material clears the other kind's fields
+PRODUCT_EDIT_DEFAULTS = {'dimensions': {}, 'volume_cm3': None, 'product_volume': None, 'product_shape': None}
+
+
+def product_update(data):
+    """$set document for an edit: build_product's fields without owner, creation_time and connections."""
+    product = build_product(None, data)
+    update = dict(PRODUCT_EDIT_DEFAULTS)
+    update.update({k: v for k, v in product.items() if k not in ('owner', 'creation_time', 'connections')})
+    return update
+
+
+def packaging_update(data):
+    """$set document for an edit: build_packaging's fields without owner, creation_time and level."""
+    doc = build_packaging(None, data)
+    return {k: v for k, v in doc.items() if k not in ('owner', 'creation_time', 'level')}
@@ -0,0 +1,381 @@
+# app/cli.py
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+import click
+from bson import json_util
+from bson.objectid import ObjectId
+from flask import current_app
+from flask.cli import with_appcontext
+from . import mongo
+from .indexes import ensure_indexes, check_indexes
+from .dashboard_metrics import compute_metrics_python, compute_metrics_pipeline, same_metrics, LEVELS
+from .rollups import rebuild_rollups, rollups_enabled
+from .sales import with_sales, migrate_embedded_sales, sale_period
+from .packagings import migrate_legacy_packagings
+from .activity_log import replay_spilled, apply_retention, activity_writer
+from .bulk_import import IMPORT_KINDS, import_rows, read_rows
+from .export import EXPORT_KINDS, EXPORT_FORMATS, export_lines
+from .data_version import bump_version
+from .recyclability import RULES_PATH, load_rules, regrade_all, check_forms
+from .compression import precompress_static
+from .json_provider import JSON_PROVIDERS
+from .warmup import cache_dir, compile_templates
+from . import dashboard_numpy
+
+
+def _print_index_report(report):
+    for key in ("missing", "changed", "undeclared", "unused"):
+        for coll_name, name in report[key]:
+            click.echo(f"{key:<10} {coll_name}.{name}")
+    if not any(report.values()):
+        click.echo("All declared indexes are present.")
+
+
+@click.command("ensure-indexes")
+@click.option("--check", is_flag=True, help="Only report missing/changed/undeclared/unused indexes.")
+@with_appcontext
+def ensure_indexes_command(check):
+    """Create (or verify) the indexes declared in app/indexes.py."""
+    if not check:
+        for coll_name, names in ensure_indexes(mongo.db).items():
+            click.echo(f"{coll_name}: {', '.join(names)}")
+    _print_index_report(check_indexes(mongo.db))
+
+
+def _owner_ids(owner):
+    if owner:
+        return [ObjectId(owner)]
+    return [u["_id"] for u in mongo.db.users.find({}, {"_id": 1})]
+
+
+def _python_metrics(owner_oid):
+    """Loads an owner's products (with sales) and packaging map the way the Python engine expects."""
+    products = with_sales(mongo.db, owner_oid, list(mongo.db.products.find({"owner": owner_oid}, {"connections": 1})), all_products=True)
+    packages = {str(pkg["_id"]): pkg for pkg in mongo.db.packagings.find({"owner": owner_oid})}
+    return products, packages
+
+
+@click.command("compare-dashboard-engines")
+@click.option("--owner", help="User id to check (default: every user).")
+@click.option("--engine", type=click.Choice(["pipeline", "numpy"]), default="pipeline", show_default=True)
+@with_appcontext
+def compare_dashboard_engines_command(owner, engine):
+    """Check that an engine returns the same dashboard metrics as the Python engine."""
+    if engine == "numpy" and not dashboard_numpy.available():
+        raise click.ClickException("numpy is not installed.")
+    mismatches = 0
+    for owner_oid in _owner_ids(owner):
+        products, packages = _python_metrics(owner_oid)
+        expected = compute_metrics_python(products, packages)
+        if engine == "numpy":
+            actual = dashboard_numpy.load_and_compute(mongo.db, owner_oid, products, packages, all_products=True)
+        else:
+            actual = compute_metrics_pipeline(mongo.db, owner_oid)
+        if not same_metrics(expected, actual):
+            mismatches += 1
+            click.echo(f"MISMATCH {owner_oid}\n  python: {expected}\n  {engine}: {actual}")
+    click.echo(f"{mismatches} owner(s) differ.")
+    if mismatches:
+        raise SystemExit(1)
+
+
+@click.command("rebuild-rollups")
+@click.option("--owner", help="User id to rebuild (default: every user).")
+@with_appcontext
+def rebuild_rollups_command(owner):
+    """Recompute packaging_rollups from the raw sales."""
+    for owner_oid in _owner_ids(owner):
+        rows = rebuild_rollups(mongo.db, owner_oid)
+        bump_version(mongo.db, owner_oid)  # Cached dashboard metrics still carry the drifted numbers
+        click.echo(f"{owner_oid}: {rows} rollup rows")
+
+
+@click.command("migrate-sales")
+@click.option("--owner", help="User id to migrate (default: every user).")
+@with_appcontext
+def migrate_sales_command(owner):
+    """Move embedded products.sales arrays into the sales collection."""
+    migrated, skipped = migrate_embedded_sales(mongo.db, ObjectId(owner) if owner else None)
+    for owner_oid in _owner_ids(owner):
+        bump_version(mongo.db, owner_oid)
+    click.echo(f"{migrated} product(s) migrated, {skipped} skipped (changed during copy; re-run).")
+
+
+@click.command("migrate-packagings")
+@click.option("--owner", help="User id to migrate (default: every user).")
+@with_appcontext
+def migrate_packagings_command(owner):
+    """Move the per-level packaging collections into the single `packagings` collection."""
+    moved = migrate_legacy_packagings(mongo.db, ObjectId(owner) if owner else None)
+    for owner_oid in _owner_ids(owner):
+        bump_version(mongo.db, owner_oid)
+    for level, count in moved.items():
+        click.echo(f"{level}: {count} moved")
+
+
+@click.command("import-data")
+@click.argument("kind", type=click.Choice(IMPORT_KINDS))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--owner", required=True, help="User id the rows belong to.")
+@click.option("--batch-size", default=1000, show_default=True)
+@with_appcontext
+def import_data_command(kind, path, owner, batch_size):
+    """Bulk import products, packagings or sales from a CSV/XLSX file."""
+    owner_oid = ObjectId(owner)
+    with open(path, "rb") as f:
+        report = import_rows(mongo.db, owner_oid, kind, read_rows(f, path), batch_size=batch_size)
+    bump_version(mongo.db, owner_oid)
+    for error in report["errors"]:
+        click.echo(f"row {error['row']}: {error['message']}", err=True)
+    click.echo(f"{report['rows']} rows, {report['inserted']} inserted, {report['failed']} failed "
+               f"in {report['duration_ms']:.0f} ms")
+
+    filename = os.path.basename(path)
+    activity_writer().submit({
+        "owner": owner_oid,
+        "type": f"{kind}_import",
+        "description": f"Imported {report['inserted']} {kind} from {filename}"
+                       + (f" ({report['failed']} rows failed)" if report["failed"] else ""),
+        "timestamp": datetime.now(timezone.utc),
+    })
+    activity_writer().stop()
+
+
+@click.command("export-data")
+@click.argument("kind", type=click.Choice(EXPORT_KINDS))
+@click.option("--owner", required=True, help="User id to export.")
+@click.option("--format", "fmt", type=click.Choice(list(EXPORT_FORMATS)), default="ndjson", show_default=True)
+@click.option("--output", type=click.Path(dir_okay=False, writable=True), help="File to write (default: stdout).")
+@with_appcontext
+def export_data_command(kind, owner, fmt, output):
+    """Stream a tenant's products, packagings, partners or sales as NDJSON or CSV."""
+    lines = export_lines(mongo.db, ObjectId(owner), kind, fmt, current_app.config["EXPORT_BATCH_SIZE"])
+    with click.open_file(output or "-", "w", encoding="utf-8") as f:
+        for chunk in lines:
+            f.write(chunk)
+
+
+@click.command("replay-activities")
+@with_appcontext
+def replay_activities_command():
+    """Insert activities spilled to ACTIVITY_LOG_SPILL_PATH while Mongo was unreachable."""
+    count = replay_spilled(mongo.db, current_app.config["ACTIVITY_LOG_SPILL_PATH"])
+    click.echo(f"{count} activities replayed.")
+
+
+@click.command("apply-activity-retention")
+@with_appcontext
+def apply_activity_retention_command():
+    """Apply ACTIVITY_RETENTION_DAYS / ACTIVITY_RETENTION_MODE (run periodically in archive mode)."""
+    days = current_app.config["ACTIVITY_RETENTION_DAYS"]
+    mode = current_app.config["ACTIVITY_RETENTION_MODE"]
+    if days <= 0:
+        click.echo("ACTIVITY_RETENTION_DAYS is not set; activities are kept forever.")
+        return
+    moved = apply_retention(mongo.db, days, mode)
+    if mode == "ttl":
+        click.echo(f"TTL index set: activities expire after {days:g} days.")
+    else:
+        click.echo(f"{moved} activities older than {days:g} days moved to the archive.")
+
+
+@click.command("regrade-recyclability")
+@click.option("--owner", help="User id to regrade (default: every user).")
+@click.option("--workers", default=4, show_default=True, help="Owners regraded in parallel.")
+@with_appcontext
+def regrade_recyclability_command(owner, workers):
+    """Re-evaluate stored recyclability answers against app/recyclability_rules.json."""
+    rules = load_rules()
+    rebuild = rollups_enabled()
+
+    def done(owner_oid, report):
+        # Runs on the worker thread, so the owner's rollups are rebuilt in parallel too
+        if rebuild and report["changed"]:
+            rebuild_rollups(mongo.db, owner_oid)
+
+    started = time.perf_counter()
+    reports = regrade_all(mongo.db, _owner_ids(owner), workers=workers, rules=rules, on_done=done)
+    for owner_oid, report in reports.items():
+        if report["checked"]:
+            click.echo(f"{owner_oid}: {report['checked']} checked, {report['changed']} changed, "
+                       f"{report['invalid']} invalid")
+    total = {key: sum(r[key] for r in reports.values()) for key in ("checked", "changed", "invalid")}
+    click.echo(f"{len(reports)} owner(s), {total['checked']} packaging(s) checked, {total['changed']} changed, "
+               f"{total['invalid']} invalid (rules v{rules.version}) in {time.perf_counter() - started:.1f} s")
+
+
+@click.command("check-recyclability-rules")
+def check_recyclability_rules_command():
+    """Compare app/recyclability_rules.json with the questionnaire templates."""
+    with open(RULES_PATH, encoding="utf-8") as f:
+        data = json.load(f)
+    load_rules(RULES_PATH)  # Fails on rules that don't compile
+    problems = check_forms(data)
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise SystemExit(1)
+    click.echo(f"{len(data['forms'])} forms match the rules.")
+
+
+@click.command("compress-static")
+@click.option("--force", is_flag=True, help="Rewrite siblings that are up to date")
+@with_appcontext
+def compress_static_command(force):
+    """Write .br/.zst/.gz siblings of the static files (for COMPRESS_STATIC=precompressed)."""
+    config = current_app.config
+    written = 0
+    for path, encoding, size, compressed in precompress_static(
+        current_app.static_folder, config["COMPRESS_LEVELS"], config["COMPRESS_MIN_SIZE"],
+        [name.strip() for name in config["COMPRESS_ALGORITHMS"].split(",")], force,
+    ):
+        written += 1
+        click.echo(f"{os.path.relpath(path, current_app.static_folder)} [{encoding}]: {size} -> {compressed} bytes")
+    click.echo(f"{written} files written.")
+
+
+def _synthetic_tenant(n_products, n_months, seed):
+    """Random catalog for bench-dashboard: every product sells every month."""
+    rng = random.Random(seed)
+    grades = ["A", "B", "C", "D", "N/A"]
+    packages = {}
+    for level in LEVELS:
+        for i in range(50):
+            packages[f"{level}-{i}"] = {
+                "level": level,
+                "recyclability": rng.choice(grades),
+                "materials": [{"weight_grams": str(rng.randint(1, 500))}],
+                "quantity_primary_in_secondary_unit": rng.randint(1, 24),
+                "quantity_secondary_in_tertiary_unit": rng.randint(1, 40),
+            }
+    products, sales = [], []
+    for j in range(n_products):
+        product = {"_id": j, "connections": {
+            f"{level.lower()}_package": f"{level}-{rng.randrange(50)}" for level in LEVELS
+        }}
+        product_sales = []
+        for m in range(n_months):
+            year, month = 2020 + m // 12, m % 12 + 1
+            sale = {"product": j, "year": str(year), "month": str(month),
+                    "quantity": str(rng.randint(0, 5000)), "period": sale_period(year, month)}
+            product_sales.append(sale)
+            sales.append(sale)
+        products.append({**product, "sales": product_sales})
+    return products, packages, sales
+
+
+def _best_of(repeat, fn):
+    """Runs fn `repeat` times; returns its last result and the fastest run in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+@click.command("bench-dashboard")
+@click.option("--products", "n_products", default=10000, show_default=True)
+@click.option("--months", "n_months", default=60, show_default=True)
+@click.option("--repeat", default=3, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+def bench_dashboard_command(n_products, n_months, repeat, seed):
+    """Time the Python and numpy dashboard engines on synthetic in-memory data."""
+    if not dashboard_numpy.available():
+        raise click.ClickException("numpy is not installed.")
+    products, packages, sales = _synthetic_tenant(n_products, n_months, seed)
+    click.echo(f"{n_products} products x {n_months} months = {len(sales)} sales")
+
+    expected, python_s = _best_of(repeat, lambda: compute_metrics_python(products, packages))
+    columns, load_s = _best_of(repeat, lambda: dashboard_numpy.sales_columns(sales, {p["_id"]: j for j, p in enumerate(products)}))
+    actual, numpy_s = _best_of(repeat, lambda: dashboard_numpy.compute_metrics_numpy(products, packages, columns))
+
+    click.echo(f"python:              {python_s * 1000:9.1f} ms")
+    click.echo(f"numpy (columns):     {load_s * 1000:9.1f} ms")
+    click.echo(f"numpy (compute):     {numpy_s * 1000:9.1f} ms")
+    click.echo(f"speed-up (compute):  {python_s / numpy_s:9.1f}x")
+    if not same_metrics(expected, actual):
+        raise click.ClickException("Engines disagree on the synthetic data.")
+    click.echo("Results match.")
+
+
+@click.command("compile-templates")
+@with_appcontext
+def compile_templates_command():
+    """Compile every template into the Jinja bytecode cache (run at deploy time)."""
+    directory = cache_dir(current_app)
+    if not directory:
+        raise click.ClickException("Set JINJA_CACHE_DIR (or WARMUP=1) to use the bytecode cache.")
+    started = time.perf_counter()
+    count = compile_templates(current_app)
+    click.echo(f"{count} templates compiled into {directory} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+
+def _synthetic_documents(n, seed):
+    """Product-like Mongo documents for bench-json."""
+    rng = random.Random(seed)
+    owner = ObjectId()
+    return [{
+        "_id": ObjectId(),
+        "owner": owner,
+        "product_code": f"P{j:06d}",
+        "product_category": rng.choice(["Food", "Drinks", "Care"]),
+        "connections": {f"{level.lower()}_package": str(ObjectId()) for level in LEVELS},
+        "creation_time": datetime(2024, 1, 1) + timedelta(seconds=rng.randrange(10 ** 8)),
+        "materials": [{"material": "glass", "weight_grams": rng.random() * 500}],
+    } for j in range(n)]
+
+
+@click.command("bench-json")
+@click.option("--docs", "n_docs", default=20000, show_default=True)
+@click.option("--repeat", default=5, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@with_appcontext
+def bench_json_command(n_docs, repeat, seed):
+    """Time the app.json providers on a synthetic list endpoint against per-document str() conversion."""
+    docs = _synthetic_documents(n_docs, seed)
+    app = current_app._get_current_object()
+
+    def converted():
+        # What the endpoints did by hand for Flask-PyMongo's json_util provider
+        rows = []
+        for doc in docs:
+            row = dict(doc, _id=str(doc["_id"]), owner=str(doc["owner"]))
+            row["creation_time"] = row["creation_time"].isoformat()
+            rows.append(row)
+        return json_util.dumps(rows)
+
+    expected, baseline_s = _best_of(repeat, converted)
+    click.echo(f"{n_docs} documents")
+    click.echo(f"str() + json_util:  {baseline_s * 1000:9.1f} ms")
+    for name, provider_class in JSON_PROVIDERS.items():
+        provider = provider_class(app)
+        with app.test_request_context():
+            body, took = _best_of(repeat, lambda: provider.response(docs).get_data())
+        click.echo(f"{name + ':':19s} {took * 1000:9.1f} ms ({baseline_s / took:.1f}x)")
+        if json.loads(body) != json.loads(expected):
+            raise click.ClickException(f"{name} output differs from the converted documents.")
+    if "orjson" not in JSON_PROVIDERS:
+        click.echo("orjson is not installed.")
+    click.echo("Results match.")
+
+
+def register_cli(app):
+    app.cli.add_command(ensure_indexes_command)
+    app.cli.add_command(compare_dashboard_engines_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(migrate_sales_command)
+    app.cli.add_command(migrate_packagings_command)
+    app.cli.add_command(import_data_command)
+    app.cli.add_command(export_data_command)
+    app.cli.add_command(replay_activities_command)
+    app.cli.add_command(apply_activity_retention_command)
+    app.cli.add_command(bench_dashboard_command)
+    app.cli.add_command(regrade_recyclability_command)
+    app.cli.add_command(check_recyclability_rules_command)
+    app.cli.add_command(compress_static_command)
+    app.cli.add_command(bench_json_command)
+    app.cli.add_command(compile_templates_command)
@@ -0,0 +1,312 @@
+# app/compression.py
+import mimetypes
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app, request
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install zstandard
+    zstandard = None
+
+# Response compression, applied in an app-wide after_request hook.
+#
+# The encoding is negotiated from Accept-Encoding among the codecs in
+# COMPRESS_ALGORITHMS that are importable here (gzip always; br and zstd when
+# the brotli / zstandard packages are installed). Only 200 responses whose
+# mimetype has a level in COMPRESS_LEVELS are compressed, and buffered bodies
+# only from COMPRESS_MIN_SIZE bytes. Streamed responses (exports, streamed
+# templates) are compressed chunk by chunk with a flush after each chunk, so
+# the client keeps receiving bytes as they are produced.
+#
+# Static files are either compressed on first request and kept in memory
+# ("dynamic"), or served from .br/.zst/.gz siblings written by
+# `flask compress-static` ("precompressed"; files without a fresh sibling
+# fall back to "dynamic").
+#
+# A compressed response gets a weak ETag (as nginx does), so conditional
+# requests keep matching the ETag computed from the uncompressed body.
+
+DEFAULT_LEVELS = {
+    "text/html": 6,
+    "text/css": 9,
+    "text/javascript": 9,
+    "application/javascript": 9,
+    "application/json": 6,
+    "application/x-ndjson": 6,
+    "text/csv": 6,
+    "text/plain": 6,
+    "image/svg+xml": 9,
+}
+
+# Suffix of the precompressed siblings; the levels are the codecs' slow, small settings
+STATIC_SUFFIXES = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+STATIC_LEVELS = {"br": 11, "zstd": 19, "gzip": 9}
+
+
+# --- Codecs ---
+# One interface over the three libraries: compress() / flush() mid-stream,
+# finish() at the end. Levels are the codec's own scale (gzip 1-9, br 0-11, zstd 1-22).
+
+class _Gzip:
+    def __init__(self, level):
+        self._obj = zlib.compressobj(min(level, 9), zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+CODECS = {"gzip": _Gzip}
+if brotli is not None:
+    CODECS["br"] = _Brotli
+if zstandard is not None:
+    CODECS["zstd"] = _Zstd
+
+
+def compress(data, encoding, level):
+    codec = CODECS[encoding](level)
+    return codec.compress(data) + codec.finish()
+
+
+def _compress_stream(chunks, encoding, level, charset="utf-8"):
+    codec = CODECS[encoding](level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            out = codec.compress(chunk) + codec.flush()
+            if out:
+                yield out
+        yield codec.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+# --- Config ---
+
+def parse_levels(spec):
+    """'text/html:6,application/json:4' -> {mimetype: level}; level 0 turns a type off."""
+    levels = {}
+    for item in spec.split(","):
+        if item.strip():
+            mimetype, _, level = item.strip().rpartition(":")
+            levels[mimetype.strip().lower()] = int(level)
+    return levels
+
+
+class Compressor:
+    """The negotiated compression for one app, with a small LRU of compressed static files."""
+
+    def __init__(self, algorithms, levels, min_size=500, static_mode="dynamic", static_folder=None, static_cache_size=128):
+        self.algorithms = [name for name in algorithms if name in CODECS]
+        self.levels = levels
+        self.min_size = min_size
+        self.static_mode = static_mode
+        self.static_folder = static_folder
+        self.static_cache_size = static_cache_size
+        self._static = OrderedDict()  # (path, mtime, encoding) -> compressed bytes
+        self._lock = threading.Lock()
+        self.stats = {"compressed": 0, "streamed": 0, "precompressed": 0, "skipped": 0,
+                      "bytes_in": 0, "bytes_out": 0, "static_hits": 0, "static_misses": 0}
+        self.encodings = dict.fromkeys(self.algorithms, 0)
+
+    def level_for(self, mimetype):
+        return self.levels.get((mimetype or "").lower(), 0)
+
+    def negotiate(self):
+        """The best encoding both sides support, or None."""
+        if not self.algorithms:
+            return None
+        encoding = request.accept_encodings.best_match(self.algorithms)
+        return encoding if encoding in self.algorithms else None
+
+    def _count(self, key, encoding=None, bytes_in=0, bytes_out=0):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats["bytes_in"] += bytes_in
+            self.stats["bytes_out"] += bytes_out
+            if encoding:
+                self.encodings[encoding] += 1
+
+    def process(self, response):
+        level = self.level_for(response.mimetype)
+        if not level or response.status_code != 200 or "Content-Encoding" in response.headers:
+            return response
+        if "no-transform" in (response.headers.get("Cache-Control") or ""):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate()
+        if encoding is None:
+            self._count("skipped")
+            return response
+
+        if response.direct_passthrough:
+            if request.endpoint != "static" or self.static_mode == "off":
+                return response  # Files sent by views stay as they are
+            return self._static_file(response, encoding, level)
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoding, level, response.mimetype_params.get("charset", "utf-8"))
+            response.headers.pop("Content-Length", None)
+            self._mark(response, encoding)
+            self._count("streamed", encoding)
+            return response
+
+        body = response.get_data()
+        if len(body) < self.min_size:
+            self._count("skipped")
+            return response
+        compressed = compress(body, encoding, level)
+        response.set_data(compressed)
+        self._mark(response, encoding)
+        self._count("compressed", encoding, len(body), len(compressed))
+        return response
+
+    def _mark(self, response, encoding):
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+    # --- Static files ---
+
+    def _static_file(self, response, encoding, level):
+        path = safe_join(self.static_folder, request.view_args.get("filename", ""))
+        if not path or not os.path.isfile(path):
+            return response
+        stat = os.stat(path)
+        if stat.st_size < self.min_size:
+            self._count("skipped")
+            return response
+
+        if self.static_mode == "precompressed":
+            sibling = path + STATIC_SUFFIXES[encoding]
+            if os.path.isfile(sibling) and os.path.getmtime(sibling) >= stat.st_mtime:
+                response.close()
+                size = os.path.getsize(sibling)
+                response.response = wrap_file(request.environ, open(sibling, "rb"))
+                response.content_length = size
+                self._mark(response, encoding)
+                self._count("precompressed", encoding, stat.st_size, size)
+                return response
+
+        key = (path, stat.st_mtime, encoding)
+        with self._lock:
+            compressed = self._static.get(key)
+            if compressed is not None:
+                self._static.move_to_end(key)
+                self.stats["static_hits"] += 1
+            else:
+                self.stats["static_misses"] += 1
+        if compressed is None:
+            with open(path, "rb") as f:
+                compressed = compress(f.read(), encoding, level)
+            with self._lock:
+                self._static[key] = compressed
+                while len(self._static) > self.static_cache_size:
+                    self._static.popitem(last=False)
+
+        response.close()
+        response.direct_passthrough = False
+        response.set_data(compressed)
+        self._mark(response, encoding)
+        self._count("compressed", encoding, stat.st_size, len(compressed))
+        return response
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats, encodings=dict(self.encodings), static_entries=len(self._static))
+        stats["ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 4) if stats["bytes_in"] else None
+        stats["algorithms"] = self.algorithms
+        return stats
+
+
+def precompress_static(folder, levels, min_size=500, algorithms=None, force=False):
+    """
+    Writes .br/.zst/.gz siblings next to every compressible file in a static
+    folder. Up-to-date siblings are kept unless `force`. Yields (path, encoding, size, compressed size).
+    """
+    algorithms = [name for name in (algorithms or CODECS) if name in CODECS]
+    suffixes = tuple(STATIC_SUFFIXES.values())
+    for root, _, files in os.walk(folder):
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            mimetype, _ = mimetypes.guess_type(filename)
+            if filename.endswith(suffixes) or not levels.get(mimetype or ""):
+                continue
+            size = os.path.getsize(path)
+            if size < min_size:
+                continue
+            data = None
+            for encoding in algorithms:
+                sibling = path + STATIC_SUFFIXES[encoding]
+                if not force and os.path.isfile(sibling) and os.path.getmtime(sibling) >= os.path.getmtime(path):
+                    continue
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                compressed = compress(data, encoding, STATIC_LEVELS[encoding])
+                with open(sibling, "wb") as f:
+                    f.write(compressed)
+                yield path, encoding, size, len(compressed)
+
+
+def init_compression(app):
+    compressor = Compressor(
+        algorithms=[name.strip() for name in app.config["COMPRESS_ALGORITHMS"].split(",")],
+        levels=app.config["COMPRESS_LEVELS"],
+        min_size=app.config["COMPRESS_MIN_SIZE"],
+        static_mode=app.config["COMPRESS_STATIC"],
+        static_folder=app.static_folder,
+    )
+    app.extensions["compression"] = compressor
+    if app.config["COMPRESS_ENABLED"]:
+        app.after_request(compressor.process)
+
+
+def compressor() -> Compressor:
+    return current_app.extensions["compression"]
@@ -0,0 +1,256 @@
+# app/connections.py
+from bson.objectid import ObjectId
+from pymongo import DeleteMany, DeleteOne, UpdateMany, UpdateOne
+from .packagings import PACKAGING_LEVELS, connection_field
+
+# Two-way links kept in sync here:
+#   products.connections.<level>_package (str id) <-> packagings.connections [{_id: str, product_code}]
+#   products.connections.customer (str id)         <-> partners.connections [product ObjectId]
+#   packagings.supplier (str id)                   <-> partners.connections [packaging ObjectId]
+#
+# Routes build a ConnectionPlan from docs they've already read, then apply it:
+# one ordered bulk_write per collection, inside a transaction when the
+# deployment supports one.
+
+PACKAGE_KEYS = tuple(f"{level.lower()}_package" for level in PACKAGING_LEVELS)
+
+
+def _oid(value):
+    """ObjectId for a stored id string, or None for empty/invalid ones."""
+    if isinstance(value, ObjectId):
+        return value
+    if value and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return None
+
+
+def supports_transactions(client):
+    """Transactions need a replica set or sharded cluster; a standalone mongod refuses them."""
+    description = client.topology_description
+    if description.topology_type_name == "Unknown":
+        client.admin.command("ping")
+        description = client.topology_description
+    return description.topology_type_name in ("ReplicaSetWithPrimary", "Sharded", "LoadBalanced")
+
+
+class ConnectionPlan:
+    """
+    Write models for one request, grouped per collection in the order they must run,
+    plus a record of every link that changes.
+    """
+
+    def __init__(self, owner_oid):
+        self.owner = owner_oid
+        self.ops = {}
+        self.changes = []
+
+    def add(self, collection, op, change=None):
+        self.ops.setdefault(collection, []).append(op)
+        if change:
+            self.changes.append(change)
+        return self
+
+    def __bool__(self):
+        return bool(self.ops)
+
+    def apply(self, client, db):
+        """
+        Runs the plan and returns {collection: {"matched", "modified", "deleted"}}.
+        In a transaction the callback is retried on transient errors, so the
+        writes land all together or not at all.
+        """
+        def run(session=None):
+            counts = {}
+            for coll_name, ops in self.ops.items():
+                result = db[coll_name].bulk_write(ops, ordered=True, session=session)
+                counts[coll_name] = {
+                    "matched": result.matched_count,
+                    "modified": result.modified_count,
+                    "deleted": result.deleted_count,
+                }
+            return counts
+
+        if not self.ops:
+            return {}
+        if supports_transactions(client):
+            with client.start_session() as session:
+                return session.with_transaction(run)
+        return run()
+
+
+# --- Planners ---
+
+def plan_product_packagings(owner_oid, product, new_ids):
+    """
+    product: doc with _id, product_code, connections.
+    new_ids: {"primary_package": str, ...}; the form value for each level (may be "").
+    """
+    plan = ConnectionPlan(owner_oid)
+    product_id_str = str(product["_id"])
+    old_connections = product.get("connections", {})
+
+    plan.add("products", UpdateOne(
+        {"_id": product["_id"], "owner": owner_oid},
+        {"$set": {f"connections.{key}": new_ids.get(key) for key in PACKAGE_KEYS}}
+    ))
+
+    link_doc = {"_id": product_id_str, "product_code": product.get("product_code")}
+    for key in PACKAGE_KEYS:
+        old_id, new_id = old_connections.get(key), new_ids.get(key)
+        if old_id == new_id:
+            continue
+        old_oid, new_oid = _oid(old_id), _oid(new_id)
+        if old_oid:
+            plan.add("packagings", UpdateOne(
+                {"_id": old_oid, "owner": owner_oid},
+                {"$pull": {"connections": {"_id": product_id_str}}}
+            ), {"action": "unlink", "product": product_id_str, "packaging": old_id})
+        if new_oid:
+            # Pull first so a stale entry for this product is never duplicated
+            plan.add("packagings", UpdateOne(
+                {"_id": new_oid, "owner": owner_oid},
+                {"$pull": {"connections": {"_id": product_id_str}}}
+            ))
+            plan.add("packagings", UpdateOne(
+                {"_id": new_oid, "owner": owner_oid},
+                {"$push": {"connections": link_doc}}
+            ), {"action": "link", "product": product_id_str, "packaging": new_id})
+    return plan
+
+
+def _linked_product_oids(package):
+    """Product ids in a packaging's connections, whatever format they were stored in."""
+    oids = []
+    for link in package.get("connections", []):
+        if isinstance(link, ObjectId):
+            oids.append(link)
+        elif isinstance(link, dict):
+            oid = _oid(link.get("_id") or link.get("$oid"))
+            if oid:
+                oids.append(oid)
+    return oids
+
+
+def plan_packaging_products(owner_oid, package, new_products):
+    """
+    package: packaging doc with _id, level, connections.
+    new_products: product docs (_id, product_code, connections) to link, already owner-checked.
+    """
+    plan = ConnectionPlan(owner_oid)
+    package_id_str = str(package["_id"])
+    key = f"{package['level'].lower()}_package"
+    field = connection_field(package["level"])
+
+    new_oids = [p["_id"] for p in new_products]
+    ids_to_unlink = [oid for oid in _linked_product_oids(package) if oid not in new_oids]
+    if ids_to_unlink:
+        plan.add("products", UpdateMany(
+            {"_id": {"$in": ids_to_unlink}, "owner": owner_oid, field: package_id_str},
+            {"$set": {field: ""}}
+        ), {"action": "unlink", "packaging": package_id_str, "products": [str(i) for i in ids_to_unlink]})
+    if new_oids:
+        plan.add("products", UpdateMany(
+            {"_id": {"$in": new_oids}, "owner": owner_oid},
+            {"$set": {field: package_id_str}}
+        ), {"action": "link", "packaging": package_id_str, "products": [str(i) for i in new_oids]})
+
+    # Products taken over from another packaging of the same level leave its list
+    moved = {}
+    for product in new_products:
+        previous = product.get("connections", {}).get(key)
+        previous_oid = _oid(previous)
+        if previous_oid and previous != package_id_str:
+            moved.setdefault(previous_oid, []).append(str(product["_id"]))
+    for previous_oid, product_ids in moved.items():
+        plan.add("packagings", UpdateOne(
+            {"_id": previous_oid, "owner": owner_oid},
+            {"$pull": {"connections": {"_id": {"$in": product_ids}}}}
+        ), {"action": "unlink", "packaging": str(previous_oid), "products": product_ids})
+
+    plan.add("packagings", UpdateOne(
+        {"_id": package["_id"], "owner": owner_oid},
+        {"$set": {"connections": [
+            {"_id": str(p["_id"]), "product_code": p.get("product_code")} for p in new_products
+        ]}}
+    ))
+    return plan
+
+
+def plan_partner_connections(owner_oid, partner, new_items):
+    """
+    partner: doc with _id, partner_type, connections.
+    new_items: docs to link, already owner-checked: products (with connections)
+    for a customer, packagings (with supplier) for a supplier.
+    """
+    plan = ConnectionPlan(owner_oid)
+    partner_id_str = str(partner["_id"])
+    partner_type = partner.get("partner_type", "").lower()
+
+    new_oids = {item["_id"] for item in new_items}
+    old_oids = {oid for oid in map(_oid, partner.get("connections", [])) if oid}
+    ids_to_unlink = list(old_oids - new_oids)
+    ids_to_link = list(new_oids - old_oids)
+
+    if partner_type == "customer":
+        collection, field = "products", "connections.customer"
+    elif partner_type == "supplier":
+        collection, field = "packagings", "supplier"
+    else:
+        collection, field = None, None
+
+    if collection:
+        if ids_to_unlink:
+            plan.add(collection, UpdateMany(
+                {"_id": {"$in": ids_to_unlink}, "owner": owner_oid, field: partner_id_str},
+                {"$set": {field: ""}}
+            ), {"action": "unlink", "partner": partner_id_str, collection: [str(i) for i in ids_to_unlink]})
+        if ids_to_link:
+            plan.add(collection, UpdateMany(
+                {"_id": {"$in": ids_to_link}, "owner": owner_oid},
+                {"$set": {field: partner_id_str}}
+            ), {"action": "link", "partner": partner_id_str, collection: [str(i) for i in ids_to_link]})
+
+        # An item can only have one customer/supplier: drop it from the previous partner's list
+        moved = {}
+        for item in new_items:
+            previous = item.get("supplier") if collection == "packagings" else item.get("connections", {}).get("customer")
+            previous_oid = _oid(previous)
+            if item["_id"] in ids_to_link and previous_oid and previous != partner_id_str:
+                moved.setdefault(previous_oid, []).append(item["_id"])
+        for previous_oid, item_oids in moved.items():
+            plan.add("partners", UpdateOne(
+                {"_id": previous_oid, "owner": owner_oid},
+                {"$pull": {"connections": {"$in": item_oids}}}
+            ), {"action": "unlink", "partner": str(previous_oid), collection: [str(i) for i in item_oids]})
+
+    plan.add("partners", UpdateOne(
+        {"_id": partner["_id"], "owner": owner_oid},
+        {"$set": {"connections": list(new_oids)}}
+    ))
+    return plan
+
+
+def plan_delete_product(owner_oid, product):
+    """Removes the product, its sales, and every link pointing at it."""
+    plan = ConnectionPlan(owner_oid)
+    product_id_str = str(product["_id"])
+    connections = product.get("connections", {})
+
+    package_oids = [oid for oid in (_oid(connections.get(key)) for key in PACKAGE_KEYS) if oid]
+    if package_oids:
+        plan.add("packagings", UpdateMany(
+            {"_id": {"$in": package_oids}, "owner": owner_oid},
+            {"$pull": {"connections": {"_id": product_id_str}}}
+        ), {"action": "unlink", "product": product_id_str, "packagings": [str(i) for i in package_oids]})
+
+    customer_oid = _oid(connections.get("customer"))
+    if customer_oid:
+        plan.add("partners", UpdateOne(
+            {"_id": customer_oid, "owner": owner_oid},
+            {"$pull": {"connections": product["_id"]}}
+        ), {"action": "unlink", "product": product_id_str, "partner": str(customer_oid)})
+
+    plan.add("products", DeleteOne({"_id": product["_id"], "owner": owner_oid}),
+             {"action": "delete", "product": product_id_str})
+    plan.add("sales", DeleteMany({"owner": owner_oid, "product": product["_id"]}))
+    return plan
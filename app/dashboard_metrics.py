@@ -0,0 +1,307 @@
+# app/dashboard_metrics.py
+import math
+from datetime import datetime
+from bson.objectid import ObjectId
+from .utils import _safe_float
+
+GRADES = ("A", "B", "C", "D")
+LEVELS = ("Primary", "Secondary", "Tertiary")
+
+
+def _package_unit_weight(pkg_doc):
+    """Calculates the total weight of a single packaging unit in grams."""
+    return sum(_safe_float(m.get("weight_grams")) or 0 for m in pkg_doc.get("materials", []))
+
+
+def _empty_grades(value=0):
+    return {g: value for g in GRADES}
+
+
+def finalize_metrics(packaging_qty_by_grade, packaging_weight_by_grade, packaging_trend):
+    """Converts grams to kg and sorts the trend by month, as the dashboard template expects."""
+    return {
+        "packaging_qty_by_grade": packaging_qty_by_grade,
+        "packaging_weight_by_grade": {k: round(v / 1000, 2) for k, v in packaging_weight_by_grade.items()},
+        "packaging_trend": {label: packaging_trend[label] for label in sorted(packaging_trend)},
+    }
+
+
+def same_metrics(a, b):
+    """Equality with a float tolerance: the engines sum the same values in a different order."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_metrics(a[k], b[k]) for k in a)
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+
+# --- Python engine (reference implementation) ---
+
+def iter_packaging_units(product, packages):
+    """
+    Expands a product's sales into packaging units.
+
+    Yields (sale_date, level, grade, units, grams) for every sale with a
+    non-zero quantity. Each such sale first yields a (sale_date, None, None, 0, 0)
+    marker so months without graded packaging still show up in the trend.
+    `level` and `grade` are those of the connected packaging doc; `grade` may be
+    anything (callers keep only A-D).
+    """
+    connections = product.get("connections", {})
+    pkg_ids = [
+        connections.get("primary_package"),
+        connections.get("secondary_package"),
+        connections.get("tertiary_package")
+    ]
+    pkg_docs = [packages.get(pkg_id) for pkg_id in pkg_ids]
+
+    qty_primary_in_secondary = pkg_docs[1].get("quantity_primary_in_secondary_unit", 1) if pkg_docs[1] else 1
+    qty_secondary_in_tertiary = pkg_docs[2].get("quantity_secondary_in_tertiary_unit", 1) if pkg_docs[2] else 1
+
+    for sale in product.get("sales", []):
+        try:
+            sale_year = int(sale["year"])
+            sale_month = int(sale["month"])
+            sale_date = datetime(sale_year, sale_month, 1)
+
+            quantity = _safe_float(sale.get("quantity")) or 0
+            if quantity == 0:
+                continue
+
+            # --- Calculate units for this sale ---
+            total_primary_units = quantity
+            total_secondary_units = math.ceil(total_primary_units / qty_primary_in_secondary) if qty_primary_in_secondary > 0 else 0
+            total_tertiary_units = math.ceil(total_secondary_units / qty_secondary_in_tertiary) if qty_secondary_in_tertiary > 0 else 0
+            num_units_per_level = [total_primary_units, total_secondary_units, total_tertiary_units]
+
+            entries = [(sale_date, None, None, 0, 0)]
+            for i, pkg_doc in enumerate(pkg_docs):
+                num_units = num_units_per_level[i]
+                if not pkg_doc or num_units == 0:
+                    continue
+                grade = (str(pkg_doc.get("recyclability") or "N/A")).strip().upper()
+                unit_weight = _package_unit_weight(pkg_doc)
+                entries.append((sale_date, pkg_doc.get("level"), grade, num_units, unit_weight * num_units))
+        except (ValueError, TypeError):
+            continue
+        yield from entries
+
+
+def compute_metrics_python(products, packages, start_date=None, end_date=None, packaging_levels=LEVELS):
+    """
+    products: docs with `connections` and `sales` (see sales.with_sales).
+    packages: {str(_id): packaging doc with a `level` key}.
+    start_date / end_date: datetime (first of month) or None.
+    """
+    packaging_qty_by_grade = _empty_grades(0)
+    packaging_weight_by_grade = _empty_grades(0.0)
+    packaging_trend = {} # "YYYY-MM" -> {"A": 0, "B": 0, ...}
+
+    for product in products:
+        for sale_date, level, grade, num_units, grams in iter_packaging_units(product, packages):
+            if start_date and sale_date < start_date:
+                continue
+            if end_date and sale_date > end_date:
+                continue
+
+            # --- Trend Data ---
+            sale_label = f"{sale_date.year}-{sale_date.month:02d}"
+            if sale_label not in packaging_trend:
+                packaging_trend[sale_label] = _empty_grades(0)
+
+            # Filter by packaging level and grade
+            if level not in packaging_levels or grade not in packaging_qty_by_grade:
+                continue
+
+            # Pie chart totals
+            packaging_qty_by_grade[grade] += num_units
+            packaging_weight_by_grade[grade] += grams
+
+            # Trend data
+            packaging_trend[sale_label][grade] += num_units
+
+    return finalize_metrics(packaging_qty_by_grade, packaging_weight_by_grade, packaging_trend)
+
+
+# --- Aggregation pipeline engine ---
+
+def _to_double(expr):
+    return {"$convert": {"input": expr, "to": "double", "onError": None, "onNull": None}}
+
+def _to_int(expr):
+    return {"$convert": {"input": expr, "to": "int", "onError": None, "onNull": None}}
+
+def _to_oid(expr):
+    return {"$convert": {"input": expr, "to": "objectId", "onError": None, "onNull": None}}
+
+def _pack_ratio(doc_field, qty_field):
+    """Mirrors `pkg.get(qty_field, 1) if pkg else 1`: missing doc or field -> 1, explicit null stays null."""
+    return {"$cond": [
+        {"$eq": [{"$size": doc_field}, 0]},
+        1,
+        {"$let": {
+            "vars": {"doc": {"$first": doc_field}},
+            "in": {"$cond": [
+                {"$eq": [{"$type": f"$$doc.{qty_field}"}, "missing"]},
+                1,
+                f"$$doc.{qty_field}",
+            ]},
+        }},
+    ]}
+
+def _level_entry(doc_field, units_expr):
+    """Grade, units and grams contributed by one connected packaging for one sale."""
+    return {"$let": {
+        "vars": {"doc": {"$first": doc_field}},
+        "in": {
+            "grade": {"$cond": [
+                {"$eq": [{"$type": "$$doc.recyclability"}, "string"]},
+                {"$toUpper": {"$trim": {"input": "$$doc.recyclability"}}},
+                None,
+            ]},
+            "units": units_expr,
+            "grams": {"$multiply": [
+                units_expr,
+                {"$sum": {"$map": {
+                    "input": {"$ifNull": ["$$doc.materials", []]},
+                    "as": "m",
+                    "in": {"$ifNull": [_to_double("$$m.weight_grams"), 0]},
+                }}},
+            ]},
+            "present": {"$gt": [{"$size": doc_field}, 0]},
+        },
+    }}
+
+def _period(date):
+    return date.year * 100 + date.month if date else None
+
+def build_metrics_pipeline(owner_oid, product_oids=None, start_date=None, end_date=None, packaging_levels=LEVELS):
+    """
+    Builds the aggregation run against `products` (sales are joined from the
+    `sales` collection). Each output document is
+    {_id: {period: YYYYMM, grade: "A".."D" or None}, units, grams}; a None grade
+    only marks that the month had sales so it still shows up in the trend.
+    The $lookup stages combine localField/foreignField with a `pipeline`,
+    which needs MongoDB 5.0 or later.
+    """
+    match = {"owner": owner_oid}
+    if product_oids is not None:
+        match["_id"] = {"$in": product_oids}
+
+    lookups = []
+    for level, key in zip(LEVELS, ("primary_package", "secondary_package", "tertiary_package")):
+        lookups.append({"$lookup": {
+            "from": "packagings",
+            "localField": f"_pkg.{key}",
+            "foreignField": "_id",
+            "pipeline": [
+                {"$match": {"owner": owner_oid, "level": level}},
+                {"$project": {
+                    "recyclability": 1, "materials.weight_grams": 1,
+                    "quantity_primary_in_secondary_unit": 1, "quantity_secondary_in_tertiary_unit": 1,
+                }},
+            ],
+            "as": f"_{level.lower()}",
+        }})
+
+    period_filters = []
+    if start_date:
+        period_filters.append({"_period": {"$gte": _period(start_date)}})
+    if end_date:
+        period_filters.append({"_period": {"$lte": _period(end_date)}})
+
+    units = {
+        "Primary": "$_qty",
+        "Secondary": "$_units2",
+        "Tertiary": "$_units3",
+    }
+    entries = [
+        _level_entry(f"$_{level.lower()}", units[level])
+        for level in LEVELS if level in packaging_levels
+    ]
+
+    return [
+        {"$match": match},
+        {"$lookup": {
+            "from": "sales",
+            "localField": "_id",
+            "foreignField": "product",
+            "pipeline": [{"$project": {"year": 1, "month": 1, "quantity": 1}}],
+            "as": "sales",
+        }},
+        {"$project": {
+            "sales": 1,
+            "_pkg": {
+                "primary_package": _to_oid("$connections.primary_package"),
+                "secondary_package": _to_oid("$connections.secondary_package"),
+                "tertiary_package": _to_oid("$connections.tertiary_package"),
+            },
+        }},
+        *lookups,
+        {"$project": {
+            "sales": 1, "_primary": 1, "_secondary": 1, "_tertiary": 1,
+            "_q2": _pack_ratio("$_secondary", "quantity_primary_in_secondary_unit"),
+            "_q3": _pack_ratio("$_tertiary", "quantity_secondary_in_tertiary_unit"),
+        }},
+        # A non-numeric pack ratio makes the Python engine skip every sale of the product
+        {"$match": {"_q2": {"$type": "number"}, "_q3": {"$type": "number"}}},
+        {"$unwind": "$sales"},
+        {"$project": {
+            "_primary": 1, "_secondary": 1, "_tertiary": 1, "_q2": 1, "_q3": 1,
+            "_year": _to_int("$sales.year"),
+            "_month": _to_int("$sales.month"),
+            "_qty": {"$ifNull": [_to_double("$sales.quantity"), 0]},
+        }},
+        {"$match": {
+            "_year": {"$gte": 1, "$lte": 9999},
+            "_month": {"$gte": 1, "$lte": 12},
+            "_qty": {"$ne": 0},
+        }},
+        {"$addFields": {"_period": {"$add": [{"$multiply": ["$_year", 100]}, "$_month"]}}},
+        *([{"$match": {"$and": period_filters}}] if period_filters else []),
+        {"$addFields": {
+            "_units2": {"$cond": [{"$gt": ["$_q2", 0]}, {"$ceil": {"$divide": ["$_qty", "$_q2"]}}, 0]},
+        }},
+        {"$addFields": {
+            "_units3": {"$cond": [{"$gt": ["$_q3", 0]}, {"$ceil": {"$divide": ["$_units2", "$_q3"]}}, 0]},
+        }},
+        {"$project": {
+            "_period": 1,
+            "_entries": {"$filter": {
+                "input": entries,
+                "as": "e",
+                "cond": {"$and": [
+                    "$$e.present",
+                    {"$ne": ["$$e.units", 0]},
+                    {"$in": ["$$e.grade", list(GRADES)]},
+                ]},
+            }},
+        }},
+        {"$unwind": {"path": "$_entries", "preserveNullAndEmptyArrays": True}},
+        {"$group": {
+            "_id": {"period": "$_period", "grade": "$_entries.grade"},
+            "units": {"$sum": "$_entries.units"},
+            "grams": {"$sum": "$_entries.grams"},
+        }},
+    ]
+
+
+def compute_metrics_pipeline(db, owner_oid, product_ids=None, start_date=None, end_date=None, packaging_levels=LEVELS):
+    """Runs the dashboard aggregation server-side and returns the same maps as the Python engine."""
+    product_oids = None
+    if product_ids:
+        product_oids = [ObjectId(pid) for pid in product_ids if ObjectId.is_valid(pid)]
+
+    pipeline = build_metrics_pipeline(owner_oid, product_oids, start_date, end_date, packaging_levels)
+
+    packaging_qty_by_grade = _empty_grades(0)
+    packaging_weight_by_grade = _empty_grades(0.0)
+    packaging_trend = {}
+    for row in db.products.aggregate(pipeline):
+        period, grade = row["_id"]["period"], row["_id"].get("grade")
+        label = f"{period // 100}-{period % 100:02d}"
+        month = packaging_trend.setdefault(label, _empty_grades(0))
+        if grade in GRADES:
+            month[grade] += row["units"]
+            packaging_qty_by_grade[grade] += row["units"]
+            packaging_weight_by_grade[grade] += row["grams"]
+
+    return finalize_metrics(packaging_qty_by_grade, packaging_weight_by_grade, packaging_trend)
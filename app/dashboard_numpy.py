@@ -0,0 +1,144 @@
+# app/dashboard_numpy.py
+"""
+Vectorized dashboard engine. numpy is optional: when it is not installed,
+`available()` is False and dashboard() keeps using the Python engine.
+"""
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from .utils import _safe_float
+from .dashboard_metrics import GRADES, LEVELS, _package_unit_weight, finalize_metrics, _empty_grades
+
+PACKAGE_KEYS = ("primary_package", "secondary_package", "tertiary_package")
+RATIO_KEYS = (None, "quantity_primary_in_secondary_unit", "quantity_secondary_in_tertiary_unit")
+GRADE_CODES = {g: i for i, g in enumerate(GRADES)}
+
+
+def available():
+    return np is not None
+
+
+def packaging_columns(products, packages):
+    """
+    Per-product, per-level packaging attributes as arrays of length len(products):
+    grade code (-1 = none/ungraded), unit weight, level name, and the two pack
+    ratios plus a mask of products whose ratios are usable.
+    """
+    n = len(products)
+    grade = np.full((3, n), -1, dtype=np.int8)
+    weight = np.zeros((3, n), dtype=np.float64)
+    level = [[None] * n for _ in range(3)]
+    ratio = np.ones((3, n), dtype=np.float64)
+    ratio_ok = np.ones(n, dtype=bool)
+
+    for j, product in enumerate(products):
+        connections = product.get("connections", {})
+        for i, key in enumerate(PACKAGE_KEYS):
+            pkg = packages.get(connections.get(key))
+            if not pkg:
+                continue
+            level[i][j] = pkg.get("level")
+            grade[i, j] = GRADE_CODES.get(str(pkg.get("recyclability") or "N/A").strip().upper(), -1)
+            weight[i, j] = _package_unit_weight(pkg)
+            if RATIO_KEYS[i]:
+                value = pkg.get(RATIO_KEYS[i], 1)
+                # The Python engine skips every sale of a product whose ratio can't be compared to 0
+                if isinstance(value, (int, float)):
+                    ratio[i, j] = value
+                else:
+                    ratio_ok[j] = False
+    return grade, weight, level, ratio, ratio_ok
+
+
+def sales_columns(sales, product_index):
+    """
+    sales: iterable of {product, period, quantity} docs.
+    product_index: {product _id: position in the products list}.
+    Returns (product position, YYYYMM period, quantity) arrays.
+    """
+    pidx, period, qty = [], [], []
+    for sale in sales:
+        j = product_index.get(sale.get("product"))
+        p = sale.get("period")
+        if j is None or p is None:
+            continue
+        pidx.append(j)
+        period.append(p)
+        qty.append(_safe_float(sale.get("quantity")) or 0)
+    return (np.asarray(pidx, dtype=np.int64),
+            np.asarray(period, dtype=np.int64),
+            np.asarray(qty, dtype=np.float64))
+
+
+def compute_metrics_numpy(products, packages, columns, start_date=None, end_date=None, packaging_levels=LEVELS):
+    """
+    products/packages as for compute_metrics_python; `columns` comes from sales_columns().
+    Returns the same maps as the Python engine.
+    """
+    pidx, period, qty = columns
+    grade, weight, level, ratio, ratio_ok = packaging_columns(products, packages)
+
+    # datetime() accepts years 1-9999; math.ceil() rejects nan/inf
+    mask = (qty != 0) & np.isfinite(qty) & (period >= 101) & (period <= 999912) & ratio_ok[pidx]
+    if start_date:
+        mask &= period >= start_date.year * 100 + start_date.month
+    if end_date:
+        mask &= period <= end_date.year * 100 + end_date.month
+
+    pidx, period, qty = pidx[mask], period[mask], qty[mask]
+
+    # --- Unit expansion per level ---
+    q2, q3 = ratio[1][pidx], ratio[2][pidx]
+    units2 = np.where(q2 > 0, np.ceil(np.divide(qty, q2, out=np.zeros_like(qty), where=q2 > 0)), 0)
+    units3 = np.where(q3 > 0, np.ceil(np.divide(units2, q3, out=np.zeros_like(qty), where=q3 > 0)), 0)
+    units = (qty, units2, units3)
+
+    months, month_idx = np.unique(period, return_inverse=True)
+    qty_by_grade = np.zeros(len(GRADES))
+    grams_by_grade = np.zeros(len(GRADES))
+    trend = np.zeros((len(months), len(GRADES)))
+
+    for i in range(3):
+        # Level names are per product; collapse them to a boolean column first
+        level_ok = np.fromiter((lvl in packaging_levels for lvl in level[i]), dtype=bool, count=len(products))
+        g = grade[i][pidx]
+        m = (g >= 0) & (units[i] != 0) & level_ok[pidx]
+        g, u = g[m], units[i][m]
+        np.add.at(qty_by_grade, g, u)
+        np.add.at(grams_by_grade, g, u * weight[i][pidx][m])
+        np.add.at(trend, (month_idx[m], g), u)
+
+    packaging_trend = {
+        f"{p // 100}-{p % 100:02d}": {grade_name: trend[k, gi].item() for gi, grade_name in enumerate(GRADES)}
+        for k, p in enumerate(months.tolist())
+    }
+    packaging_qty_by_grade = _empty_grades(0)
+    packaging_weight_by_grade = _empty_grades(0.0)
+    for gi, grade_name in enumerate(GRADES):
+        packaging_qty_by_grade[grade_name] = qty_by_grade[gi].item()
+        packaging_weight_by_grade[grade_name] = grams_by_grade[gi].item()
+
+    return finalize_metrics(packaging_qty_by_grade, packaging_weight_by_grade, packaging_trend)
+
+
+def load_and_compute(db, owner_oid, products, packages, start_date=None, end_date=None,
+                     packaging_levels=LEVELS, all_products=False):
+    """
+    Reads the sales of `products` straight into columns and runs the numpy engine.
+    all_products=True skips the $in list when `products` is the whole catalog.
+    """
+    product_index = {p["_id"]: j for j, p in enumerate(products)}
+    query = {"owner": owner_oid}
+    if not all_products:
+        query["product"] = {"$in": list(product_index)}
+    if start_date or end_date:
+        query["period"] = {}
+        if start_date:
+            query["period"]["$gte"] = start_date.year * 100 + start_date.month
+        if end_date:
+            query["period"]["$lte"] = end_date.year * 100 + end_date.month
+    cursor = db.sales.find(query, {"_id": 0, "product": 1, "period": 1, "quantity": 1}).batch_size(10000)
+    columns = sales_columns(cursor, product_index)
+    return compute_metrics_numpy(products, packages, columns, start_date, end_date, packaging_levels)
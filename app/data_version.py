@@ -0,0 +1,129 @@
+# app/data_version.py
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from bson.objectid import ObjectId
+from flask import current_app, request
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from . import mongo
+
+# Per-tenant data version: a counter in `data_versions` ({_id: owner, version,
+# updated_at}) bumped after every mutating request (routes.py, teardown) and
+# by the CLI commands that write tenant data. Read-only JSON endpoints wrapped
+# in @versioned_json are tagged with it: an unchanged version answers
+# If-None-Match / If-Modified-Since with 304, and the serialized body of the
+# last full response is kept in memory, so neither case runs the view.
+#
+# The version is read before the view runs, and writers bump it after their
+# write, so a body is never tagged with a version newer than its data.
+
+ETAG_SCHEMA = 2  # Bump when a versioned endpoint changes its payload shape
+
+
+def bump_version(db, owner_oid):
+    db.data_versions.update_one(
+        {"_id": owner_oid},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc).replace(microsecond=0)}},
+        upsert=True,
+    )
+
+
+def read_version(db, owner_oid):
+    """Returns (version, updated_at); (0, None) for a tenant that never wrote anything."""
+    doc = db.data_versions.find_one({"_id": owner_oid})
+    if not doc:
+        return 0, None
+    updated_at = doc.get("updated_at")
+    if updated_at is not None and updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)  # Mongo hands back naive UTC
+    return doc["version"], updated_at
+
+
+class ResponseCache:
+    """LRU of serialized responses: (owner, path) -> (version, body, mimetype). Stale versions never match."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0}
+
+    def get(self, owner_oid, path, version):
+        with self._lock:
+            entry = self._entries.get((owner_oid, path))
+            if entry and entry[0] == version:
+                self._entries.move_to_end((owner_oid, path))
+                self.stats["hits"] += 1
+                return entry[1], entry[2]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, owner_oid, path, version, body, mimetype):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(owner_oid, path)] = (version, body, mimetype)
+            self._entries.move_to_end((owner_oid, path))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self.stats["not_modified"] += 1
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
+
+
+def init_response_cache(app):
+    app.extensions["response_cache"] = ResponseCache(max_entries=app.config["RESPONSE_CACHE_SIZE"])
+
+
+def response_cache() -> ResponseCache:
+    return current_app.extensions["response_cache"]
+
+
+def _tag(response, etag, updated_at):
+    response.set_etag(etag)
+    if updated_at is not None:
+        response.last_modified = updated_at
+    # The browser may keep it but must ask first; the answer is usually a 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def versioned_json(view):
+    """
+    Tags a read-only JSON view with the tenant's data version (see above).
+    Only 200 responses are cached; errors pass through untagged.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        owner_oid = ObjectId(current_user.id)
+        version, updated_at = read_version(mongo.db, owner_oid)
+        etag = f"{ETAG_SCHEMA}.{owner_oid}.{version}"
+        cache = response_cache()
+        if not is_resource_modified(request.environ, etag=etag, last_modified=updated_at):
+            cache.count_not_modified()
+            return _tag(current_app.response_class(status=304), etag, updated_at)
+
+        path = request.full_path
+        cached = cache.get(owner_oid, path, version)
+        if cached is not None:
+            body, mimetype = cached
+            return _tag(current_app.response_class(body, mimetype=mimetype), etag, updated_at)
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        cache.put(owner_oid, path, version, response.get_data(), response.mimetype)
+        return _tag(response, etag, updated_at)
+    return wrapper
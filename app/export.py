@@ -0,0 +1,165 @@
+# app/export.py
+import csv
+import io
+import json
+from datetime import datetime
+from bson.objectid import ObjectId
+from .catalog import COMPONENT_FIELDS
+from .packagings import PACKAGING_LEVELS
+
+# Streaming export of a tenant's catalog as NDJSON or CSV.
+#
+# Every kind is read from one owner-scoped cursor and flattened row by row, so
+# memory stays flat; only the id -> code/name lookups used to resolve links
+# are held. Product columns use the bulk import names, so a products CSV can
+# be imported into another account as is.
+
+DIMENSION_COLUMNS = ("length", "width", "height", "radius", "volume")
+PACKAGE_COLUMNS = tuple(f"{level.lower()}_package" for level in PACKAGING_LEVELS)
+
+EXPORT_COLUMNS = {
+    "products": (
+        "product_id", "product_code", "secondary_product_code", "product_category", "product_description",
+        "material", "product_shape", *DIMENSION_COLUMNS, "volume_cm3", "product_volume",
+        *PACKAGE_COLUMNS, "customer", "creation_time",
+    ),
+    # One row per material component; a packaging without components gets one row
+    "packagings": (
+        "packaging_id", "level", "package_code", "recyclability", "package_shape", *DIMENSION_COLUMNS,
+        "volume_cm3", "quantity_primary_in_secondary_unit", "quantity_secondary_in_tertiary_unit",
+        "supplier", "component_index", *COMPONENT_FIELDS, "creation_time",
+    ),
+    "partners": (
+        "partner_id", "partner_type", "partner_name", "email", "phone_number", "address", "country",
+        "connection_count", "creation_time",
+    ),
+    "sales": ("sale_id", "product_id", "product_code", "year", "month", "period", "quantity", "sku_price"),
+}
+EXPORT_KINDS = tuple(EXPORT_COLUMNS)
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CHUNK_SIZE = 64 * 1024  # Rows are sent in chunks of about this many characters
+
+
+def _codes(db, collection, owner_oid, field):
+    return {str(doc["_id"]): doc.get(field) for doc in db[collection].find({"owner": owner_oid}, {field: 1})}
+
+
+def _product_rows(db, owner_oid, batch_size):
+    package_codes = _codes(db, "packagings", owner_oid, "package_code")
+    partner_names = _codes(db, "partners", owner_oid, "partner_name")
+    for product in db.products.find({"owner": owner_oid}, batch_size=batch_size):
+        connections = product.get("connections") or {}
+        dimensions = product.get("dimensions") or {}
+        yield {
+            "product_id": product["_id"],
+            "product_code": product.get("product_code"),
+            "secondary_product_code": product.get("secondary_product_code"),
+            "product_category": product.get("product_category"),
+            "product_description": product.get("product_description"),
+            "material": product.get("product_material"),
+            "product_shape": product.get("product_shape"),
+            **{dim: dimensions.get(dim) for dim in DIMENSION_COLUMNS},
+            "volume_cm3": product.get("volume_cm3"),
+            "product_volume": product.get("product_volume"),
+            **{key: package_codes.get(connections.get(key)) for key in PACKAGE_COLUMNS},
+            "customer": partner_names.get(connections.get("customer")),
+            "creation_time": product.get("creation_time"),
+        }
+
+
+def _packaging_rows(db, owner_oid, batch_size):
+    partner_names = _codes(db, "partners", owner_oid, "partner_name")
+    for package in db.packagings.find({"owner": owner_oid}, {"connections": 0}, batch_size=batch_size):
+        dimensions = package.get("dimensions") or {}
+        base = {
+            "packaging_id": package["_id"],
+            "level": package.get("level"),
+            "package_code": package.get("package_code"),
+            "recyclability": package.get("recyclability"),
+            "package_shape": package.get("package_shape"),
+            **{dim: dimensions.get(dim) for dim in DIMENSION_COLUMNS},
+            "volume_cm3": package.get("volume_cm3"),
+            "quantity_primary_in_secondary_unit": package.get("quantity_primary_in_secondary_unit"),
+            "quantity_secondary_in_tertiary_unit": package.get("quantity_secondary_in_tertiary_unit"),
+            "supplier": partner_names.get(package.get("supplier")),
+            "creation_time": package.get("creation_time"),
+        }
+        materials = [m for m in package.get("materials") or [] if isinstance(m, dict)]
+        if not materials:
+            yield {**base, "component_index": None}
+        for index, component in enumerate(materials, start=1):
+            yield {**base, "component_index": index, **{field: component.get(field) for field in COMPONENT_FIELDS}}
+
+
+def _partner_rows(db, owner_oid, batch_size):
+    for partner in db.partners.find({"owner": owner_oid}, batch_size=batch_size):
+        row = {column: partner.get(column) for column in EXPORT_COLUMNS["partners"]}
+        row["partner_id"] = partner["_id"]
+        row["connection_count"] = len(partner.get("connections") or [])
+        yield row
+
+
+def _sale_rows(db, owner_oid, batch_size):
+    product_codes = _codes(db, "products", owner_oid, "product_code")
+    for sale in db.sales.find({"owner": owner_oid}, batch_size=batch_size):
+        row = {column: sale.get(column) for column in EXPORT_COLUMNS["sales"]}
+        row["sale_id"] = sale["_id"]
+        row["product_id"] = sale.get("product")
+        row["product_code"] = product_codes.get(str(sale.get("product")))
+        yield row
+
+
+_ROW_READERS = {
+    "products": _product_rows,
+    "packagings": _packaging_rows,
+    "partners": _partner_rows,
+    "sales": _sale_rows,
+}
+
+
+def _plain(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_lines(kind, rows):
+    columns = EXPORT_COLUMNS[kind]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(["" if row.get(column) is None else _plain(row.get(column)) for column in columns])
+        yield buffer.getvalue()
+
+
+def export_lines(db, owner_oid, kind, fmt="ndjson", batch_size=1000):
+    """
+    Yields the export as text chunks. The first line (the CSV header, or the
+    first NDJSON record) goes out on its own so the client sees bytes at once.
+    """
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"Unknown export kind: {kind}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    rows = _ROW_READERS[kind](db, owner_oid, batch_size)
+    if fmt == "ndjson":
+        lines = (json.dumps({key: _plain(value) for key, value in row.items()}, ensure_ascii=False, default=str) + "\n"
+                 for row in rows)
+    else:
+        lines = _csv_lines(kind, rows)
+
+    chunk, size = [], 0
+    for number, line in enumerate(lines):
+        chunk.append(line)
+        size += len(line)
+        if number == 0 or size >= CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
@@ -0,0 +1,148 @@
+# app/indexes.py
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+# --- Index declarations ---
+# Every query in routes.py is scoped by `owner`, so each collection leads with it.
+# Keep this map as the single source of truth: `flask ensure-indexes` creates
+# exactly these and `flask ensure-indexes --check` reports drift against them.
+# The unique ones back up the routes' own duplicate checks against concurrent
+# writes; VERIFY_INDEXES=1 reports them on startup when they are missing.
+
+def _data_setup_indexes():
+    return [
+        IndexModel([("owner", ASCENDING), ("name", ASCENDING)], name="owner_name_unique", unique=True),
+    ]
+
+# Indexes created from config rather than declared here; not reported as undeclared
+MANAGED_ELSEWHERE = {
+    ("activities", "timestamp_ttl"),  # activity_log.apply_retention
+}
+
+INDEXES = {
+    "users": [
+        # Login looks a user up by name
+        IndexModel([("username", ASCENDING)], name="username", unique=True),
+    ],
+    "products": [
+        # (owner, sort field, _id): keyset pages of the products table (tables.py)
+        IndexModel([("owner", ASCENDING), ("product_code", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_product_code_id"),
+        IndexModel([("owner", ASCENDING), ("secondary_product_code", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_secondary_product_code_id"),
+        IndexModel([("owner", ASCENDING), ("product_category", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_product_category_id"),
+        IndexModel([("owner", ASCENDING), ("connections.primary_package", ASCENDING)], name="owner_primary_package"),
+        IndexModel([("owner", ASCENDING), ("connections.secondary_package", ASCENDING)], name="owner_secondary_package"),
+        IndexModel([("owner", ASCENDING), ("connections.tertiary_package", ASCENDING)], name="owner_tertiary_package"),
+        IndexModel([("owner", ASCENDING), ("connections.customer", ASCENDING)], name="owner_customer"),
+    ],
+    "packagings": [
+        IndexModel([("owner", ASCENDING), ("level", ASCENDING), ("_id", ASCENDING)], name="owner_level_id"),
+        IndexModel([("owner", ASCENDING), ("package_code", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_package_code_id"),
+        IndexModel([("owner", ASCENDING), ("recyclability", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_recyclability_id"),
+        IndexModel([("owner", ASCENDING), ("supplier", ASCENDING)], name="owner_supplier"),
+        IndexModel([("connections._id", ASCENDING)], name="connections_id"),
+    ],
+    "partners": [
+        IndexModel([("owner", ASCENDING), ("partner_name", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_partner_name_id"),
+        IndexModel([("owner", ASCENDING), ("partner_type", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_partner_type_id"),
+        IndexModel([("owner", ASCENDING), ("country", ASCENDING), ("_id", ASCENDING)],
+                   name="owner_country_id"),
+    ],
+    "activities": [
+        # _id breaks timestamp ties for the keyset-paginated feed
+        IndexModel([("owner", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="owner_timestamp_id"),
+        # Archive retention scans it oldest first across owners (activity_log.apply_retention).
+        # Not plain (timestamp): that key is the TTL index's in ttl mode, with other options
+        IndexModel([("timestamp", ASCENDING), ("_id", ASCENDING)], name="timestamp_id"),
+    ],
+    "activities_archive": [
+        IndexModel([("owner", ASCENDING), ("timestamp", DESCENDING)], name="owner_timestamp"),
+    ],
+    "sales": [
+        # The pipeline engine's $lookup matches on product alone
+        IndexModel([("product", ASCENDING), ("_id", ASCENDING)], name="product_id"),
+        # sales_by_product and the sales modal: owner-scoped, per product in insertion order
+        IndexModel([("owner", ASCENDING), ("product", ASCENDING), ("_id", ASCENDING)], name="owner_product_id"),
+        IndexModel([("owner", ASCENDING), ("period", ASCENDING)], name="owner_period"),
+    ],
+    "packaging_rollups": [
+        IndexModel([("owner", ASCENDING), ("month", ASCENDING), ("level", ASCENDING), ("grade", ASCENDING)],
+                   name="owner_month_level_grade", unique=True),
+    ],
+    "component_types": _data_setup_indexes(),
+    "adhesives": _data_setup_indexes(),
+    "food_contacts": _data_setup_indexes(),
+    "coatings": _data_setup_indexes(),
+}
+
+
+def _differs(existing, model):
+    """True when an existing index (index_information entry) has other keys or uniqueness than declared."""
+    keys = [tuple(k) for k in existing["key"]]
+    return keys != list(model.document["key"].items()) or bool(existing.get("unique")) != bool(model.document.get("unique"))
+
+
+def ensure_indexes(db):
+    """
+    Creates every declared index. Returns {collection: [index names]}.
+    An index whose definition changed (e.g. made unique) is dropped and
+    recreated; if that fails the old one is put back and the error raised.
+    """
+    created = {}
+    for coll_name, models in INDEXES.items():
+        collection = db[coll_name]
+        info = collection.index_information()
+        for model in models:
+            name = model.document["name"]
+            if name in info and _differs(info[name], model):
+                collection.drop_index(name)
+                try:
+                    collection.create_indexes([model])
+                except OperationFailure:
+                    collection.create_index(info[name]["key"], name=name, unique=bool(info[name].get("unique")))
+                    raise
+        created[coll_name] = collection.create_indexes(models)
+    return created
+
+
+def _index_usage(collection):
+    """Returns {index name: ops} from $indexStats, or {} if the server refuses it."""
+    try:
+        return {s["name"]: s["accesses"]["ops"] for s in collection.aggregate([{"$indexStats": {}}])}
+    except OperationFailure:
+        return {}
+
+
+def check_indexes(db):
+    """
+    Compares the declared index set with what exists on the server.
+    Returns {"missing": [(collection, name)], "changed": [...], "undeclared": [...], "unused": [...]}.
+    `changed` lists indexes whose keys or uniqueness differ from the declaration;
+    `unused` lists declared indexes with zero recorded accesses since the last restart.
+    """
+    report = {"missing": [], "changed": [], "undeclared": [], "unused": []}
+    for coll_name, models in INDEXES.items():
+        collection = db[coll_name]
+        declared = {m.document["name"] for m in models}
+        info = collection.index_information()
+        existing = set(info.keys()) - {"_id_"}
+        usage = _index_usage(collection)
+
+        for name in sorted(declared - existing):
+            report["missing"].append((coll_name, name))
+        for model in models:
+            if model.document["name"] in existing and _differs(info[model.document["name"]], model):
+                report["changed"].append((coll_name, model.document["name"]))
+        for name in sorted(existing - declared):
+            if (coll_name, name) not in MANAGED_ELSEWHERE:
+                report["undeclared"].append((coll_name, name))
+        for name in sorted(declared & existing):
+            if usage.get(name) == 0:
+                report["unused"].append((coll_name, name))
+    return report
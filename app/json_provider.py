@@ -0,0 +1,82 @@
+# app/json_provider.py
+import dataclasses
+import decimal
+from datetime import date
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+# app.json (jsonify, request.get_json, the |tojson filter), replacing
+# Flask-PyMongo's provider, whose extended JSON ({"$oid": ...}, {"$date": ...})
+# the frontend can't use as is. The BSON types are encoded natively instead,
+# so views hand Mongo documents over as they are:
+# ObjectId -> hex string, datetime/date -> ISO 8601 (naive Mongo datetimes
+# stay naive, as .isoformat() left them), Decimal128 -> string, like Flask
+# does for Decimal. JSON_PROVIDER="orjson" uses orjson when it is installed
+# and falls back to "stdlib" (json with the same conversions) otherwise.
+# Keys keep their order unless sort_keys is asked for (Flask sorts by default).
+
+
+def _default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, Decimal128):
+        return str(o.to_decimal())
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """The stdlib provider with the BSON conversions above."""
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+
+class OrjsonProvider(MongoJSONProvider):
+    """orjson-backed; responses are written as bytes without a str round trip."""
+
+    def _option(self, sort_keys, indent):
+        option = orjson.OPT_NON_STR_KEYS  # json.dumps turns int keys into strings; orjson needs the flag
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        option = self._option(kwargs.get("sort_keys", self.sort_keys), kwargs.get("indent"))
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._option(self.sort_keys, indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {"stdlib": MongoJSONProvider}
+if orjson is not None:
+    JSON_PROVIDERS["orjson"] = OrjsonProvider
+
+
+def init_json(app):
+    name = app.config["JSON_PROVIDER"]
+    app.json = JSON_PROVIDERS.get(name, MongoJSONProvider)(app)
+    # Flask hands |tojson the provider it had at setup
+    app.jinja_env.policies["json.dumps_function"] = app.json.dumps
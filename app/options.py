@@ -0,0 +1,83 @@
+# app/options.py
+import re
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from .packagings import PACKAGING_LEVELS
+from .reference_data import REFERENCE_COLLECTIONS, reference_data
+
+# Option lists of the edit modals, fetched when a modal opens (see
+# static/js/lazy_options.js) instead of being rendered into every page.
+#
+# Catalog sources are one owner-scoped query sorted on the label, which the
+# (owner, label, _id) indexes serve; ?q= filters on the label and ?limit= caps
+# the list, so large catalogs are searched rather than scrolled. Ids in
+# ?selected= are always included, so a modal can show the current links even
+# when they fall outside the filter. The data setup lists come from the
+# reference cache.
+
+OPTION_SOURCES = {
+    # source: (collection, label field, {query arg: field})
+    "products": ("products", "product_code", {}),
+    "packagings": ("packagings", "package_code", {"level": "level"}),
+    "partners": ("partners", "partner_name", {"partner_type": "partner_type"}),
+}
+REFERENCE_SOURCES = tuple(REFERENCE_COLLECTIONS.values())
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+
+
+def _selected_ids(raw):
+    try:
+        return [ObjectId(value) for value in raw.split(",") if value]
+    except InvalidId:
+        raise ValueError("Invalid selected id")
+
+
+def option_list(db, owner_oid, source, args):
+    """
+    {"options": [{"value", "label"}, ...], "more": bool} for one source.
+    Packaging labels carry their level unless ?level= is given. Raises ValueError.
+    """
+    q = (args.get("q") or "").strip()
+    try:
+        limit = min(max(int(args.get("limit", DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise ValueError("Invalid limit")
+
+    if source in REFERENCE_SOURCES:
+        names = [item.get("name") or "" for item in reference_data(owner_oid)[source]]
+        matched = [name for name in names if q.lower() in name.lower()]
+        return {"options": [{"value": name, "label": name} for name in matched[:limit]], "more": len(matched) > limit}
+    if source not in OPTION_SOURCES:
+        raise ValueError(f"Unknown option list: {source}")
+
+    collection, label, filters = OPTION_SOURCES[source]
+    query = {"owner": owner_oid}
+    for arg, field in filters.items():
+        if args.get(arg):
+            query[field] = args[arg]
+    if "level" in query and query["level"] not in PACKAGING_LEVELS:
+        raise ValueError("Invalid packaging level")
+    if q:
+        query[label] = {"$regex": re.escape(q), "$options": "i"}
+    projection = {label: 1, "level": 1}
+
+    docs = list(db[collection].find(query, projection).sort([(label, 1), ("_id", 1)]).limit(limit + 1))
+    more = len(docs) > limit
+    docs = docs[:limit]
+
+    selected = _selected_ids(args.get("selected") or "")
+    listed = {doc["_id"] for doc in docs}
+    missing = [oid for oid in selected if oid not in listed]
+    if missing:
+        extra = db[collection].find({"owner": owner_oid, "_id": {"$in": missing}}, projection)
+        docs = sorted([*docs, *extra], key=lambda doc: (str(doc.get(label) or ""), str(doc["_id"])))
+
+    with_level = source == "packagings" and not args.get("level")
+    options = []
+    for doc in docs:
+        text = doc.get(label) or "—"
+        if with_level and doc.get("level"):
+            text = f"{text} ({doc['level']})"
+        options.append({"value": str(doc["_id"]), "label": text})
+    return {"options": options, "more": more}
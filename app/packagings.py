@@ -0,0 +1,82 @@
+# app/packagings.py
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# All packaging levels live in the `packagings` collection, tagged with `level`.
+# Documents keep the _id they had in the old per-level collections, so product
+# connections, partner links and client-side ids stay valid after the move.
+# Lists, search and exports only read `packagings`, so `flask migrate-packagings`
+# is a required deploy step; CHECK_LEGACY_PACKAGINGS=1 makes create_app() log an
+# error while legacy docs remain.
+
+PACKAGING_LEVELS = ("Primary", "Secondary", "Tertiary")
+LEGACY_COLLECTIONS = {level: f"{level.lower()}_packagings" for level in PACKAGING_LEVELS}
+
+
+def connection_field(level):
+    """Product field that points at a packaging of the given level."""
+    return f"connections.{level.lower()}_package"
+
+
+def find_packaging(db, owner_oid, package_oid, projection=None):
+    """
+    Looks up one of the owner's packagings by id.
+    A doc still sitting in an old per-level collection (migration not run yet)
+    is moved over on first access.
+    """
+    query = {"_id": package_oid, "owner": owner_oid}
+    package = db.packagings.find_one(query, projection)
+    if package is None and _move_legacy(db, query):
+        package = db.packagings.find_one(query, projection)
+    return package
+
+
+def _move_legacy(db, query):
+    for level, coll_name in LEGACY_COLLECTIONS.items():
+        doc = db[coll_name].find_one(query)
+        if doc:
+            doc["level"] = level
+            try:
+                db.packagings.insert_one(doc)
+            except DuplicateKeyError:
+                pass  # Already moved by a concurrent request or the migration
+            db[coll_name].delete_one({"_id": doc["_id"]})
+            return True
+    return False
+
+
+def legacy_packaging_counts(db):
+    """{level: docs} still in the old per-level collections; empty once migrated."""
+    counts = {}
+    for level, coll_name in LEGACY_COLLECTIONS.items():
+        count = db[coll_name].estimated_document_count()
+        if count:
+            counts[level] = count
+    return counts
+
+
+def migrate_legacy_packagings(db, owner_oid=None, batch_size=500):
+    """
+    Moves docs from the per-level collections into `packagings`, batch by batch.
+    Safe to run while the app is serving: a doc that already exists in
+    `packagings` (moved on access and maybe edited since) is kept, and the
+    legacy copy is only deleted after the insert. Returns {level: moved}.
+    """
+    query = {"owner": owner_oid} if owner_oid else {}
+    moved = {}
+    for level, coll_name in LEGACY_COLLECTIONS.items():
+        legacy = db[coll_name]
+        moved[level] = 0
+        while True:
+            batch = list(legacy.find(query).limit(batch_size))
+            if not batch:
+                break
+            for doc in batch:
+                doc["level"] = level
+            try:
+                db.packagings.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            legacy.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+            moved[level] += len(batch)
+    return moved
@@ -0,0 +1,309 @@
+# app/recyclability.py
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from flask import current_app
+from pymongo import UpdateOne
+from .dashboard_metrics import GRADES
+from .data_version import bump_version
+
+# Server-side recyclability grading.
+#
+# The questionnaires in templates/recyclability_forms are only the UI; the
+# rules live in recyclability_rules.json: per form, its questions, and per
+# option the question it leads to and its score (O, R, L, NR; other values
+# such as the Y/N branch answers don't affect the grade). The rules are
+# compiled into one decision table per form. A packaging keeps the answers
+# it was graded from, so a rules change is applied with
+# `flask regrade-recyclability` instead of every form being filled in again.
+#
+# The grade is the worst score among the answered questions on the path
+# actually taken: answers left behind in branches the user backed out of are
+# ignored. Like the forms, an option may lead to several questions or none.
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), "recyclability_rules.json")
+FORMS_DIR = os.path.join(os.path.dirname(__file__), "templates", "recyclability_forms")
+_QUESTION_CLASS = re.compile(r"\bquestion-\d+-\w+")
+
+
+class Questionnaire:
+    """One form's decision table: question -> (multiple choice?, ((grade rank or -1, next questions), ...))."""
+
+    def __init__(self, name, spec, scores):
+        self.name = name
+        self.start = spec["start"]
+        self.questions = {}
+        for qid, question in spec["questions"].items():
+            options = []
+            for option in question["options"]:
+                ranks = [GRADES.index(scores[token]) for token in option["value"].split() if token in scores]
+                options.append((max(ranks, default=-1), tuple(option.get("next", ()))))
+            self.questions[qid] = (question["type"] == "checkbox", tuple(options))
+        if self.start not in self.questions:
+            raise ValueError(f"{name}: start question {self.start} is not defined")
+
+    def grade(self, answers):
+        """
+        Grade for {question id: [option index, ...]}. Raises ValueError when the
+        first question is unanswered or an answer doesn't fit the rules.
+        """
+        if not answers.get(self.start):
+            raise ValueError("Please answer the first question.")
+        worst, seen, pending = 0, set(), [self.start]
+        while pending:
+            qid = pending.pop()
+            if qid in seen or qid not in self.questions:
+                continue
+            seen.add(qid)
+            multiple, options = self.questions[qid]
+            picked = answers.get(qid) or []
+            if not multiple and len(picked) > 1:
+                raise ValueError(f"Question {qid.split('-')[1]} takes a single answer.")
+            for index in picked:
+                if not isinstance(index, int) or not 0 <= index < len(options):
+                    raise ValueError(f"Invalid answer for question {qid.split('-')[1]}.")
+                rank, next_qids = options[index]
+                worst = max(worst, rank)
+                pending.extend(next_qids)
+        return GRADES[worst]
+
+
+class Rules:
+    def __init__(self, data):
+        self.version = data["version"]
+        self.forms = {name: Questionnaire(name, spec, data["scores"]) for name, spec in data["forms"].items()}
+
+    def grade(self, form, answers):
+        if form not in self.forms:
+            raise ValueError(f"Unknown recyclability form: {form}")
+        return self.forms[form].grade(answers)
+
+
+_rules = None
+
+
+def load_rules(path=None):
+    """The compiled rules; the default file is read once per process."""
+    global _rules
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return Rules(json.load(f))
+    if _rules is None:
+        with open(RULES_PATH, encoding="utf-8") as f:
+            _rules = Rules(json.load(f))
+    return _rules
+
+
+def parse_answers(form, raw):
+    """
+    Validates a posted {"form", "answers"} pair (answers as a dict or its JSON
+    text) and returns (grade, the document stored on the packaging).
+    """
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            raise ValueError("Answers are not valid JSON.")
+    if not isinstance(raw, dict):
+        raise ValueError("Answers must map questions to option indexes.")
+    answers = {}
+    for qid, picked in raw.items():
+        if not isinstance(picked, list) or not all(type(i) is int for i in picked):
+            raise ValueError("Answers must map questions to option indexes.")
+        if picked:
+            answers[str(qid)] = sorted(set(picked))
+    rules = load_rules()
+    grade = rules.grade(form, answers)
+    return grade, {"form": form, "answers": answers, "rules_version": rules.version}
+
+
+# --- Batch regrading ---
+
+def regrade_owner(db, owner_oid, rules=None):
+    """
+    Re-evaluates every packaging of one owner that has stored answers.
+    Returns {"checked", "changed", "invalid", "changed_ids"}; invalid answers keep their grade.
+    """
+    rules = rules or load_rules()
+    report = {"checked": 0, "changed": 0, "invalid": 0, "changed_ids": []}
+    ops = []
+    cursor = db.packagings.find(
+        {"owner": owner_oid, "recyclability_answers": {"$exists": True}},
+        {"recyclability": 1, "recyclability_answers": 1},
+    )
+    for package in cursor:
+        report["checked"] += 1
+        stored = package["recyclability_answers"]
+        try:
+            grade = rules.grade(stored.get("form"), stored.get("answers") or {})
+        except ValueError:
+            report["invalid"] += 1
+            continue
+        if grade == package.get("recyclability") and stored.get("rules_version") == rules.version:
+            continue
+        if grade != package.get("recyclability"):
+            report["changed"] += 1
+            report["changed_ids"].append(package["_id"])
+        ops.append(UpdateOne(
+            {"_id": package["_id"]},
+            {"$set": {"recyclability": grade, "recyclability_answers.rules_version": rules.version}},
+        ))
+    if ops:
+        db.packagings.bulk_write(ops, ordered=False)
+        bump_version(db, owner_oid)
+    return report
+
+
+def regrade_all(db, owner_oids, workers=4, rules=None, on_done=None):
+    """
+    Runs regrade_owner for every owner on a thread pool (the work is mostly
+    waiting on Mongo). `on_done(owner_oid, report)` is called as owners finish,
+    from the worker thread. Returns {owner_oid: report}.
+    """
+    rules = rules or load_rules()
+
+    def run(owner_oid):
+        report = regrade_owner(db, owner_oid, rules)
+        if on_done:
+            on_done(owner_oid, report)
+        return owner_oid, report
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(pool.map(run, owner_oids))
+
+
+# --- Rules vs. forms ---
+
+class _FormParser(HTMLParser):
+    """Collects question blocks and their inputs from a questionnaire template."""
+
+    def __init__(self):
+        super().__init__()
+        self.questions = {}  # qid -> {"text", "type", "options": [{"value", "next", "label"}]}
+        self._question = None
+        self._text = None  # list collecting the current label's text
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = attrs.get("class") or ""
+        if tag == "div" and "question-block" in classes.split():
+            match = _QUESTION_CLASS.search(classes)
+            qid = match.group(0) if match else f"question-{len(self.questions) + 1}"
+            self._question = self.questions.setdefault(qid, {"text": "", "type": None, "options": []})
+        elif tag == "input" and self._question is not None and attrs.get("type") in ("radio", "checkbox"):
+            self._question["type"] = attrs["type"]
+            option = {"value": attrs.get("value", "").strip(), "label": ""}
+            if attrs.get("data-next"):
+                option["next"] = attrs["data-next"].split()
+            self._question["options"].append(option)
+        elif tag == "label" and self._question is not None:
+            self._text = []
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "label" and self._text is not None and self._question is not None:
+            text = " ".join("".join(self._text).split())
+            if not self._question["options"] and not self._question["text"]:
+                self._question["text"] = text
+            elif self._question["options"] and not self._question["options"][-1]["label"]:
+                self._question["options"][-1]["label"] = text
+            self._text = None
+
+
+def form_questions(html):
+    """{question id: {"text", "type", "options"}} as laid out in a questionnaire template."""
+    parser = _FormParser()
+    parser.feed(html)
+    return parser.questions
+
+
+def check_forms(rules_data, forms_dir=FORMS_DIR):
+    """
+    Lists the differences between the rules and the questionnaire templates
+    (questions, option counts, values and next questions) as strings.
+    """
+    problems = []
+    for name, spec in rules_data["forms"].items():
+        path = os.path.join(forms_dir, f"{name}.html")
+        if not os.path.exists(path):
+            problems.append(f"{name}: no template {path}")
+            continue
+        with open(path, encoding="utf-8") as f:
+            questions = form_questions(f.read())
+        for qid in sorted(set(questions) ^ set(spec["questions"])):
+            where = "template" if qid in questions else "rules"
+            problems.append(f"{name}: {qid} only in the {where}")
+        for qid, question in spec["questions"].items():
+            if qid not in questions:
+                continue
+            # A next question missing from the template is a dead end in the form too
+            expected = [(o["value"], [n for n in o.get("next", ()) if n in questions]) for o in question["options"]]
+            actual = [(o["value"], [n for n in o.get("next", ()) if n in questions]) for o in questions[qid]["options"]]
+            if question["type"] != questions[qid]["type"] or expected != actual:
+                problems.append(f"{name}: {qid} differs from the template")
+    return problems
+
+
+# --- Questionnaire fragments ---
+# The templates are static, so they are rendered once at startup and served
+# from memory with strong ETags, one by one or as a single JSON bundle the
+# modal fetches once per version (see static/js/recyclability_forms.js).
+
+# Material name patterns -> form, most specific first; the modal picks the first match
+FORM_MATERIALS = (
+    (("beverage carton",), "beverage_carton"),
+    (("flexible plastic pp", "flexible pp"), "flexible_plastic_pp"),
+    (("flexible plastic pe", "flexible pe"), "flexible_plastic_pe"),
+    (("flexible plastic other", "flexible other"), "flexible_plastic_other"),
+    (("rigid plastic pet bottle", "rigid pet bottle"), "rigid_plastic_pet_bottle"),
+    (("rigid plastic pe/pp", "rigid pe/pp"), "rigid_plastic_pe_pp"),
+    (("rigid plastic other pet", "rigid other pet"), "rigid_plastic_other_pet"),
+    (("rigid plastic other plastic", "rigid other plastic"), "rigid_plastic_other_plastic"),
+    (("metal aluminium", "metal aluminum"), "metal_aluminium"),
+    (("metal steel",), "metal_steel"),
+    (("paper", "cardboard"), "paper_cardboard"),
+    (("glass",), "glass"),
+)
+
+
+def _etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+class FormFragments:
+    """Rendered questionnaires: name -> (HTML bytes, ETag), plus the JSON bundle and its version."""
+
+    def __init__(self, jinja_env, forms_dir=FORMS_DIR):
+        self.forms = {}
+        for filename in sorted(os.listdir(forms_dir)):
+            if filename.endswith(".html"):
+                body = jinja_env.get_template(f"recyclability_forms/{filename}").render().encode("utf-8")
+                self.forms[filename[:-len(".html")]] = (body, _etag(body))
+        bundle = {
+            "materials": [[list(patterns), name] for patterns, name in FORM_MATERIALS if name in self.forms],
+            "forms": {name: body.decode("utf-8") for name, (body, _) in self.forms.items()},
+        }
+        self.bundle = json.dumps(bundle, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.version = _etag(self.bundle)
+
+    def get(self, name):
+        """(HTML bytes, ETag) for a form name, with or without .html; None if unknown."""
+        if name.endswith(".html"):
+            name = name[:-len(".html")]
+        return self.forms.get(name)
+
+
+def init_form_fragments(app):
+    fragments = FormFragments(app.jinja_env)
+    app.extensions["recyclability_forms"] = fragments
+    app.jinja_env.globals["recyclability_forms_version"] = fragments.version
+
+
+def form_fragments() -> FormFragments:
+    return current_app.extensions["recyclability_forms"]
@@ -0,0 +1,105 @@
+# app/reference_data.py
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from . import mongo
+from .data_version import read_version
+
+# Data setup lists shown in the packaging modals: form `type` -> collection name
+REFERENCE_COLLECTIONS = {
+    "component_type": "component_types",
+    "adhesive": "adhesives",
+    "food_contact": "food_contacts",
+    "coating": "coatings",
+}
+
+# With REFERENCE_CACHE_SHARED each entry is stamped with the tenant's data
+# version (data_version.py), which every write moves on, so the other gunicorn
+# workers reload their copy; the worker that served the change drops its own.
+
+
+class ReferenceCache:
+    """
+    In-process cache of an owner's data setup lists, with TTL and LRU eviction.
+    The cached lists are shared between requests; callers must treat them as read-only.
+    """
+
+    def __init__(self, ttl=300, max_entries=256, shared=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries = OrderedDict()  # owner -> (expires_at, version, lists)
+        self._lock = threading.Lock()
+        self._epoch = 0  # bumped by local invalidations; guards against storing stale loads
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _version(self, owner_oid):
+        if not self.shared:
+            return None
+        return read_version(mongo.db, owner_oid)[0]
+
+    @staticmethod
+    def _load(owner_oid):
+        return {
+            coll_name: list(mongo.db[coll_name].find({"owner": owner_oid}).sort("name", 1))
+            for coll_name in REFERENCE_COLLECTIONS.values()
+        }
+
+    def get(self, owner_oid):
+        """Returns {collection name: [docs sorted by name]} for the owner."""
+        if self.ttl <= 0:
+            return self._load(owner_oid)
+
+        # Read the version before the lists, so a concurrent bump is never missed
+        version = self._version(owner_oid)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(owner_oid)
+            if entry and entry[0] > now and entry[1] == version:
+                self._entries.move_to_end(owner_oid)
+                self.stats["hits"] += 1
+                return entry[2]
+            self.stats["misses"] += 1
+            epoch = self._epoch
+
+        lists = self._load(owner_oid)
+        with self._lock:
+            if epoch == self._epoch:
+                self._entries[owner_oid] = (now + self.ttl, version, lists)
+                self._entries.move_to_end(owner_oid)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return lists
+
+    def invalidate(self, owner_oid):
+        """Drops the owner's entry here; other workers see the data version move (shared mode)."""
+        with self._lock:
+            self._entries.pop(owner_oid, None)
+            self._epoch += 1
+            self.stats["invalidations"] += 1
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
+
+
+def init_reference_cache(app):
+    app.extensions["reference_cache"] = ReferenceCache(
+        ttl=app.config["REFERENCE_CACHE_TTL"],
+        max_entries=app.config["REFERENCE_CACHE_SIZE"],
+        shared=app.config["REFERENCE_CACHE_SHARED"],
+    )
+
+
+def reference_cache() -> ReferenceCache:
+    return current_app.extensions["reference_cache"]
+
+
+def reference_data(owner_oid):
+    """Template kwargs for the data setup lists: component_types, adhesives, food_contacts, coatings."""
+    return reference_cache().get(owner_oid)
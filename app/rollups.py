@@ -0,0 +1,320 @@
+# app/rollups.py
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import DeleteMany, InsertOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from . import mongo
+from .sales import with_sales
+from .dashboard_metrics import (
+    GRADES, LEVELS, iter_packaging_units, finalize_metrics, _empty_grades, _package_unit_weight
+)
+
+# packaging_rollups documents:
+#   {owner, month: "YYYY-MM", level, grade, units, grams}
+# level/grade are "" on the per-month marker row, whose `units` counts the sales
+# in that month (so the trend keeps months that have no graded packaging).
+#
+# Writes that move the rollups (sales, product <-> packaging links, the graded
+# packaging fields) run inside track_rollups(). It holds the owner's lease in
+# rollup_locks, so they run one at a time per owner across workers, and the
+# write records the rows it changed (the sale, the relinked products, the
+# packaging before and after) in a RollupDelta. Only those rows' products are
+# read, and their difference is $inc'ed into packaging_rollups on exit.
+
+PACKAGE_KEYS = {
+    "Primary": "primary_package",
+    "Secondary": "secondary_package",
+    "Tertiary": "tertiary_package",
+}
+# What iter_packaging_units reads from a packaging doc
+GRADED_PACKAGING_FIELDS = {"level": 1, "recyclability": 1, "materials": 1,
+                           "quantity_primary_in_secondary_unit": 1, "quantity_secondary_in_tertiary_unit": 1}
+SALE_UNIT_FIELDS = {"year": 1, "month": 1, "quantity": 1}
+LOCK_LEASE = timedelta(seconds=30)  # A lease left by a crashed worker expires
+LOCK_WAIT = 2  # seconds a web request waits for the owner's lease
+REBUILD_LOCK_WAIT = 60  # seconds
+
+
+def rollups_enabled():
+    return current_app.config.get("DASHBOARD_ENGINE") == "rollup"
+
+
+def _load_packages(db, owner_oid, products):
+    """Fetches only the packaging docs the given products are connected to."""
+    ids = {p.get("connections", {}).get(key) for p in products for key in PACKAGE_KEYS.values()}
+    oids = [ObjectId(i) for i in ids if i and ObjectId.is_valid(i)]
+    if not oids:
+        return {}
+    return {
+        str(pkg["_id"]): pkg
+        for pkg in db.packagings.find({"_id": {"$in": oids}, "owner": owner_oid}, GRADED_PACKAGING_FIELDS)
+    }
+
+
+def _add_units(totals, product, packages, sign=1):
+    """Adds (sign=1) or takes off (sign=-1) a product's packaging units."""
+    for sale_date, level, grade, units, grams in iter_packaging_units(product, packages):
+        month = f"{sale_date.year}-{sale_date.month:02d}"
+        if level is None:
+            totals[(month, "", "")][0] += sign
+        elif grade in GRADES:
+            entry = totals[(month, level, grade)]
+            entry[0] += sign * units
+            entry[1] += sign * grams
+
+
+def contributions(db, owner_oid, product_filter=None):
+    """Returns {(month, level, grade): [units, grams]} for the owner's products matching the filter."""
+    query = {"owner": owner_oid, **(product_filter or {})}
+    products = list(db.products.find(query, {"connections": 1}))
+    products = with_sales(db, owner_oid, products, all_products=product_filter is None)
+    packages = _load_packages(db, owner_oid, products)
+
+    totals = defaultdict(lambda: [0, 0.0])
+    for product in products:
+        _add_units(totals, product, packages)
+    return totals
+
+
+def apply_delta(db, owner_oid, delta):
+    """$inc's a {(month, level, grade): [units, grams]} delta into packaging_rollups."""
+    ops = [
+        UpdateOne(
+            {"owner": owner_oid, "month": month, "level": level, "grade": grade},
+            {"$inc": {"units": units, "grams": grams}},
+            upsert=True,
+        )
+        for (month, level, grade), (units, grams) in delta.items()
+        if units or grams
+    ]
+    if ops:
+        db.packaging_rollups.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def _renew(db, owner_oid, token):
+    """Pushes the lease's expiry out; False once it has expired and another worker took it."""
+    result = db.rollup_locks.update_one(
+        {"_id": owner_oid, "token": token},
+        {"$set": {"expires": datetime.now(timezone.utc) + LOCK_LEASE}},
+    )
+    return result.matched_count == 1
+
+
+@contextmanager
+def owner_lock(db, owner_oid, wait=LOCK_WAIT, keep_alive=False):
+    """
+    Holds the owner's lease in rollup_locks while the block runs and yields a
+    callable that renews it (False if it was lost). With keep_alive a
+    background thread also renews it every third of LOCK_LEASE.
+    """
+    token = ObjectId()
+    deadline = time.monotonic() + wait
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            # Matches only an expired lease; otherwise the upsert hits the existing _id
+            db.rollup_locks.update_one(
+                {"_id": owner_oid, "expires": {"$lt": now}},
+                {"$set": {"token": token, "expires": now + LOCK_LEASE}},
+                upsert=True,
+            )
+            break
+        except DuplicateKeyError:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Packaging rollups are busy, please try again.")
+            time.sleep(0.02)
+
+    stop = threading.Event()
+    if keep_alive:
+        def heartbeat():
+            while not stop.wait(LOCK_LEASE.total_seconds() / 3):
+                if not _renew(db, owner_oid, token):
+                    return
+        threading.Thread(target=heartbeat, name="rollup-lease", daemon=True).start()
+    try:
+        yield lambda: _renew(db, owner_oid, token)
+    finally:
+        stop.set()
+        db.rollup_locks.delete_one({"_id": owner_oid, "token": token})
+
+
+def _links(product):
+    connections = product.get("connections", {})
+    return tuple(connections.get(key) for key in PACKAGE_KEYS.values())
+
+
+def _graded(package):
+    """The packaging values the rollups depend on."""
+    return (
+        str(package.get("recyclability") or "N/A").strip().upper(),
+        _package_unit_weight(package),
+        package.get("quantity_primary_in_secondary_unit", 1),
+        package.get("quantity_secondary_in_tertiary_unit", 1),
+    )
+
+
+def _after_write(method):
+    # The write itself succeeded by then; `flask rebuild-rollups` repairs the drift
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.enabled:
+            return
+        try:
+            method(self, *args, **kwargs)
+        except Exception as e:
+            current_app.logger.warning("Failed to update packaging rollups: %s", e)
+    return wrapper
+
+
+class RollupDelta:
+    """The rows changed by one track_rollups() block; every method is a no-op when rollups are off."""
+
+    def __init__(self, db, owner_oid, enabled):
+        self.db = db
+        self.owner = owner_oid
+        self.enabled = enabled
+        self.totals = defaultdict(lambda: [0, 0.0])
+
+    @_after_write
+    def sale(self, product_oid, before=None, after=None):
+        """A sale inserted (no `before`), updated, or deleted (no `after`); docs need year, month, quantity."""
+        product = self.db.products.find_one({"_id": product_oid, "owner": self.owner}, {"connections": 1})
+        if product is None:
+            return
+        packages = _load_packages(self.db, self.owner, [product])
+        if before:
+            _add_units(self.totals, {**product, "sales": [before]}, packages, -1)
+        if after:
+            _add_units(self.totals, {**product, "sales": [after]}, packages)
+
+    @_after_write
+    def packaging_updated(self, before, fields):
+        """A packaging doc (GRADED_PACKAGING_FIELDS) as it was before `$set: fields`."""
+        if before is None:
+            return
+        after = {**before, **fields}
+        if _graded(before) == _graded(after):
+            return
+        package_id = str(before["_id"])
+        products = list(self.db.products.find(
+            {"owner": self.owner, f"connections.{PACKAGE_KEYS[before['level']]}": package_id},
+            {"connections": 1}
+        ))
+        if not products:
+            return
+        products = with_sales(self.db, self.owner, products)
+        packages = _load_packages(self.db, self.owner, products)
+        for product in products:
+            _add_units(self.totals, product, {**packages, package_id: before}, -1)
+            _add_units(self.totals, product, {**packages, package_id: after})
+
+    def remove_products(self, product_filter):
+        """Call before deleting the matching products and their sales."""
+        if not self.enabled:
+            return
+        for key, (units, grams) in contributions(self.db, self.owner, product_filter).items():
+            entry = self.totals[key]
+            entry[0] -= units
+            entry[1] -= grams
+
+    @contextmanager
+    def relinked(self, product_filter):
+        """Wraps a write that changes the packaging links of the matching products."""
+        if not self.enabled:
+            yield
+            return
+        before = {p["_id"]: p for p in self.db.products.find({"owner": self.owner, **product_filter}, {"connections": 1})}
+        # Read now: the write may delete a packaging these products are linked to
+        old_packages = _load_packages(self.db, self.owner, before.values())
+        yield
+        self._relink(before, old_packages)
+
+    @_after_write
+    def _relink(self, before, old_packages):
+        after = {p["_id"]: p for p in self.db.products.find(
+            {"owner": self.owner, "_id": {"$in": list(before)}}, {"connections": 1}
+        )}
+        changed = [before[oid] for oid in after if _links(before[oid]) != _links(after[oid])]
+        if not changed:
+            return
+        new_packages = _load_packages(self.db, self.owner, [after[p["_id"]] for p in changed])
+        for product in with_sales(self.db, self.owner, changed):
+            _add_units(self.totals, product, old_packages, -1)
+            _add_units(self.totals, {**product, "connections": after[product["_id"]].get("connections", {})}, new_packages)
+
+
+@contextmanager
+def track_rollups(owner_oid):
+    """
+    Runs a write that changes the owner's rollups, serialized per owner, and
+    yields the RollupDelta it records the changed rows in; applied on exit.
+    """
+    if not rollups_enabled():
+        yield RollupDelta(mongo.db, owner_oid, enabled=False)
+        return
+    with owner_lock(mongo.db, owner_oid):
+        delta = RollupDelta(mongo.db, owner_oid, enabled=True)
+        yield delta
+        try:
+            apply_delta(mongo.db, owner_oid, delta.totals)
+        except Exception as e:
+            current_app.logger.warning("Failed to update packaging rollups: %s", e)
+
+
+def packaging_filter(level, package_id):
+    """Product filter for every product connected to the given packaging."""
+    return {f"connections.{PACKAGE_KEYS[level]}": package_id}
+
+
+def rebuild_rollups(db, owner_oid):
+    """Recomputes an owner's rollups from the raw sales. Returns the number of rows written."""
+    # Writers wait on the lease, so it is kept alive for however long the sales scan takes
+    with owner_lock(db, owner_oid, wait=REBUILD_LOCK_WAIT, keep_alive=True) as renew:
+        totals = contributions(db, owner_oid)
+        ops = [DeleteMany({"owner": owner_oid})]
+        for (month, level, grade), (units, grams) in totals.items():
+            ops.append(InsertOne({"owner": owner_oid, "month": month, "level": level, "grade": grade,
+                                  "units": units, "grams": grams}))
+        # A writer that took an expired lease may have $inc'ed rows this would overwrite
+        if not renew():
+            raise RuntimeError("Lost the packaging rollups lease during the rebuild; run it again.")
+        db.packaging_rollups.bulk_write(ops, ordered=True)
+    return len(ops) - 1
+
+
+def compute_metrics_rollup(db, owner_oid, start_date=None, end_date=None, packaging_levels=LEVELS):
+    """Builds the dashboard maps from packaging_rollups instead of the raw sales."""
+    query = {"owner": owner_oid}
+    month_range = {}
+    if start_date:
+        month_range["$gte"] = f"{start_date.year}-{start_date.month:02d}"
+    if end_date:
+        month_range["$lte"] = f"{end_date.year}-{end_date.month:02d}"
+    if month_range:
+        query["month"] = month_range
+
+    packaging_qty_by_grade = _empty_grades(0)
+    packaging_weight_by_grade = _empty_grades(0.0)
+    packaging_trend = {}
+    for row in db.packaging_rollups.find(query, {"_id": 0, "owner": 0}):
+        if row["level"] == "":
+            if row["units"] > 0:
+                packaging_trend.setdefault(row["month"], _empty_grades(0))
+            continue
+        if row["level"] not in packaging_levels or row["grade"] not in GRADES:
+            continue
+        if row["units"] == 0 and row["grams"] == 0:
+            continue
+        month = packaging_trend.setdefault(row["month"], _empty_grades(0))
+        month[row["grade"]] += row["units"]
+        packaging_qty_by_grade[row["grade"]] += row["units"]
+        packaging_weight_by_grade[row["grade"]] += row["grams"]
+
+    return finalize_metrics(packaging_qty_by_grade, packaging_weight_by_grade, packaging_trend)
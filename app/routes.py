@@ -6,55 +6,81 @@ from wtforms.validators import DataRequired
 from werkzeug.security import check_password_hash
 from flask_login import login_user, logout_user, login_required, UserMixin, current_user
 from bson.objectid import ObjectId
-from flask import request, jsonify
+from pymongo.errors import DuplicateKeyError
+from flask import request, jsonify, current_app, Response, stream_with_context
 from . import mongo, login_manager
+from .dashboard_metrics import compute_metrics_python, compute_metrics_pipeline
+from . import dashboard_numpy
+from .rollups import (
+    track_rollups, packaging_filter, compute_metrics_rollup, GRADED_PACKAGING_FIELDS, SALE_UNIT_FIELDS
+)
+from .reference_data import reference_data, reference_cache
+from .activity_log import activity_writer, activity_page, parse_cursor
+from .user_cache import user_cache
+from .packagings import PACKAGING_LEVELS, connection_field, find_packaging
+from .connections import (
+    plan_product_packagings, plan_packaging_products, plan_partner_connections, plan_delete_product
+)
+from .catalog import (
+    form_dimensions, form_components, build_product, build_packaging, product_update, packaging_update
+)
+from .bulk_import import IMPORT_KINDS, import_rows, read_rows
+from .export import EXPORT_KINDS, EXPORT_FORMATS, export_lines
+from .search import SEARCH_TYPES, search_catalog, search_index, matching_ids
+from .tables import TABLES, StreamedPage, parse_table_args, table_page
+from .streaming import stream_page
+from .options import option_list
+from .recyclability import parse_answers, form_fragments
+from .data_version import bump_version, versioned_json, response_cache
+from .compression import compressor
+from .warmup import startup_report
+from .sales import SALE_FIELDS, PERIOD_EXPR, new_sale, sale_period, resolve_sale_ref, with_sales
 from datetime import datetime, timezone
-import math
+import time
 
 main_bp = Blueprint("main", __name__)
 
+# Projections for the products page tables (see tables.py) and the in-process
+# dashboard engines (_dashboard_metrics).
+PRODUCT_LIST_FIELDS = (
+    "product_code", "secondary_product_code", "connections", "product_category", "product_description",
+    "product_material", "product_shape", "volume_cm3", "product_volume"
+)
+DASHBOARD_PRODUCT_FIELDS = ("product_code", "connections")
+# Packaging rows and edit modals read these
+PACKAGING_VIEW_FIELDS = (
+    "package_code", "code", "materials", "supplier", "connections", "recyclability",
+    "quantity_primary_in_secondary_unit", "quantity_secondary_in_tertiary_unit"
+)
+PARTNER_LIST_FIELDS = ("partner_name", "partner_type", "country", "email", "phone_number", "address", "connections")
+
+# Views that change searchable catalog fields; see invalidate_catalog_caches()
+CATALOG_WRITE_ENDPOINTS = {
+    "main.add_product", "main.update_product", "main.delete_product",
+    "main.add_packaging", "main.update_packaging", "main.delete_packaging", "main.update_packaging_recyclability",
+    "main.add_partner", "main.update_partner", "main.delete_partner",
+    "main.import_data",
+}
+
 # --- Helpers ---
-def _safe_float(value):
-    try:
-        return float(value) if value not in (None, '') else None
-    except (TypeError, ValueError):
-        return None
-
-def calculate_volume(shape, dimensions):
-    """Return volume in cm^3 for supported shapes, or None if inputs are incomplete."""
-    if shape == 'rectangular':
-        length = _safe_float(dimensions.get('length'))
-        width = _safe_float(dimensions.get('width'))
-        height = _safe_float(dimensions.get('height'))
-        if None not in (length, width, height):
-            return length * width * height
-    elif shape == 'cylinder':
-        radius = _safe_float(dimensions.get('radius'))
-        height = _safe_float(dimensions.get('height'))
-        if None not in (radius, height):
-            return math.pi * (radius ** 2) * height
-    elif shape == 'sphere':
-        radius = _safe_float(dimensions.get('radius'))
-        if radius is not None:
-            return (4 / 3) * math.pi * (radius ** 3)
-    elif shape == 'other':
-        volume = _safe_float(dimensions.get('volume'))
-        if volume is not None:
-            return volume
-    return None
-
-def _log_activity(activity_type: str, description: str):
-    """Inserts an activity record for the current user."""
-    try:
-        mongo.db.activities.insert_one({
-            "owner": ObjectId(current_user.id),
-            "type": activity_type,
-            "description": description,
-            "timestamp": datetime.now(timezone.utc)
-        })
-    except Exception as e:
-        # In a real app, you might want to log this error to a file
-        print(f"Failed to log activity: {e}")
+def _log_activity(activity_type: str, description: str, changes=None):
+    """
+    Queues an activity record for the current user (written in batches, see activity_log.py).
+    `changes` is a ConnectionPlan's record of the links it changed (see connections.py).
+    """
+    activity = {
+        "owner": ObjectId(current_user.id),
+        "type": activity_type,
+        "description": description,
+        "timestamp": datetime.now(timezone.utc)
+    }
+    if changes is not None:
+        activity["changes"] = changes
+    activity_writer().submit(activity)
+
+
+def _links_changed(changes):
+    return f"{len(changes)} link(s) changed"
 
 # --- User model ---
 class User(UserMixin):
@@ -67,7 +93,7 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
+    user = user_cache().get(user_id)
     return User(user) if user else None
 
 # --- WTForm ---
@@ -76,6 +102,24 @@ class LoginForm(FlaskForm):
     password = PasswordField("Password", validators=[DataRequired()])
     submit = SubmitField("Log In")
 
+@main_bp.after_request
+def invalidate_catalog_caches(response):
+    """Drops this worker's search index after a catalog write (the others see the data version move)."""
+    if request.endpoint in CATALOG_WRITE_ENDPOINTS and current_user.is_authenticated:
+        search_index().invalidate(ObjectId(current_user.id))
+    return response
+
+@main_bp.teardown_request
+def bump_data_version(exc):
+    """
+    Every mutating request moves the tenant's data version on, whatever its
+    outcome (a failed request may still have written); see data_version.py.
+    """
+    if request.method in ("GET", "HEAD", "OPTIONS") or request.endpoint == "main.login":
+        return
+    if current_user.is_authenticated:
+        bump_version(mongo.db, ObjectId(current_user.id))
+
 @main_bp.route("/", methods=["GET", "POST"])
 def login():
     login_form = LoginForm()
@@ -87,6 +131,7 @@ def login():
         if user:
             if check_password_hash(user["password"], raw_password):
                 login_user(User(user))
+                user_cache().prime(user)
                 return redirect(url_for("main.dashboard"))
             flash("Incorrect password.", "danger")
         else:
@@ -139,161 +184,192 @@ def pick_component_type_text(pkg: dict) -> str:
         return ", ".join(uniq[:3]) if uniq else "—"
     return "—"
 
+def _product_list_row(product: dict) -> dict:
+    """Products table row: the listed fields plus the packaging status column."""
+    connections = product.get("connections", {})
+    missing_count = sum(1 for key in ("primary_package", "secondary_package", "tertiary_package")
+                        if not connections.get(key))
+    row = {field: product.get(field) for field in PRODUCT_LIST_FIELDS if field in product}
+    row["_id"] = str(product["_id"])
+    if missing_count == 0:
+        row["packaging_status"] = "Connected"
+        row["packaging_status_color"] = "green"
+    else:
+        row["packaging_status"] = f"Missing ({missing_count})"
+        row["packaging_status_color"] = "red"
+    return row
+
+
+def _packaging_list_rows(packages: list, owner_oid) -> list:
+    """Packaging table rows; supplier names are looked up for this page only."""
+    supplier_oids = [ObjectId(p["supplier"]) for p in packages if p.get("supplier") and ObjectId.is_valid(p["supplier"])]
+    supplier_map = {
+        str(p["_id"]): p.get("partner_name", "Unknown")
+        for p in mongo.db.partners.find({"_id": {"$in": supplier_oids}, "owner": owner_oid}, {"partner_name": 1})
+    } if supplier_oids else {}
+    return [{
+        "_id": str(pkg.get("_id")),
+        "package_code": pkg.get("package_code") or pkg.get("code") or "—",
+        "level": pkg.get("level"),  # Primary / Secondary / Tertiary
+        "component_type": pick_component_type_text(pkg),
+        "material": pick_material_text(pkg),
+        "supplier": supplier_map.get(str(pkg.get("supplier")), "—"),
+        "products_using": len(pkg.get("connections", [])),
+        "recyclability": (pkg.get("recyclability") or "—"),
+    } for pkg in packages]
+
+
+def _partner_list_row(partner: dict) -> dict:
+    row = {field: partner.get(field) for field in PARTNER_LIST_FIELDS if field != "connections"}
+    row["_id"] = str(partner["_id"])
+    row["linked_count"] = len(partner.get("connections") or [])
+    return row
+
+
+def _table_filter(table: str, owner_oid, args) -> dict:
+    """Owner-scoped query for a products page table from its filter args (?q= uses the search index)."""
+    query = {"owner": owner_oid}
+    if table == "products":
+        status = args.get("status")
+        keys = [connection_field(level) for level in PACKAGING_LEVELS]
+        if status == "connected":
+            query.update({key: {"$nin": ["", None]} for key in keys})
+        elif status == "missing":
+            query["$or"] = [{key: {"$in": ["", None]}} for key in keys]
+        if args.get("category"):
+            query["product_category"] = args["category"]
+    elif table == "packagings":
+        if args.get("level"):
+            query["level"] = args["level"]
+        recyclability = args.get("recyclability")
+        if recyclability == "missing":
+            query["recyclability"] = {"$in": ["", None, "—"]}
+        elif recyclability:
+            query["recyclability"] = recyclability
+        if args.get("supplier"):
+            query["supplier"] = args["supplier"]
+    elif table == "partners":
+        if args.get("partner_type"):
+            query["partner_type"] = args["partner_type"]
+
+    if args.get("q"):
+        hit_type = {"products": "product", "packagings": "packaging", "partners": "partner"}[table]
+        query["_id"] = {"$in": matching_ids(owner_oid, args["q"], hit_type)}
+    return query
+
+
+def _table_query(table: str, owner_oid, args) -> tuple:
+    """(query, sort, direction, after, limit, projection, docs -> rows) for one page of a products page table."""
+    sort, direction, after, limit = parse_table_args(table, args, current_app.config["TABLE_PAGE_SIZE"])
+    projection = {
+        "products": PRODUCT_LIST_FIELDS,
+        "packagings": PACKAGING_VIEW_FIELDS + ("level",),
+        "partners": PARTNER_LIST_FIELDS,
+    }[table]
+    return (_table_filter(table, owner_oid, args), sort, direction, after, limit,
+            {field: 1 for field in projection}, lambda docs: _table_row_dicts(table, docs, owner_oid))
+
+
+def _table_row_dicts(table: str, docs: list, owner_oid) -> list:
+    if table == "products":
+        return [_product_list_row(doc) for doc in docs]
+    if table == "packagings":
+        return _packaging_list_rows(docs, owner_oid)
+    return [_partner_list_row(doc) for doc in docs]
+
+
+def _table_rows(table: str, owner_oid, args) -> tuple:
+    """Returns (rows, next cursor) for one page of a products page table."""
+    query, sort, direction, after, limit, projection, convert = _table_query(table, owner_oid, args)
+    docs, next_cursor = table_page(mongo.db, table, query, sort, direction, after, limit, projection)
+    return convert(docs), next_cursor
+
+
 @main_bp.get("/products")
 @login_required
 def products():
     user_oid = ObjectId(current_user.id)
 
-    # --- Products (user'a ait) ---
-    products = list(
-        mongo.db.products.find(
-            {"owner": user_oid},
-            {"product_code": 1, "secondary_product_code": 1, "connections": 1, "product_category": 1, "product_description": 1, "product_material": 1, "product_shape": 1, "volume_cm3": 1, "product_volume": 1}
-        ).sort("product_code", 1)
+    # Streamed: each table's first page is read while the page is sent (rows
+    # then `next`); the rest comes from /get_table_page/<table>. The modals
+    # load their option lists from /options/<source> when opened.
+    tables = {}
+    for table in TABLES:
+        query, sort, direction, after, limit, projection, convert = _table_query(table, user_oid, {})
+        tables[table] = StreamedPage(mongo.db, table, query, sort, direction, after, limit, projection, convert)
+
+    return stream_page(
+        "products_page.html",
+        product_rows=tables["products"],
+        packaging_rows=tables["packagings"],
+        partner_rows=tables["partners"],
+        packaging_levels=PACKAGING_LEVELS,
     )
 
-    for product in products:
-        connections = product.get("connections", {})
-        missing_count = 0
-        
-        # Check for empty or non-existent values
-        if not connections.get("primary_package"):
-            missing_count += 1
-        if not connections.get("secondary_package"):
-            missing_count += 1
-        if not connections.get("tertiary_package"):
-            missing_count += 1
-        
-        if missing_count == 0:
-            product["packaging_status"] = "Connected"
-            product["packaging_status_color"] = "green"
-        else:
-            product["packaging_status"] = f"Missing ({missing_count})"
-            product["packaging_status_color"] = "red"
-
-
-    # --- Packaging collections (user'a ait) ---
-    primary = list(mongo.db.primary_packagings.find({"owner": user_oid}))
-    secondary = list(mongo.db.secondary_packagings.find({"owner": user_oid}))
-    tertiary = list(mongo.db.tertiary_packagings.find({"owner": user_oid}))
-
-    partners = list(mongo.db.partners.find({"owner": user_oid}))
-    supplier_map = {str(p["_id"]): p.get("partner_name", "Unknown") for p in partners}
-
-    def pick_supplier_text(pkg: dict) -> str:
-        supplier_id = pkg.get("supplier")
-        if supplier_id and str(supplier_id) in supplier_map:
-            return supplier_map[str(supplier_id)]
-        return "—"
-
-    def normalize(pkg: dict, level: str) -> dict:
-        return {
-            "_id": str(pkg.get("_id")),
-            "package_code": pkg.get("package_code") or pkg.get("code") or "—",
-            "level": level,  # Primary / Secondary / Tertiary
-            "component_type": pick_component_type_text(pkg),
-            "material": pick_material_text(pkg),
-            "supplier": pick_supplier_text(pkg),
-            # Bu doc tek bir product'a bağlıysa product_code üzerinden 1 sayabiliriz.
-            # Eğer doc içinde product_codes listesi varsa onu say.
-            "products_using": (
-                len(pkg.get("connections", []))
-            ),
-            "recyclability": (pkg.get("recyclability") or "—"),
-        }
 
-    packaging_rows = (
-        [normalize(p, "Primary") for p in primary] +
-        [normalize(p, "Secondary") for p in secondary] +
-        [normalize(p, "Tertiary") for p in tertiary]
-    )
+@main_bp.get("/get_table_page/<table>")
+@login_required
+def get_table_page(table):
+    """
+    One page of a products page table as JSON plus its rendered rows.
+    ?sort= (indexed fields only, see tables.py), ?dir=asc|desc, ?after= (the
+    previous page's `next`), ?limit=, ?q=, and per table: status, category
+    (products); level, recyclability, supplier (packagings); partner_type (partners).
+    """
+    if table not in TABLES:
+        return jsonify({"status": "error", "message": "Invalid table"}), 400
+    try:
+        rows, next_cursor = _table_rows(table, ObjectId(current_user.id), request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-    all_primary_packagings = list(mongo.db.primary_packagings.find({"owner": user_oid}))
-    all_secondary_packagings = list(mongo.db.secondary_packagings.find({"owner": user_oid}))
-    all_tertiary_packagings = list(mongo.db.tertiary_packagings.find({"owner": user_oid}))
-    
-    # Fetch data setup items
-    component_types = list(mongo.db.component_types.find({"owner": user_oid}).sort("name", 1))
-    adhesives = list(mongo.db.adhesives.find({"owner": user_oid}).sort("name", 1))
-    food_contacts = list(mongo.db.food_contacts.find({"owner": user_oid}).sort("name", 1))
-    coatings = list(mongo.db.coatings.find({"owner": user_oid}).sort("name", 1))
+    template = {"products": "product_list_rows.html", "packagings": "packaging_list_rows.html",
+                "partners": "partner_list_rows.html"}[table]
+    return jsonify({
+        "rows": rows,
+        "next": next_cursor,
+        "html": render_template(template, **{f"{table[:-1]}_rows": rows}),
+    })
 
-    return render_template(
-        "products_page.html",
-        products=products,
-        packaging_rows=packaging_rows,
-        partners=partners,
-        all_primary_packagings=all_primary_packagings,
-        all_secondary_packagings=all_secondary_packagings,
-        all_tertiary_packagings=all_tertiary_packagings,
-        component_types=component_types,
-        adhesives=adhesives,
-        food_contacts=food_contacts,
-        coatings=coatings
-    )
+
+@main_bp.get("/options/<source>")
+@login_required
+@versioned_json
+def get_options(source):
+    """
+    Option list for a modal <select>: products, packagings (?level=), partners
+    (?partner_type=) or a data setup list; ?q=, ?limit=, ?selected=id,id (see options.py).
+    """
+    try:
+        return jsonify(option_list(mongo.db, ObjectId(current_user.id), source, request.args))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
 
 @main_bp.route("/add_product", methods=["POST"])
 @login_required
 def add_product():
     try:
-        created_at = datetime.now(timezone.utc)
-        owner_id = ObjectId(current_user.id)
-
-        product_code = request.form.get('productCode')
-        secondary_product_code = request.form.get('secondaryProductCode')
-        product_category = request.form.get('productCategory')
-        product_description = request.form.get('productDescription')
         product_material = request.form.get('material')
+        product_shape = request.form.get('productShape')
+        new_product = build_product(ObjectId(current_user.id), {
+            'product_code': request.form.get('productCode'),
+            'secondary_product_code': request.form.get('secondaryProductCode'),
+            'product_category': request.form.get('productCategory'),
+            'product_description': request.form.get('productDescription'),
+            'material': product_material,
+            'product_shape': product_shape,
+            'dimensions': form_dimensions(request.form, product_shape),
+            'product_volume': request.form.get('productVolume'),
+        })
+        product_code = new_product['product_code']
 
-        if not product_code or not product_material:
-            flash('Product Code and Material are required.', 'danger')
-            return redirect(url_for("main.products"))
-
-        new_product = {
-            'product_code': product_code,
-            'secondary_product_code': secondary_product_code,
-            'product_category': product_category,
-            'product_description': product_description,
-            'product_material': product_material,
-            'owner': owner_id,
-            'creation_time': created_at,
-            'dimensions': {},
-            'sales': [],
-            'connections': {
-                'primary_package': '',
-                'secondary_package': '',
-                'tertiary_package': ''
-            }
-        }
-
-        if product_material == 'solid':
-            product_shape = request.form.get('productShape')
-            new_product['product_shape'] = product_shape
-            dimensions = {}
-            if product_shape == 'rectangular':
-                dimensions['length'] = request.form.get('length')
-                dimensions['width'] = request.form.get('width')
-                dimensions['height'] = request.form.get('height')
-            elif product_shape == 'cylinder':
-                dimensions['height'] = request.form.get('cylHeight')
-                dimensions['radius'] = request.form.get('cylRadius')
-            elif product_shape == 'sphere':
-                dimensions['radius'] = request.form.get('sphRadius')
-            elif product_shape == 'other':
-                dimensions['volume'] = request.form.get('volume')
-            
-            new_product['dimensions'] = dimensions
-            new_product['volume_cm3'] = calculate_volume(product_shape, dimensions)
-
-        elif product_material == 'liquid/gas':
-            product_volume = request.form.get('productVolume')
-            new_product['product_volume'] = product_volume
-        
         mongo.db.products.insert_one(new_product)
         _log_activity("product_creation", f"Created product: {product_code}")
 
         flash(f'Product "{product_code}" has been created successfully!', 'success')
+    except ValueError as e:
+        flash(str(e), 'danger')
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'danger')
 
@@ -313,47 +389,18 @@ def update_product(product_id):
             flash("Product not found or access denied.", "danger")
             return redirect(url_for("main.products"))
 
-        product_code = request.form.get('productCode')
-        product_material = request.form.get('material')
-
-        if not product_code or not product_material:
-            flash('Product Code and Material are required.', 'danger')
-            return redirect(url_for("main.products"))
-
-        update_doc = {
-            'product_code': product_code,
+        product_shape = request.form.get('productShape')
+        update_doc = product_update({
+            'product_code': request.form.get('productCode'),
             'secondary_product_code': request.form.get('secondaryProductCode'),
             'product_category': request.form.get('productCategory'),
             'product_description': request.form.get('productDescription'),
-            'product_material': product_material,
-            'dimensions': {},
-            'volume_cm3': None,
-            'product_volume': None,
-            'product_shape': None
-        }
-
-        if product_material == 'solid':
-            product_shape = request.form.get('productShape')
-            update_doc['product_shape'] = product_shape
-            dimensions = {}
-            if product_shape == 'rectangular':
-                dimensions['length'] = request.form.get('length')
-                dimensions['width'] = request.form.get('width')
-                dimensions['height'] = request.form.get('height')
-            elif product_shape == 'cylinder':
-                dimensions['height'] = request.form.get('cylHeight')
-                dimensions['radius'] = request.form.get('cylRadius')
-            elif product_shape == 'sphere':
-                dimensions['radius'] = request.form.get('sphRadius')
-            elif product_shape == 'other':
-                dimensions['volume'] = request.form.get('volume')
-            
-            update_doc['dimensions'] = dimensions
-            update_doc['volume_cm3'] = calculate_volume(product_shape, dimensions)
-
-        elif product_material == 'liquid/gas':
-            product_volume = request.form.get('productVolume')
-            update_doc['product_volume'] = product_volume
+            'material': request.form.get('material'),
+            'product_shape': product_shape,
+            'dimensions': form_dimensions(request.form, product_shape),
+            'product_volume': request.form.get('productVolume'),
+        })
+        product_code = update_doc['product_code']
 
         mongo.db.products.update_one(
             {'_id': product_oid},
@@ -362,22 +409,17 @@ def update_product(product_id):
 
         # If product code was changed, we must update denormalized data in packaging
         if product.get('product_code') != product_code:
-            product_id_str = str(product_oid)
-            collections = [
-                mongo.db.primary_packagings,
-                mongo.db.secondary_packagings,
-                mongo.db.tertiary_packagings
-            ]
-            for coll in collections:
-                coll.update_many(
-                    {'connections._id': product_id_str},
-                    {'$set': {'connections.$.product_code': product_code}}
-                )
+            mongo.db.packagings.update_many(
+                {'connections._id': str(product_oid)},
+                {'$set': {'connections.$.product_code': product_code}}
+            )
 
 
         _log_activity("product_update", f"Updated product: {product_code}")
         flash(f'Product "{product_code}" has been updated successfully!', 'success')
 
+    except ValueError as e:
+        flash(str(e), 'danger')
     except Exception as e:
         flash(f'An error occurred while updating the product: {str(e)}', 'danger')
 
@@ -389,84 +431,25 @@ def update_product(product_id):
 @login_required
 def add_packaging():
     try:
-        # --- Basic Info ---
-        level = request.form.get('packagingLevel')
-        package_code = request.form.get('packageCode')
-        recyclability = request.form.get('recyclability')
         package_shape = request.form.get('packageShape')
-
-        if not all([level, package_code]):
-            flash('Level and Code are required.', 'danger')
-            return redirect(url_for("main.products"))
-
-        # --- Dimensions ---
-        dimensions = {}
-        if package_shape == 'rectangular':
-            dimensions['length'] = request.form.get('length')
-            dimensions['width'] = request.form.get('width')
-            dimensions['height'] = request.form.get('height')
-        elif package_shape == 'cylinder':
-            dimensions['height'] = request.form.get('cylHeight')
-            dimensions['radius'] = request.form.get('cylRadius')
-        elif package_shape == 'sphere':
-            dimensions['radius'] = request.form.get('sphRadius')
-        elif package_shape == 'other':
-            dimensions['volume'] = request.form.get('volume')
-        
-        # --- Material Composition ---
-        components = request.form.getlist('packageComponent[]')
-        materials = request.form.getlist('material[]')
-        weights = request.form.getlist('weightGrams[]')
-        recycled_contents = request.form.getlist('recycledContent[]')
-        thicknesses = request.form.getlist('thicknessMicrons[]')
-        adhesives = request.form.getlist('adhesiveType[]')
-        food_contacts = request.form.getlist('foodContact[]')
-        coatings = request.form.getlist('coatingType[]')
-
-        materials_list = []
-        for i in range(len(components)):
-            if not components[i]: continue # Skip empty component rows
-            materials_list.append({
-                "package_component": components[i],
-                "material": materials[i],
-                "weight_grams": _safe_float(weights[i]),
-                "recycled_content": _safe_float(recycled_contents[i]),
-                "thickness_microns": _safe_float(thicknesses[i]),
-                "adhesive_type": adhesives[i],
-                "food_contact": food_contacts[i],
-                "coating": coatings[i]
-            })
-            
-        # --- Document Assembly ---
-        doc = {
-            'package_code': package_code,
+        doc = build_packaging(ObjectId(current_user.id), {
+            'level': request.form.get('packagingLevel'),
+            'package_code': request.form.get('packageCode'),
+            'recyclability': request.form.get('recyclability'),
             'package_shape': package_shape,
-            'dimensions': dimensions,
-            'materials': materials_list,
-            'recyclability': recyclability,
-            'volume_cm3': calculate_volume(package_shape, dimensions),
-            'owner': ObjectId(current_user.id),
-            'creation_time': datetime.now(timezone.utc)
-        }
-        
-        # --- DB Insertion ---
-        collection = None
-        if level == 'Primary':
-            collection = mongo.db.primary_packagings
-        elif level == 'Secondary':
-            collection = mongo.db.secondary_packagings
-            doc['quantity_primary_in_secondary_unit'] = _safe_float(request.form.get('quantity_primary_in_secondary_unit'))
-        elif level == 'Tertiary':
-            collection = mongo.db.tertiary_packagings
-            doc['quantity_secondary_in_tertiary_unit'] = _safe_float(request.form.get('quantity_secondary_in_tertiary_unit'))
-
-        if collection is not None:
-            collection.insert_one(doc)
-            _log_activity("packaging_creation", f"Created {level} packaging: {package_code}")
-            flash(f'{level} packaging "{package_code}" has been created successfully!', 'success')
-        else:
-            flash(f'Invalid packaging level: {level}', 'danger')
+            'dimensions': form_dimensions(request.form, package_shape),
+            'components': form_components(request.form),
+            'quantity_primary_in_secondary_unit': request.form.get('quantity_primary_in_secondary_unit'),
+            'quantity_secondary_in_tertiary_unit': request.form.get('quantity_secondary_in_tertiary_unit'),
+        })
+        level, package_code = doc['level'], doc['package_code']
+
+        mongo.db.packagings.insert_one(doc)
+        _log_activity("packaging_creation", f"Created {level} packaging: {package_code}")
+        flash(f'{level} packaging "{package_code}" has been created successfully!', 'success')
 
+    except ValueError as e:
+        flash(str(e), 'danger')
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'danger')
 
@@ -506,6 +489,67 @@ def add_partner():
     return redirect(url_for("main.products"))
 
 
+@main_bp.post("/import/<kind>")
+@login_required
+def import_data(kind):
+    """
+    Bulk import of products, packagings or sales from an uploaded CSV/XLSX `file`
+    (columns in bulk_import.py). Returns the per-row error report as JSON.
+    """
+    upload = request.files.get("file")
+    if kind not in IMPORT_KINDS:
+        return jsonify({"status": "error", "message": "Invalid import type"}), 400
+    if not upload or not upload.filename:
+        return jsonify({"status": "error", "message": "File is required"}), 400
+
+    try:
+        report = import_rows(mongo.db, ObjectId(current_user.id), kind, read_rows(upload.stream, upload.filename))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    _log_activity(f"{kind}_import", f"Imported {report['inserted']} {kind} from {upload.filename}"
+                  + (f" ({report['failed']} rows failed)" if report["failed"] else ""))
+    return jsonify({"status": "success", **report})
+
+
+@main_bp.get("/search")
+@login_required
+def search():
+    """
+    Ranked catalog search: ?q=, optional ?type=product|packaging|partner (repeatable),
+    ?page= and ?per_page= (max 500).
+    """
+    started = time.perf_counter()
+    types = request.args.getlist("type")
+    if any(t not in SEARCH_TYPES for t in types):
+        return jsonify({"status": "error", "message": "Invalid search type"}), 400
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 20)), 1), 500)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid page"}), 400
+
+    result = search_catalog(ObjectId(current_user.id), request.args.get("q", ""), types or None, page, per_page)
+    result["took_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(result)
+
+
+@main_bp.get("/export/<kind>")
+@login_required
+def export_data(kind):
+    """Streams the tenant's products, packagings, partners or sales; ?format=ndjson (default) or csv."""
+    fmt = request.args.get("format", "ndjson")
+    if kind not in EXPORT_KINDS or fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": "Invalid export type or format"}), 400
+
+    lines = export_lines(mongo.db, ObjectId(current_user.id), kind, fmt, current_app.config["EXPORT_BATCH_SIZE"])
+    filename = f"{kind}-{datetime.now(timezone.utc):%Y%m%d}.{fmt}"
+    return Response(stream_with_context(lines), mimetype=EXPORT_FORMATS[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Accel-Buffering": "no",  # Let nginx pass chunks through as they come
+    })
+
+
 @main_bp.route("/update_product_packaging_connections/<product_id>", methods=["POST"])
 @login_required
 def update_product_packaging_connections(product_id):
@@ -521,63 +565,21 @@ def update_product_packaging_connections(product_id):
                 return redirect(url_for("main.dashboard"))
             return redirect(url_for("main.products"))
 
-        old_connections = product.get("connections", {})
-        product_info = { "_id": str(product["_id"]), "product_code": product["product_code"] }
-
         # Get new connections from form
-        new_primary_id = request.form.get("primary_package")
-        new_secondary_id = request.form.get("secondary_package")
-        new_tertiary_id = request.form.get("tertiary_package")
-
-        # --- Update Product's connections ---
-        mongo.db.products.update_one(
-            {"_id": product_oid},
-            {"$set": {
-                "connections.primary_package": new_primary_id,
-                "connections.secondary_package": new_secondary_id,
-                "connections.tertiary_package": new_tertiary_id
-            }}
-        )
-
-        # --- Helper to manage two-way binding ---
-        def update_packaging_connection(collection, old_pkg_id_str, new_pkg_id_str, product_info_to_link):
-            product_id_str_to_link = product_info_to_link['_id']
-
-            # Remove from old packaging
-            if old_pkg_id_str and old_pkg_id_str != new_pkg_id_str:
-                try:
-                    collection.update_one(
-                        {"_id": ObjectId(old_pkg_id_str)},
-                        {"$pull": {"connections": {'_id': product_id_str_to_link}}}
-                    )
-                except:
-                    pass # Ignore if old ID is invalid
-            
-            # Add to new packaging
-            if new_pkg_id_str and old_pkg_id_str != new_pkg_id_str:
-                try:
-                    link_doc = {'_id': product_id_str_to_link, 'product_code': product_info_to_link['product_code']}
-                    
-                    # First remove any old link for this product to prevent duplicates if logic ever changes
-                    collection.update_one(
-                        {"_id": ObjectId(new_pkg_id_str)},
-                        {"$pull": {"connections": {'_id': product_id_str_to_link}}}
-                    )
-                    # Then add the new, updated link
-                    collection.update_one(
-                        {"_id": ObjectId(new_pkg_id_str)},
-                        {"$push": {"connections": link_doc}}
-                    )
-                except:
-                    pass # Ignore if new ID is invalid
+        new_ids = {
+            "primary_package": request.form.get("primary_package"),
+            "secondary_package": request.form.get("secondary_package"),
+            "tertiary_package": request.form.get("tertiary_package")
+        }
 
-        # --- Apply updates for each level ---
-        update_packaging_connection(mongo.db.primary_packagings, old_connections.get("primary_package"), new_primary_id, product_info)
-        update_packaging_connection(mongo.db.secondary_packagings, old_connections.get("secondary_package"), new_secondary_id, product_info)
-        update_packaging_connection(mongo.db.tertiary_packagings, old_connections.get("tertiary_package"), new_tertiary_id, product_info)
+        # Product side and both packagings' lists change together (see connections.py)
+        plan = plan_product_packagings(owner_oid, product, new_ids)
+        with track_rollups(owner_oid) as rollup, rollup.relinked({"_id": product_oid}):
+            plan.apply(mongo.cx, mongo.db)
         
-        _log_activity("connection_update", f"Updated packaging connections for product: {product['product_code']}")
-        flash("Packaging connections updated successfully!", "success")
+        _log_activity("connection_update", f"Updated packaging connections for product: {product['product_code']}",
+                      plan.changes)
+        flash(f"Packaging connections updated successfully! ({_links_changed(plan.changes)})", "success")
 
     except Exception as e:
         flash(f"An error occurred: {str(e)}", "danger")
@@ -652,78 +654,38 @@ def update_packaging_product_connections():
     try:
         owner_oid = ObjectId(current_user.id)
         package_id_str = request.form.get("package_id")
-        package_level = request.form.get("package_level")
         new_product_ids_str = request.form.getlist("product_ids")
 
         package_oid = ObjectId(package_id_str)
         new_product_oids = [ObjectId(pid) for pid in new_product_ids_str]
 
-        collections = {
-            "Primary": mongo.db.primary_packagings,
-            "Secondary": mongo.db.secondary_packagings,
-            "Tertiary": mongo.db.tertiary_packagings
-        }
-        package_collection = collections.get(package_level)
-        connection_field = f"connections.{package_level.lower()}_package"
-
-        if package_collection is None:
-            flash("Invalid packaging level.", "danger")
+        # The level comes from the doc; the form's package_level is no longer needed
+        package = find_packaging(mongo.db, owner_oid, package_oid)
+        if package is None or package.get("level") not in PACKAGING_LEVELS:
+            flash("Packaging not found.", "danger")
             referer = request.headers.get('Referer', '')
             if '/dashboard' in referer:
                 return redirect(url_for("main.dashboard"))
             return redirect(url_for("main.products"))
+        package_level = package["level"]
 
-        # Get the package's current connections to find which products to unlink
-        package = package_collection.find_one({"_id": package_oid})
-        # Note: This is complex because connections can be in multiple formats.
-        # We find all old product IDs regardless of format to ensure they can be unlinked.
-        old_product_ids = []
-        if package and "connections" in package:
-            for link in package.get("connections", []):
-                try:
-                    if isinstance(link, ObjectId):
-                        old_product_ids.append(link)
-                    elif isinstance(link, dict) and '_id' in link:
-                        old_product_ids.append(ObjectId(link['_id']))
-                    elif isinstance(link, dict) and '$oid' in link:
-                        old_product_ids.append(ObjectId(link['$oid']))
-                except:
-                    pass
-        
-        # --- Main Logic ---
-        # 1. Find which products are being removed and unlink them from this package
-        ids_to_unlink = [old_id for old_id in old_product_ids if old_id not in new_product_oids]
-        if ids_to_unlink:
-            mongo.db.products.update_many(
-                {"_id": {"$in": ids_to_unlink}},
-                {"$set": {connection_field: ""}}
-            )
-
-        # 2. Link all new products to this package in the products collection
-        if new_product_oids:
-            mongo.db.products.update_many(
-                {"_id": {"$in": new_product_oids}},
-                {"$set": {connection_field: package_id_str}}
-            )
-
-        # 3. Create the new denormalized list for the package's own connections field
-        products_to_link_cursor = mongo.db.products.find(
-            {"_id": {"$in": new_product_oids}},
-            {"product_code": 1}
-        )
-        new_connections_list = [
-            {'_id': str(p['_id']), 'product_code': p['product_code']}
-            for p in products_to_link_cursor
-        ]
+        # Only the user's own products can be linked
+        new_products = list(mongo.db.products.find(
+            {"_id": {"$in": new_product_oids}, "owner": owner_oid},
+            {"product_code": 1, f"connections.{package_level.lower()}_package": 1}
+        ))
 
-        # 4. Atomically update the package's own connection list
-        package_collection.update_one(
-            {"_id": package_oid},
-            {"$set": {"connections": new_connections_list}}
-        )
+        # --- Main Logic ---
+        # Unlinks removed products, links the new ones, takes them off their previous
+        # packaging of this level and rewrites this packaging's list (see connections.py)
+        plan = plan_packaging_products(owner_oid, package, new_products)
+        relinked = {"$or": [packaging_filter(package_level, package_id_str), {"_id": {"$in": new_product_oids}}]}
+        with track_rollups(owner_oid) as rollup, rollup.relinked(relinked):
+            plan.apply(mongo.cx, mongo.db)
 
-        _log_activity("connection_update", f"Updated product connections for packaging: {package.get('package_code', 'N/A')}")
-        flash("Packaging connections updated successfully!", "success")
+        _log_activity("connection_update", f"Updated product connections for packaging: {package.get('package_code', 'N/A')}",
+                      plan.changes)
+        flash(f"Packaging connections updated successfully! ({_links_changed(plan.changes)})", "success")
 
     except Exception as e:
         flash(f"An error occurred: {str(e)}", "danger")
@@ -740,31 +702,22 @@ def update_packaging_product_connections():
 def update_packaging_supplier_connection():
     try:
         package_id_str = request.form.get("package_id")
-        package_level = request.form.get("package_level")
         new_supplier_id_str = request.form.get("supplier_id")
         
         package_oid = ObjectId(package_id_str)
 
-        collections = {
-            "Primary": mongo.db.primary_packagings,
-            "Secondary": mongo.db.secondary_packagings,
-            "Tertiary": mongo.db.tertiary_packagings
-        }
-        package_collection = collections.get(package_level)
-
-        if package_collection is None:
-            flash("Invalid packaging level.", "danger")
+        # Get old supplier to unlink later
+        package = find_packaging(mongo.db, ObjectId(current_user.id), package_oid)
+        if package is None:
+            flash("Packaging not found.", "danger")
             referer = request.headers.get('Referer', '')
             if '/dashboard' in referer:
                 return redirect(url_for("main.dashboard"))
             return redirect(url_for("main.products"))
-
-        # Get old supplier to unlink later
-        package = package_collection.find_one({"_id": package_oid})
         old_supplier_id_str = package.get("supplier")
 
         # Update package's supplier field
-        package_collection.update_one(
+        mongo.db.packagings.update_one(
             {"_id": package_oid},
             {"$set": {"supplier": new_supplier_id_str}}
         )
@@ -815,45 +768,27 @@ def update_partner_connections(partner_id):
             return redirect(url_for("main.products"))
 
         new_linked_ids_str = request.form.getlist("linked_item_ids")
-        new_linked_oids = {ObjectId(id_str) for id_str in new_linked_ids_str}
-
-        old_connection_ids = partner.get("connections", [])
-        old_linked_oids = {ObjectId(c) for c in old_connection_ids if c}
-
-        ids_to_unlink = old_linked_oids - new_linked_oids
-        ids_to_link = new_linked_oids - old_linked_oids
+        new_linked_oids = [ObjectId(id_str) for id_str in new_linked_ids_str]
 
+        # Only the user's own items can be linked; the previous partner is read alongside
         partner_type = partner.get("partner_type", "").lower()
-
         if partner_type == "customer":
-            if ids_to_unlink:
-                mongo.db.products.update_many(
-                    {"_id": {"$in": list(ids_to_unlink)}},
-                    {"$set": {"connections.customer": ""}}
-                )
-            if ids_to_link:
-                mongo.db.products.update_many(
-                    {"_id": {"$in": list(ids_to_link)}},
-                    {"$set": {"connections.customer": partner_id}}
-                )
+            new_items = list(mongo.db.products.find(
+                {"_id": {"$in": new_linked_oids}, "owner": owner_oid}, {"connections.customer": 1}
+            ))
         elif partner_type == "supplier":
-            pkg_collections = [mongo.db.primary_packagings, mongo.db.secondary_packagings, mongo.db.tertiary_packagings]
-            if ids_to_unlink:
-                for coll in pkg_collections:
-                    coll.update_many({"_id": {"$in": list(ids_to_unlink)}}, {"$set": {"supplier": ""}})
-            if ids_to_link:
-                for coll in pkg_collections:
-                    # This is inefficient, but necessary with the current schema
-                    coll.update_many({"_id": {"$in": list(ids_to_link)}}, {"$set": {"supplier": partner_id}})
-
-        # Update the partner's own connection list
-        mongo.db.partners.update_one(
-            {"_id": partner_oid},
-            {"$set": {"connections": list(new_linked_oids)}}
-        )
+            new_items = list(mongo.db.packagings.find(
+                {"_id": {"$in": new_linked_oids}, "owner": owner_oid}, {"supplier": 1}
+            ))
+        else:
+            new_items = [{"_id": oid} for oid in new_linked_oids]
 
-        _log_activity("connection_update", f"Updated connections for partner: {partner['partner_name']}")
-        flash("Partner connections updated successfully!", "success")
+        # Item side, previous partners and this partner's list change together (see connections.py)
+        plan = plan_partner_connections(owner_oid, partner, new_items)
+        plan.apply(mongo.cx, mongo.db)
+
+        _log_activity("connection_update", f"Updated connections for partner: {partner['partner_name']}", plan.changes)
+        flash(f"Partner connections updated successfully! ({_links_changed(plan.changes)})", "success")
 
     except Exception as e:
         flash(f"An error occurred: {str(e)}", "danger")
@@ -903,180 +838,100 @@ def get_activity_icon(activity_type):
     return "bi-info-circle"
 
 
-@main_bp.get("/dashboard")
-@login_required
-def dashboard():
-    owner_id = ObjectId(current_user.id)
-
-    # --- Filter Processing ---
-    start_date_str = request.args.get("start_date")
-    end_date_str = request.args.get("end_date")
-    product_ids = request.args.getlist("product_ids")
-    packaging_levels = request.args.getlist("packaging_levels")
+def _dashboard_filters(args):
+    """(product_ids, start_date, end_date, packaging_levels) from the dashboard's query args."""
+    product_ids = args.getlist("product_ids")
+    packaging_levels = args.getlist("packaging_levels")
 
-    if "packaging_levels" not in request.args:
+    if "packaging_levels" not in args:
         # On initial load, consider all levels to be selected.
         packaging_levels = ["Primary", "Secondary", "Tertiary"]
 
     start_date, end_date = None, None
-    if start_date_str:
+    if args.get("start_date"):
         try:
-            start_date = datetime.strptime(start_date_str, "%Y-%m")
+            start_date = datetime.strptime(args["start_date"], "%Y-%m")
         except ValueError:
             start_date = None
-    if end_date_str:
+    if args.get("end_date"):
         try:
-            end_date = datetime.strptime(end_date_str, "%Y-%m")
+            end_date = datetime.strptime(args["end_date"], "%Y-%m")
         except ValueError:
             end_date = None
-
-    # --- Data Fetching ---
-    product_filter = {"owner": owner_id}
+    return product_ids, start_date, end_date, packaging_levels
+
+
+def _dashboard_metrics(owner_id, product_ids, start_date, end_date, packaging_levels):
+    """The chart data (packaging_qty_by_grade, packaging_weight_by_grade, packaging_trend)."""
+    engine = current_app.config.get("DASHBOARD_ENGINE", "python")
+    if engine == "rollup" and product_ids:
+        # Rollups are per tenant; a product filter needs the raw sales
+        engine = "pipeline"
+    if engine == "numpy" and not dashboard_numpy.available():
+        engine = "python"
+
+    if engine == "rollup":
+        return compute_metrics_rollup(mongo.db, owner_id, start_date, end_date, packaging_levels)
+    if engine == "pipeline":
+        return compute_metrics_pipeline(
+            mongo.db, owner_id, product_ids, start_date, end_date, packaging_levels
+        )
+    # The in-process engines read the catalog themselves
+    query = {"owner": owner_id}
     if product_ids:
-        product_filter["_id"] = {"$in": [ObjectId(pid) for pid in product_ids]}
-
-    all_products = list(mongo.db.products.find(
-        product_filter,
-        {"product_code": 1, "sales": 1, "connections": 1}
-    ))
-
-    package_collections = {
-        "Primary": mongo.db.primary_packagings,
-        "Secondary": mongo.db.secondary_packagings,
-        "Tertiary": mongo.db.tertiary_packagings,
+        query["_id"] = {"$in": [ObjectId(pid) for pid in product_ids if ObjectId.is_valid(pid)]}
+    selected = list(mongo.db.products.find(query, {field: 1 for field in DASHBOARD_PRODUCT_FIELDS}))
+    packages = {
+        str(pkg["_id"]): pkg for pkg in mongo.db.packagings.find({"owner": owner_id}, GRADED_PACKAGING_FIELDS)
     }
+    if engine == "numpy":
+        return dashboard_numpy.load_and_compute(
+            mongo.db, owner_id, selected, packages, start_date, end_date, packaging_levels,
+            all_products=not product_ids
+        )
+    all_products = with_sales(mongo.db, owner_id, selected, all_products=not product_ids)
+    return compute_metrics_python(
+        all_products, packages, start_date, end_date, packaging_levels
+    )
 
-    all_packages = {}
-    for level, collection in package_collections.items():
-        for pkg in collection.find({"owner": owner_id}):
-            pkg["level"] = level
-            all_packages[str(pkg.get("_id"))] = pkg
 
-    # --- Helper Functions ---
-    def _package_unit_weight(pkg_doc):
-        """Calculates the total weight of a single packaging unit in grams."""
-        return sum(_safe_float(m.get("weight_grams")) or 0 for m in pkg_doc.get("materials", []))
+@main_bp.get("/dashboard")
+@login_required
+def dashboard():
+    owner_id = ObjectId(current_user.id)
+    filters = _dashboard_filters(request.args)
 
     # --- Aggregation ---
-    packaging_qty_by_grade = {"A": 0, "B": 0, "C": 0, "D": 0}
-    packaging_weight_by_grade = {"A": 0.0, "B": 0.0, "C": 0.0, "D": 0.0}
-    packaging_trend = {} # "YYYY-MM" -> {"A": 0, "B": 0, ...}
-
-    for product in all_products:
-        connections = product.get("connections", {})
-        pkg_ids = [
-            connections.get("primary_package"),
-            connections.get("secondary_package"),
-            connections.get("tertiary_package")
-        ]
-        pkg_docs = [all_packages.get(pkg_id) for pkg_id in pkg_ids]
-
-        qty_primary_in_secondary = pkg_docs[1].get("quantity_primary_in_secondary_unit", 1) if pkg_docs[1] else 1
-        qty_secondary_in_tertiary = pkg_docs[2].get("quantity_secondary_in_tertiary_unit", 1) if pkg_docs[2] else 1
-
-        for sale in product.get("sales", []):
-            try:
-                sale_year = int(sale["year"])
-                sale_month = int(sale["month"])
-                sale_date = datetime(sale_year, sale_month, 1)
-                
-                is_after_start = not start_date or sale_date >= start_date
-                is_before_end = not end_date or sale_date <= end_date
-
-                if is_after_start and is_before_end:
-                    quantity = _safe_float(sale.get("quantity")) or 0
-                    if quantity == 0:
-                        continue
-                    
-                    # --- Calculate units for this sale ---
-                    total_primary_units = quantity
-                    total_secondary_units = math.ceil(total_primary_units / qty_primary_in_secondary) if qty_primary_in_secondary > 0 else 0
-                    total_tertiary_units = math.ceil(total_secondary_units / qty_secondary_in_tertiary) if qty_secondary_in_tertiary > 0 else 0
-                    num_units_per_level = [total_primary_units, total_secondary_units, total_tertiary_units]
-
-                    # --- Trend Data ---
-                    sale_label = f"{sale_year}-{sale_month:02d}"
-                    if sale_label not in packaging_trend:
-                        packaging_trend[sale_label] = {"A": 0, "B": 0, "C": 0, "D": 0}
-
-                    # --- Aggregate data ---
-                    for i, pkg_doc in enumerate(pkg_docs):
-                        num_units = num_units_per_level[i]
-                        if not pkg_doc or num_units == 0:
-                            continue
-
-                        # Filter by packaging level
-                        level = pkg_doc.get("level")
-                        if level not in packaging_levels:
-                            continue
-
-                        grade = (str(pkg_doc.get("recyclability") or "N/A")).strip().upper()
-                        if grade not in packaging_qty_by_grade:
-                            continue
-                        
-                        # Pie chart totals
-                        packaging_qty_by_grade[grade] += num_units
-                        unit_weight = _package_unit_weight(pkg_doc)
-                        packaging_weight_by_grade[grade] += unit_weight * num_units
-                        
-                        # Trend data
-                        packaging_trend[sale_label][grade] += num_units
-
-            except (ValueError, TypeError):
-                continue
-
-    # --- Final Data Preparation ---
-    packaging_weight_kg_by_grade = {k: round(v / 1000, 2) for k, v in packaging_weight_by_grade.items()}
-    
-    # Sort trend data by date
-    sorted_trend_labels = sorted(packaging_trend.keys())
-    sorted_packaging_trend = {label: packaging_trend[label] for label in sorted_trend_labels}
-
-    user_products = list(mongo.db.products.find({'owner': owner_id}, {"product_code": 1, "_id": 1}))
+    # The page is streamed and the charts come last, so the metrics are
+    # computed when the template gets there, after the rest has been sent.
+    # Filter changes afterwards only fetch /api/dashboard/metrics.
+    def dashboard_metrics():
+        return _dashboard_metrics(owner_id, *filters)
 
     # --- Fetch Latest Activities ---
-    latest_activities = list(mongo.db.activities.find(
-        {"owner": owner_id}
-    ).sort("timestamp", -1).limit(10))
-
-    # --- Fetch data for edit modals ---
-    all_primary_packagings = list(mongo.db.primary_packagings.find({"owner": owner_id}))
-    all_secondary_packagings = list(mongo.db.secondary_packagings.find({"owner": owner_id}))
-    all_tertiary_packagings = list(mongo.db.tertiary_packagings.find({"owner": owner_id}))
-    partners = list(mongo.db.partners.find({"owner": owner_id}))
-    # For editLinkedProductsModal, we need all products (use user_products as products)
-    products = user_products
-    
-    # Fetch data setup items for packaging modals
-    component_types = list(mongo.db.component_types.find({"owner": owner_id}).sort("name", 1))
-    adhesives = list(mongo.db.adhesives.find({"owner": owner_id}).sort("name", 1))
-    food_contacts = list(mongo.db.food_contacts.find({"owner": owner_id}).sort("name", 1))
-    coatings = list(mongo.db.coatings.find({"owner": owner_id}).sort("name", 1))
+    latest_activities, _ = activity_page(mongo.db, owner_id, limit=10)
 
-    return render_template(
+    return stream_page(
         'dashboard_page.html',
-        packaging_qty_by_grade=packaging_qty_by_grade,
-        packaging_weight_by_grade=packaging_weight_kg_by_grade,
-        packaging_trend=sorted_packaging_trend,
-        products=products,  # For both filter and edit modals
-        start_date=start_date_str,
-        end_date=end_date_str,
+        dashboard_metrics=dashboard_metrics,
+        start_date=request.args.get("start_date"),
+        end_date=request.args.get("end_date"),
         datetime=datetime,
         request=request,
         latest_activities=latest_activities,
         get_activity_icon=get_activity_icon,
-        # For edit modals
-        all_primary_packagings=all_primary_packagings,
-        all_secondary_packagings=all_secondary_packagings,
-        all_tertiary_packagings=all_tertiary_packagings,
-        partners=partners,
-        component_types=component_types,
-        adhesives=adhesives,
-        food_contacts=food_contacts,
-        coatings=coatings
     )
 
 
+@main_bp.get("/api/dashboard/metrics")
+@login_required
+@versioned_json
+def dashboard_metrics_json():
+    """The dashboard charts' data for the filters in the query string (same args as /dashboard)."""
+    owner_id = ObjectId(current_user.id)
+    return jsonify(_dashboard_metrics(owner_id, *_dashboard_filters(request.args)))
+
+
 
 @main_bp.get("/partners")
 @login_required
@@ -1098,19 +953,8 @@ def reports():
 def data_setup():
     owner_id = ObjectId(current_user.id)
     
-    # Fetch all items for each list
-    component_types = list(mongo.db.component_types.find({"owner": owner_id}).sort("name", 1))
-    adhesives = list(mongo.db.adhesives.find({"owner": owner_id}).sort("name", 1))
-    food_contacts = list(mongo.db.food_contacts.find({"owner": owner_id}).sort("name", 1))
-    coatings = list(mongo.db.coatings.find({"owner": owner_id}).sort("name", 1))
-    
-    return render_template(
-        "data_setup_page.html",
-        component_types=component_types,
-        adhesives=adhesives,
-        food_contacts=food_contacts,
-        coatings=coatings
-    )
+    # All items for each list (cached per owner, see reference_data.py)
+    return render_template("data_setup_page.html", **reference_data(owner_id))
 
 
 @main_bp.route("/add_data_setup_item", methods=["POST"])
@@ -1137,17 +981,19 @@ def add_data_setup_item():
         
         collection = collection_map[item_type]
         
-        # Check if name already exists for this owner
-        existing = collection.find_one({"owner": owner_id, "name": name})
-        if existing:
+        # Check if name already exists for this owner; the unique (owner, name)
+        # index (`flask ensure-indexes`) also rejects a concurrent duplicate
+        if collection.find_one({"owner": owner_id, "name": name}, {"_id": 1}):
             return jsonify({"status": "error", "message": "This name already exists"}), 400
-        
-        # Insert new item
-        result = collection.insert_one({
-            "owner": owner_id,
-            "name": name,
-            "created_at": datetime.now(timezone.utc)
-        })
+        try:
+            result = collection.insert_one({
+                "owner": owner_id,
+                "name": name,
+                "created_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            return jsonify({"status": "error", "message": "This name already exists"}), 400
+        reference_cache().invalidate(owner_id)
         
         return jsonify({
             "status": "success",
@@ -1194,19 +1040,16 @@ def update_data_setup_item():
             return jsonify({"status": "error", "message": "Item not found or access denied"}), 404
         
         # Check if name already exists for this owner (excluding current item)
-        existing = collection.find_one({
-            "owner": owner_id,
-            "name": name,
-            "_id": {"$ne": item_oid}
-        })
-        if existing:
+        if collection.find_one({"owner": owner_id, "name": name, "_id": {"$ne": item_oid}}, {"_id": 1}):
             return jsonify({"status": "error", "message": "This name already exists"}), 400
-        
-        # Update item
-        collection.update_one(
-            {"_id": item_oid, "owner": owner_id},
-            {"$set": {"name": name, "updated_at": datetime.now(timezone.utc)}}
-        )
+        try:
+            collection.update_one(
+                {"_id": item_oid, "owner": owner_id},
+                {"$set": {"name": name, "updated_at": datetime.now(timezone.utc)}}
+            )
+        except DuplicateKeyError:
+            return jsonify({"status": "error", "message": "This name already exists"}), 400
+        reference_cache().invalidate(owner_id)
         
         return jsonify({
             "status": "success",
@@ -1247,6 +1090,7 @@ def delete_data_setup_item():
         
         if result.deleted_count == 0:
             return jsonify({"status": "error", "message": "Item not found or access denied"}), 404
+        reference_cache().invalidate(owner_id)
         
         return jsonify({
             "status": "success",
@@ -1256,6 +1100,25 @@ def delete_data_setup_item():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@main_bp.get("/stats")
+@login_required
+def runtime_stats():
+    """
+    Counters of this worker's in-process caches and background writers. They
+    cover every tenant, so only the usernames listed in STATS_USERS may read them.
+    """
+    if current_user.username not in current_app.config["STATS_USERS"]:
+        return jsonify({"status": "error", "message": "Access denied"}), 403
+    return jsonify({
+        "reference_data": reference_cache().snapshot_stats(),
+        "activity_log": activity_writer().snapshot_stats(),
+        "users": user_cache().snapshot_stats(),
+        "search": search_index().snapshot_stats(),
+        "responses": response_cache().snapshot_stats(),
+        "compression": compressor().snapshot_stats(),
+        "startup": startup_report().snapshot_stats(),
+    })
+
 @main_bp.get("/settings")
 @login_required
 def settings():
@@ -1264,6 +1127,7 @@ def settings():
 @main_bp.get("/logout")
 @login_required
 def logout():
+    user_cache().invalidate(current_user.id)
     logout_user()
     return redirect(url_for("main.login"))
 
@@ -1281,46 +1145,20 @@ def delete_product(product_id):
             return jsonify({"status": "error", "message": "Product not found or access denied"}), 404
 
         product_code = product.get("product_code", "N/A")
-        connections = product.get("connections", {})
-
-        # 2. Unlink from packaging collections
-        pkg_collections = {
-            "primary_package": mongo.db.primary_packagings,
-            "secondary_package": mongo.db.secondary_packagings,
-            "tertiary_package": mongo.db.tertiary_packagings
-        }
-        for level_key, collection in pkg_collections.items():
-            pkg_id_str = connections.get(level_key)
-            if pkg_id_str:
-                try:
-                    # Remove the product's reference from the package's `connections` array.
-                    # This now correctly targets the dictionary entry by the product's stringified ObjectId.
-                    collection.update_one(
-                        {"_id": ObjectId(pkg_id_str)},
-                        {"$pull": {"connections": {"_id": str(product_oid)}}}
-                    )
-                except Exception as e:
-                    print(f"Could not unlink product from {level_key} ({pkg_id_str}): {e}")
-
-        # 3. Unlink from partner (customer)
-        customer_id_str = connections.get("customer")
-        if customer_id_str:
-            try:
-                # Remove the product's ObjectId from the partner's `connections` array.
-                mongo.db.partners.update_one(
-                    {"_id": ObjectId(customer_id_str)},
-                    {"$pull": {"connections": product_oid}}
-                )
-            except Exception as e:
-                print(f"Could not unlink product from customer ({customer_id_str}): {e}")
 
-
-        # 4. Delete the product itself
-        mongo.db.products.delete_one({"_id": product_oid})
+        # 2. Unlink from packagings and customer, then delete the product and its sales
+        plan = plan_delete_product(owner_oid, product)
+        with track_rollups(owner_oid) as rollup:
+            rollup.remove_products({"_id": product_oid})
+            plan.apply(mongo.cx, mongo.db)
         
-        _log_activity("product_deletion", f"Deleted product: {product_code}")
+        _log_activity("product_deletion", f"Deleted product: {product_code}", plan.changes)
 
-        return jsonify({"status": "success", "message": f"Product '{product_code}' deleted successfully."})
+        return jsonify({
+            "status": "success",
+            "message": f"Product '{product_code}' deleted successfully.",
+            "changes": plan.changes
+        })
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1334,6 +1172,7 @@ def delete_product(product_id):
 
 @main_bp.get("/get_product_details/<product_id>")
 @login_required
+@versioned_json
 def get_product_details(product_id):
     try:
         product_oid = ObjectId(product_id)
@@ -1347,53 +1186,30 @@ def get_product_details(product_id):
         if not product:
             return jsonify({"error": "Product not found"}), 404
 
-        # Convert ObjectId to string for JSON serialization
-        product["_id"] = str(product["_id"])
-        product["owner"] = str(product["owner"])
-
         connections = product.get("connections", {})
         
         # Fetch details for connected items
         packaging_details = []
         
-        primary_pkg_id = connections.get("primary_package")
-        if primary_pkg_id:
-            try:
-                pkg = mongo.db.primary_packagings.find_one({"_id": ObjectId(primary_pkg_id)}, {"package_code": 1, "recyclability": 1})
-                if pkg:
-                    packaging_details.append({
-                        "code": pkg.get("package_code", "Not Found"),
-                        "level": "Primary",
-                        "recyclability": pkg.get("recyclability", "N/A")
-                    })
-            except:
-                pass # Invalid ID
-
-        secondary_pkg_id = connections.get("secondary_package")
-        if secondary_pkg_id:
-            try:
-                pkg = mongo.db.secondary_packagings.find_one({"_id": ObjectId(secondary_pkg_id)}, {"package_code": 1, "recyclability": 1})
-                if pkg:
-                    packaging_details.append({
-                        "code": pkg.get("package_code", "Not Found"),
-                        "level": "Secondary",
-                        "recyclability": pkg.get("recyclability", "N/A")
-                    })
-            except:
-                pass # Invalid ID
-
-        tertiary_pkg_id = connections.get("tertiary_package")
-        if tertiary_pkg_id:
-            try:
-                pkg = mongo.db.tertiary_packagings.find_one({"_id": ObjectId(tertiary_pkg_id)}, {"package_code": 1, "recyclability": 1})
-                if pkg:
-                    packaging_details.append({
-                        "code": pkg.get("package_code", "Not Found"),
-                        "level": "Tertiary",
-                        "recyclability": pkg.get("recyclability", "N/A")
-                    })
-            except:
-                pass # Invalid ID
+        # One query for all three connected packagings; invalid IDs are skipped
+        pkg_ids = [connections.get(f"{level.lower()}_package") for level in PACKAGING_LEVELS]
+        pkg_oids = [ObjectId(i) for i in pkg_ids if i and ObjectId.is_valid(i)]
+        found = {}
+        if pkg_oids:
+            for pkg in mongo.db.packagings.find(
+                {"_id": {"$in": pkg_oids}, "owner": owner_oid},
+                {"package_code": 1, "recyclability": 1, "level": 1}
+            ):
+                found[str(pkg["_id"])] = pkg
+
+        for level, pkg_id in zip(PACKAGING_LEVELS, pkg_ids):
+            pkg = found.get(pkg_id)
+            if pkg and pkg.get("level") == level:
+                packaging_details.append({
+                    "code": pkg.get("package_code", "Not Found"),
+                    "level": level,
+                    "recyclability": pkg.get("recyclability", "N/A")
+                })
 
         connections['packaging'] = packaging_details
         # Clean up old keys if they exist
@@ -1412,10 +1228,6 @@ def get_product_details(product_id):
 
         product["connections"] = connections
 
-        # Clean up non-serializable fields if they are not needed by the frontend
-        if 'creation_time' in product:
-            product.pop('creation_time')
-
         return jsonify(product)
 
     except Exception as e:
@@ -1424,36 +1236,22 @@ def get_product_details(product_id):
 
 @main_bp.get("/get_packaging_details")
 @login_required
+@versioned_json
 def get_packaging_details():
     try:
         package_id = request.args.get('id')
-        level = request.args.get('level')
         # A new flag to determine the response format
         is_for_editing = request.args.get('edit', 'false').lower() == 'true'
         owner_oid = ObjectId(current_user.id)
 
-        collection = None
-        if level == 'Primary':
-            collection = mongo.db.primary_packagings
-        elif level == 'Secondary':
-            collection = mongo.db.secondary_packagings
-        elif level == 'Tertiary':
-            collection = mongo.db.tertiary_packagings
-        
-        if collection is None:
-            return jsonify({"error": "Invalid packaging level"}), 400
-
-        package = collection.find_one({"_id": ObjectId(package_id), "owner": owner_oid})
+        # `level` is still sent by the client but the doc carries its own
+        package = find_packaging(mongo.db, owner_oid, ObjectId(package_id))
 
         if not package:
             return jsonify({"error": "Packaging not found"}), 404
 
         # If for editing, return the full document
         if is_for_editing:
-            package["_id"] = str(package["_id"])
-            package["owner"] = str(package["owner"])
-            if 'creation_time' in package:
-                package.pop('creation_time')
             return jsonify(package)
 
         # --- Otherwise, return the summarized version for the offcanvas ---
@@ -1481,7 +1279,7 @@ def get_packaging_details():
             )
             for p in products_cursor:
                 clean_linked_products.append({
-                    '_id': str(p['_id']),
+                    '_id': p['_id'],
                     'product_code': p['product_code']
                 })
 
@@ -1499,14 +1297,14 @@ def get_packaging_details():
                 supplier_name = "Invalid Supplier ID"
 
         result = {
-            "_id": str(package["_id"]),
+            "_id": package["_id"],
             "package_code": package.get("package_code"),
-            "level": level,
+            "level": package.get("level"),
             "component_type": pick_component_type_text(package),
             "material": pick_material_text(package),
             "recyclability": package.get("recyclability") or "—",
             "linked_products": clean_linked_products,
-            "supplier_id": str(package.get("supplier")),
+            "supplier_id": package.get("supplier"),
             "supplier_name": supplier_name
         }
 
@@ -1518,32 +1316,33 @@ def get_packaging_details():
 
 @main_bp.get("/get_product_sales/<product_id>")
 @login_required
+@versioned_json
 def get_product_sales(product_id):
-    product = mongo.db.products.find_one({
-        "_id": ObjectId(product_id),
-        "owner": ObjectId(current_user.id)
-    }, {"sales": 1, "product_code": 1})
-
-    if not product:
-        return jsonify({"sales": []})
+    # Sales carry their owner, so no separate product lookup is needed
+    sales = list(mongo.db.sales.find(
+        {"owner": ObjectId(current_user.id), "product": ObjectId(product_id)},
+        {"year": 1, "month": 1, "quantity": 1, "sku_price": 1}
+    ).sort("_id", 1))
 
-    return jsonify({"sales": product.get("sales", [])})
+    return jsonify({"sales": sales})
 
 
 @main_bp.get("/get_activities")
 @login_required
 def get_activities():
+    """
+    One page of the activity feed, newest first.
+    ?limit= page size (max 500); ?before= the `next_before` of the previous page.
+    """
     owner_id = ObjectId(current_user.id)
-    activities = list(mongo.db.activities.find(
-        {"owner": owner_id}
-    ).sort("timestamp", -1).limit(100))
-    
-    # Convert ObjectId and datetime to string for JSON serialization
-    for activity in activities:
-        activity["_id"] = str(activity["_id"])
-        activity["timestamp"] = activity["timestamp"].isoformat()
+    try:
+        limit = min(max(int(request.args.get("limit", 100)), 1), 500)
+        before = parse_cursor(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid limit or cursor"}), 400
 
-    return jsonify(activities)
+    activities, next_before = activity_page(mongo.db, owner_id, before=before, limit=limit, projection={"owner": 0})
+    return jsonify({"activities": activities, "next_before": next_before})
 
 
 @main_bp.post("/add_product_sales/<product_id>")
@@ -1566,82 +1365,79 @@ def add_product_sales(product_id):
     if not product:
         return jsonify({"status": "error", "message": "Product not found"}), 404
 
-    new_record = {
-        "year": year,
-        "month": month,
-        "quantity": quantity,
-        "sku_price": data.get("sku_price")  # Optional
-    }
+    owner_oid = ObjectId(current_user.id)
+    product_oid = ObjectId(product_id)
+    new_record = new_sale(owner_oid, product_oid, data)
 
-    mongo.db.products.update_one(
-        {"_id": ObjectId(product_id)},
-        {"$push": {"sales": new_record}}
-    )
+    with track_rollups(owner_oid) as rollup:
+        result = mongo.db.sales.insert_one(new_record)
+        rollup.sale(product_oid, after=new_record)
 
     _log_activity("sales_addition", f"Added {month}/{year} sales to product: {product.get('product_code')}")
 
-    return jsonify({"status": "success"})
+    return jsonify({"status": "success", "sale_id": str(result.inserted_id)})
 
 
-@main_bp.post("/update_product_sales/<product_id>/<int:index>")
+@main_bp.post("/update_product_sales/<product_id>/<sale_ref>")
 @login_required
-def update_product_sales(product_id, index):
+def update_product_sales(product_id, sale_ref):
+    """`sale_ref` is a sale id; a list position from old clients still resolves (see resolve_sale_ref)."""
     data = request.get_json(silent=True) or {}
+    owner_oid = ObjectId(current_user.id)
+    product_oid = ObjectId(product_id)
 
-    product = mongo.db.products.find_one({
-        "_id": ObjectId(product_id),
-        "owner": ObjectId(current_user.id)
-    }, {"sales": 1})
+    fields = {field: data.get(field) for field in SALE_FIELDS if field in data}
+    if not fields:
+        return jsonify({"status": "error", "message": "No fields to update"}), 400
 
-    if not product:
-        return jsonify({"status": "error", "message": "Product not found"}), 404
+    if "year" in fields and "month" in fields:
+        fields["period"] = sale_period(fields["year"], fields["month"])
+        update = {"$set": fields}
+    elif "year" in fields or "month" in fields:
+        update = [{"$set": fields}, {"$set": {"period": PERIOD_EXPR}}]
+    else:
+        update = {"$set": fields}
 
-    sales = product.get("sales", []) or []
-    if index < 0 or index >= len(sales):
+    sale_oid = resolve_sale_ref(mongo.db, owner_oid, product_oid, sale_ref)
+    if sale_oid is None:
         return jsonify({"status": "error", "message": "Invalid sale index"}), 400
 
-    fields = {}
-    if "year" in data:
-        fields[f"sales.{index}.year"] = data.get("year")
-    if "month" in data:
-        fields[f"sales.{index}.month"] = data.get("month")
-    if "quantity" in data:
-        fields[f"sales.{index}.quantity"] = data.get("quantity")
-    if "sku_price" in data:
-        fields[f"sales.{index}.sku_price"] = data.get("sku_price")
-
-    if not fields:
-        return jsonify({"status": "error", "message": "No fields to update"}), 400
+    with track_rollups(owner_oid) as rollup:
+        before = mongo.db.sales.find_one_and_update(
+            {"_id": sale_oid, "owner": owner_oid, "product": product_oid},
+            update,
+            projection=SALE_UNIT_FIELDS
+        )
+        if before is not None:
+            rollup.sale(product_oid, before, {**before, **fields})
 
-    mongo.db.products.update_one(
-        {"_id": ObjectId(product_id), "owner": ObjectId(current_user.id)},
-        {"$set": fields}
-    )
+    if before is None:
+        return jsonify({"status": "error", "message": "Sale not found"}), 404
 
     return jsonify({"status": "success"})
 
 
-@main_bp.post("/delete_product_sales/<product_id>/<int:index>")
+@main_bp.post("/delete_product_sales/<product_id>/<sale_ref>")
 @login_required
-def delete_product_sales(product_id, index):
-    product = mongo.db.products.find_one({
-        "_id": ObjectId(product_id),
-        "owner": ObjectId(current_user.id)
-    }, {"sales": 1})
-
-    if not product:
-        return jsonify({"status": "error", "message": "Product not found"}), 404
+def delete_product_sales(product_id, sale_ref):
+    """`sale_ref` is a sale id; a list position from old clients still resolves (see resolve_sale_ref)."""
+    owner_oid = ObjectId(current_user.id)
+    product_oid = ObjectId(product_id)
 
-    sales = product.get("sales", []) or []
-    if index < 0 or index >= len(sales):
+    sale_oid = resolve_sale_ref(mongo.db, owner_oid, product_oid, sale_ref)
+    if sale_oid is None:
         return jsonify({"status": "error", "message": "Invalid sale index"}), 400
 
-    sales.pop(index)
+    with track_rollups(owner_oid) as rollup:
+        deleted = mongo.db.sales.find_one_and_delete(
+            {"_id": sale_oid, "owner": owner_oid, "product": product_oid},
+            projection=SALE_UNIT_FIELDS
+        )
+        if deleted is not None:
+            rollup.sale(product_oid, before=deleted)
 
-    mongo.db.products.update_one(
-        {"_id": ObjectId(product_id), "owner": ObjectId(current_user.id)},
-        {"$set": {"sales": sales}}
-    )
+    if deleted is None:
+        return jsonify({"status": "error", "message": "Sale not found"}), 404
 
     return jsonify({"status": "success"})
 
@@ -1667,17 +1463,10 @@ def delete_partner(partner_id):
         )
 
         # 3. Unlink from packaging (suppliers)
-        # This requires checking all three packaging collections
-        pkg_collections = [
-            mongo.db.primary_packagings,
-            mongo.db.secondary_packagings,
-            mongo.db.tertiary_packagings
-        ]
-        for collection in pkg_collections:
-            collection.update_many(
-                {"owner": owner_oid, "supplier": partner_id},
-                {"$set": {"supplier": ""}}
-            )
+        mongo.db.packagings.update_many(
+            {"owner": owner_oid, "supplier": partner_id},
+            {"$set": {"supplier": ""}}
+        )
 
         # 4. Delete the partner itself
         mongo.db.partners.delete_one({"_id": partner_oid})
@@ -1695,35 +1484,28 @@ def delete_partner(partner_id):
 def delete_packaging(package_id):
     try:
         package_oid = ObjectId(package_id)
-        level = request.args.get('level')
         owner_oid = ObjectId(current_user.id)
 
-        collections = {
-            "Primary": mongo.db.primary_packagings,
-            "Secondary": mongo.db.secondary_packagings,
-            "Tertiary": mongo.db.tertiary_packagings
-        }
-        collection = collections.get(level)
-        connection_field = f"connections.{level.lower()}_package"
-
-        if collection is None:
-            return jsonify({"status": "error", "message": "Invalid packaging level"}), 400
-
         # 1. Find the packaging to ensure it exists and belongs to the user
-        package = collection.find_one({"_id": package_oid, "owner": owner_oid})
+        package = find_packaging(mongo.db, owner_oid, package_oid)
         if not package:
             return jsonify({"status": "error", "message": "Packaging not found or access denied"}), 404
+        level = package.get("level")
+        if level not in PACKAGING_LEVELS:
+            return jsonify({"status": "error", "message": "Invalid packaging level"}), 400
+        product_field = connection_field(level)
 
         package_code = package.get("package_code", "N/A")
 
-        # 2. Unlink from products
-        mongo.db.products.update_many(
-            {"owner": owner_oid, connection_field: package_id},
-            {"$set": {connection_field: ""}}
-        )
+        with track_rollups(owner_oid) as rollup, rollup.relinked(packaging_filter(level, package_id)):
+            # 2. Unlink from products
+            mongo.db.products.update_many(
+                {"owner": owner_oid, product_field: package_id},
+                {"$set": {product_field: ""}}
+            )
 
-        # 3. Delete the packaging itself
-        collection.delete_one({"_id": package_oid})
+            # 3. Delete the packaging itself
+            mongo.db.packagings.delete_one({"_id": package_oid})
         
         _log_activity("packaging_deletion", f"Deleted {level} packaging: {package_code}")
 
@@ -1733,28 +1515,41 @@ def delete_packaging(package_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+def _fragment_response(body, etag, mimetype):
+    """
+    A prerendered fragment with a strong ETag. Requests carrying the current
+    ?v= version may cache it for good; others revalidate (a 304 is free).
+    """
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if request.args.get("v") == etag:
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 @main_bp.route('/get_recyclability_form/<form_name>')
 @login_required
 def get_recyclability_form(form_name):
     """
-    Renders a specific recyclability form template.
-    Note: This is an authenticated route.
+    Serves one recyclability questionnaire, prerendered at startup
+    (see recyclability.FormFragments).
     """
-    try:
-        # Basic security: prevent directory traversal
-        if '..' in form_name or '/' in form_name:
-            return "Invalid form name", 400
-        
-        template_path = f"recyclability_forms/{form_name}"
-        
-        # render_template will raise a TemplateNotFound error if the file doesn't exist,
-        # which will be caught by the generic exception handler below.
-        return render_template(template_path)
-
-    except Exception as e:
-        # In a real app, you might want more specific error handling
-        # and logging for template not found errors.
+    fragment = form_fragments().get(form_name)
+    if fragment is None:
         return f"Form '{form_name}' not found.", 404
+    return _fragment_response(*fragment, "text/html")
+
+
+@main_bp.get("/recyclability_forms.json")
+@login_required
+def recyclability_forms_bundle():
+    """All questionnaires plus the material -> form patterns, as one versioned JSON bundle."""
+    fragments = form_fragments()
+    return _fragment_response(fragments.bundle, fragments.version, "application/json")
 
 
 @main_bp.route("/update_packaging_recyclability", methods=["POST"])
@@ -1762,42 +1557,50 @@ def get_recyclability_form(form_name):
 def update_packaging_recyclability():
     """
     Updates only the recyclability field of a packaging item.
+    With `form` and `answers` (JSON {question id: [option index, ...]}) the
+    grade is computed server-side and the answers are kept for regrading;
+    a bare `recyclability` grade is stored as is.
     """
     try:
         package_id_str = request.form.get('packageId')
-        package_level = request.form.get('packageLevel')
         recyclability = request.form.get('recyclability')
+        answers = request.form.get('answers')
         
-        if not all([package_id_str, package_level, recyclability]):
+        # packageLevel is still posted by the forms but no longer needed
+        if not package_id_str or not (recyclability or answers):
             return jsonify({"status": "error", "message": "Missing required fields"}), 400
+
+        if answers:
+            try:
+                recyclability, stored_answers = parse_answers(request.form.get('form'), answers)
+            except ValueError as e:
+                return jsonify({"status": "error", "message": str(e)}), 400
+            update = {"$set": {"recyclability": recyclability, "recyclability_answers": stored_answers}}
+        else:
+            # A grade set by hand has no answers to regrade from
+            update = {"$set": {"recyclability": recyclability}, "$unset": {"recyclability_answers": ""}}
         
         package_oid = ObjectId(package_id_str)
         owner_oid = ObjectId(current_user.id)
         
-        collections = {
-            "Primary": mongo.db.primary_packagings,
-            "Secondary": mongo.db.secondary_packagings,
-            "Tertiary": mongo.db.tertiary_packagings
-        }
-        collection = collections.get(package_level)
-        
-        if collection is None:
-            return jsonify({"status": "error", "message": "Invalid packaging level"}), 400
-        
         # Verify ownership
-        package = collection.find_one({"_id": package_oid, "owner": owner_oid})
+        package = find_packaging(mongo.db, owner_oid, package_oid)
         if not package:
             return jsonify({"status": "error", "message": "Packaging not found or access denied"}), 404
+        package_level = package.get("level")
+        if package_level not in PACKAGING_LEVELS:
+            return jsonify({"status": "error", "message": "Invalid packaging level"}), 400
         
         # Update only recyclability
-        collection.update_one(
-            {"_id": package_oid},
-            {"$set": {"recyclability": recyclability}}
-        )
+        with track_rollups(owner_oid) as rollup:
+            before = mongo.db.packagings.find_one_and_update(
+                {"_id": package_oid}, update, projection=GRADED_PACKAGING_FIELDS
+            )
+            rollup.packaging_updated(before, update["$set"])
         
         _log_activity("packaging_update", f"Updated recyclability for {package_level} packaging: {package.get('package_code', 'N/A')}")
         
-        return jsonify({"status": "success", "message": "Recyclability updated successfully"})
+        return jsonify({"status": "success", "message": "Recyclability updated successfully", "recyclability": recyclability})
         
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1805,33 +1608,25 @@ def update_packaging_recyclability():
 
 @main_bp.get("/get_all_products_json")
 @login_required
+@versioned_json
 def get_all_products_json():
     owner_oid = ObjectId(current_user.id)
-    products = list(mongo.db.products.find({"owner": owner_oid}, {"_id": 1, "product_code": 1}))
-    for p in products:
-        p["_id"] = str(p["_id"])
-    return jsonify(products)
+    return jsonify(list(mongo.db.products.find({"owner": owner_oid}, {"_id": 1, "product_code": 1})))
 
 @main_bp.get("/get_all_packagings_json")
 @login_required
+@versioned_json
 def get_all_packagings_json():
     owner_oid = ObjectId(current_user.id)
-    all_packagings = []
-    pkg_collections = {
-        "Primary": mongo.db.primary_packagings,
-        "Secondary": mongo.db.secondary_packagings,
-        "Tertiary": mongo.db.tertiary_packagings
-    }
-    for level, collection in pkg_collections.items():
-        packagings = list(collection.find({"owner": owner_oid}, {"_id": 1, "package_code": 1}))
-        for p in packagings:
-            p["_id"] = str(p["_id"])
-            p["level"] = level
-            all_packagings.append(p)
+    # Level names sort Primary < Secondary < Tertiary, matching the old per-collection order
+    all_packagings = list(mongo.db.packagings.find(
+        {"owner": owner_oid}, {"_id": 1, "package_code": 1, "level": 1}
+    ).sort("level", 1))
     return jsonify(all_packagings)
 
 @main_bp.get("/get_missing_recyclability")
 @login_required
+@versioned_json
 def get_missing_recyclability():
     """
     Returns list of packagings that don't have recyclability set.
@@ -1842,31 +1637,24 @@ def get_missing_recyclability():
         missing_recyclability = []
         
         # Check all packaging levels
-        collections = {
-            "Primary": mongo.db.primary_packagings,
-            "Secondary": mongo.db.secondary_packagings,
-            "Tertiary": mongo.db.tertiary_packagings
-        }
-        
-        for level, collection in collections.items():
-            packagings = collection.find(
-                {"owner": owner_oid},
-                {"package_code": 1, "recyclability": 1, "materials": 1}
-            )
-            
-            for pkg in packagings:
-                recyclability = pkg.get("recyclability")
-                # Check if recyclability is missing, empty, or not a valid grade
-                if not recyclability or recyclability.strip() == "" or recyclability == "—":
-                    # Get material for the recyclability form
-                    material = pick_material_text(pkg)
-                    
-                    missing_recyclability.append({
-                        "_id": str(pkg["_id"]),
-                        "package_code": pkg.get("package_code", "N/A"),
-                        "level": level,
-                        "material": material
-                    })
+        packagings = mongo.db.packagings.find(
+            {"owner": owner_oid},
+            {"package_code": 1, "recyclability": 1, "materials": 1, "level": 1}
+        ).sort("level", 1)
+        
+        for pkg in packagings:
+            recyclability = pkg.get("recyclability")
+            # Check if recyclability is missing, empty, or not a valid grade
+            if not recyclability or recyclability.strip() == "" or recyclability == "—":
+                # Get material for the recyclability form
+                material = pick_material_text(pkg)
+                
+                missing_recyclability.append({
+                    "_id": pkg["_id"],
+                    "package_code": pkg.get("package_code", "N/A"),
+                    "level": pkg.get("level"),
+                    "material": material
+                })
         
         return jsonify({
             "count": len(missing_recyclability),
@@ -1879,6 +1667,7 @@ def get_missing_recyclability():
 
 @main_bp.get("/get_product_status")
 @login_required
+@versioned_json
 def get_product_status():
     """
     Returns product status statistics including missing connections.
@@ -1893,10 +1682,9 @@ def get_product_status():
         ))
         
         # Get all packagings
-        all_primary = list(mongo.db.primary_packagings.find({"owner": owner_oid}, {"package_code": 1, "supplier": 1}))
-        all_secondary = list(mongo.db.secondary_packagings.find({"owner": owner_oid}, {"package_code": 1, "supplier": 1}))
-        all_tertiary = list(mongo.db.tertiary_packagings.find({"owner": owner_oid}, {"package_code": 1, "supplier": 1}))
-        all_packagings = all_primary + all_secondary + all_tertiary
+        all_packagings = list(mongo.db.packagings.find(
+            {"owner": owner_oid}, {"package_code": 1, "supplier": 1}
+        ).sort("level", 1))
         
         # Analyze products
         missing_primary = []
@@ -1907,7 +1695,7 @@ def get_product_status():
         for product in all_products:
             connections = product.get("connections", {})
             product_info = {
-                "_id": str(product["_id"]),
+                "_id": product["_id"],
                 "product_code": product.get("product_code", "N/A")
             }
             
@@ -1925,7 +1713,7 @@ def get_product_status():
         for pkg in all_packagings:
             if not pkg.get("supplier"):
                 missing_supplier.append({
-                    "_id": str(pkg["_id"]),
+                    "_id": pkg["_id"],
                     "package_code": pkg.get("package_code", "N/A")
                 })
         
@@ -1974,6 +1762,7 @@ def get_product_status():
 
 @main_bp.get("/get_partner_details/<partner_id>")
 @login_required
+@versioned_json
 def get_partner_details(partner_id):
     try:
         partner_oid = ObjectId(partner_id)
@@ -2002,39 +1791,26 @@ def get_partner_details(partner_id):
                 )
                 for p in products:
                     connected_items.append({
-                        "_id": str(p["_id"]),
+                        "_id": p["_id"],
                         "code": p.get("product_code", "N/A"),
                         "type": "Product"
                     })
             elif partner_type == "supplier":
-                pkg_collections = {
-                    "Primary": mongo.db.primary_packagings,
-                    "Secondary": mongo.db.secondary_packagings,
-                    "Tertiary": mongo.db.tertiary_packagings
-                }
-                for level, collection in pkg_collections.items():
-                    packagings = collection.find(
-                        {"_id": {"$in": connection_oids}},
-                        {"package_code": 1}
-                    )
-                    for pkg in packagings:
-                        connected_items.append({
-                            "_id": str(pkg["_id"]),
-                            "code": pkg.get("package_code", "N/A"),
-                            "type": "Packaging",
-                            "level": level
-                        })
+                packagings = mongo.db.packagings.find(
+                    {"_id": {"$in": connection_oids}},
+                    {"package_code": 1, "level": 1}
+                ).sort("level", 1)
+                for pkg in packagings:
+                    connected_items.append({
+                        "_id": pkg["_id"],
+                        "code": pkg.get("package_code", "N/A"),
+                        "type": "Packaging",
+                        "level": pkg.get("level")
+                    })
         
         partner["connections_detailed"] = connected_items
-
-        # Convert ObjectId to string for JSON serialization
-        partner["_id"] = str(partner["_id"])
-        partner["owner"] = str(partner["owner"])
-        if 'creation_time' in partner:
-            partner.pop('creation_time')
-        if 'connections' in partner:
-            # We are sending connections_detailed instead
-            partner.pop('connections')
+        # We are sending connections_detailed instead
+        partner.pop('connections', None)
 
         return jsonify(partner)
 
@@ -2088,93 +1864,48 @@ def update_packaging(package_id):
     try:
         package_oid = ObjectId(package_id)
         owner_oid = ObjectId(current_user.id)
-        level = request.form.get('packagingLevel')
-        
-        collections = {
-            "Primary": mongo.db.primary_packagings,
-            "Secondary": mongo.db.secondary_packagings,
-            "Tertiary": mongo.db.tertiary_packagings
-        }
-        collection = collections.get(level)
-        if collection is None:
-            flash(f'Invalid packaging level: {level}', 'danger')
-            return redirect(url_for("main.products"))
 
-        package = collection.find_one({"_id": package_oid, "owner": owner_oid})
+        package = find_packaging(mongo.db, owner_oid, package_oid)
         if not package:
             flash("Packaging not found or access denied.", "danger")
             return redirect(url_for("main.products"))
-
-        # --- Basic Info ---
-        package_code = request.form.get('packageCode')
-        recyclability = request.form.get('recyclability')
-        package_shape = request.form.get('packageShape')
-
-        if not all([level, package_code]):
-            flash('Level and Code are required.', 'danger')
+        # The level can't change on edit; the doc's own value wins over the form
+        level = package.get("level")
+        if level not in PACKAGING_LEVELS:
+            flash(f'Invalid packaging level: {level}', 'danger')
             return redirect(url_for("main.products"))
 
-        # --- Dimensions ---
-        dimensions = {}
-        if package_shape == 'rectangular':
-            dimensions['length'] = request.form.get('length')
-            dimensions['width'] = request.form.get('width')
-            dimensions['height'] = request.form.get('height')
-        elif package_shape == 'cylinder':
-            dimensions['height'] = request.form.get('cylHeight')
-            dimensions['radius'] = request.form.get('cylRadius')
-        elif package_shape == 'sphere':
-            dimensions['radius'] = request.form.get('sphRadius')
-        elif package_shape == 'other':
-            dimensions['volume'] = request.form.get('volume')
-        
-        # --- Material Composition ---
-        components = request.form.getlist('packageComponent[]')
-        materials = request.form.getlist('material[]')
-        weights = request.form.getlist('weightGrams[]')
-        recycled_contents = request.form.getlist('recycledContent[]')
-        thicknesses = request.form.getlist('thicknessMicrons[]')
-        adhesives = request.form.getlist('adhesiveType[]')
-        food_contacts = request.form.getlist('foodContact[]')
-        coatings = request.form.getlist('coatingType[]')
-
-        materials_list = []
-        for i in range(len(components)):
-            if not components[i]: continue # Skip empty component rows
-            materials_list.append({
-                "package_component": components[i],
-                "material": materials[i],
-                "weight_grams": _safe_float(weights[i]),
-                "recycled_content": _safe_float(recycled_contents[i]),
-                "thickness_microns": _safe_float(thicknesses[i]),
-                "adhesive_type": adhesives[i],
-                "food_contact": food_contacts[i],
-                "coating": coatings[i]
-            })
-            
-        # --- Document Assembly for Update ---
-        update_doc = {
-            'package_code': package_code,
+        package_shape = request.form.get('packageShape')
+        update_doc = packaging_update({
+            'level': level,
+            'package_code': request.form.get('packageCode'),
+            'recyclability': request.form.get('recyclability'),
             'package_shape': package_shape,
-            'dimensions': dimensions,
-            'materials': materials_list,
-            'recyclability': recyclability,
-            'volume_cm3': calculate_volume(package_shape, dimensions),
-        }
-        
-        if level == 'Secondary':
-            update_doc['quantity_primary_in_secondary_unit'] = _safe_float(request.form.get('quantity_primary_in_secondary_unit'))
-        elif level == 'Tertiary':
-            update_doc['quantity_secondary_in_tertiary_unit'] = _safe_float(request.form.get('quantity_secondary_in_tertiary_unit'))
-        
-        collection.update_one(
-            {'_id': package_oid},
-            {'$set': update_doc}
-        )
+            'dimensions': form_dimensions(request.form, package_shape),
+            'components': form_components(request.form),
+            'quantity_primary_in_secondary_unit': request.form.get('quantity_primary_in_secondary_unit'),
+            'quantity_secondary_in_tertiary_unit': request.form.get('quantity_secondary_in_tertiary_unit'),
+        })
+        package_code, recyclability = update_doc['package_code'], update_doc['recyclability']
+
+        update = {'$set': update_doc}
+        if recyclability != package.get('recyclability'):
+            # A grade changed by hand has no answers to regrade from
+            update['$unset'] = {'recyclability_answers': ''}
+
+        with track_rollups(owner_oid) as rollup:
+            before = mongo.db.packagings.find_one_and_update(
+                {'_id': package_oid},
+                update,
+                projection=GRADED_PACKAGING_FIELDS
+            )
+            rollup.packaging_updated(before, update_doc)
 
         _log_activity("packaging_update", f"Updated {level} packaging: {package_code}")
         flash(f'{level} packaging "{package_code}" has been updated successfully!', 'success')
 
+    except ValueError as e:
+        flash(str(e), 'danger')
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'danger')
 
@@ -0,0 +1,117 @@
+# app/sales.py
+from collections import defaultdict
+from bson.objectid import ObjectId
+
+# `sales` documents, one per product and month:
+#   {_id, owner, product: ObjectId, year, month, quantity, sku_price, period: YYYYMM | None}
+# year/month/quantity/sku_price keep whatever the client posted (product_sales.js
+# sends strings); `period` is the parsed month used for sorting and range filters.
+# A product's sales are listed in _id (insertion) order, like the old embedded array.
+# A plain collection rather than a time-series one: the sales modal edits and
+# deletes single rows by _id, which time-series collections only partly support.
+
+SALE_FIELDS = ("year", "month", "quantity", "sku_price")
+
+# Server-side equivalent of sale_period(), for updates that only change year or month
+PERIOD_EXPR = {"$let": {
+    "vars": {
+        "y": {"$convert": {"input": "$year", "to": "int", "onError": None, "onNull": None}},
+        "m": {"$convert": {"input": "$month", "to": "int", "onError": None, "onNull": None}},
+    },
+    "in": {"$cond": [
+        {"$and": [{"$gte": ["$$m", 1]}, {"$lte": ["$$m", 12]}, {"$gte": ["$$y", 1]}]},
+        {"$add": [{"$multiply": ["$$y", 100]}, "$$m"]},
+        None,
+    ]},
+}}
+
+
+def sale_period(year, month):
+    """Returns YYYYMM as an int, or None if year/month don't parse."""
+    try:
+        year, month = int(year), int(month)
+    except (TypeError, ValueError):
+        return None
+    if year < 1 or not 1 <= month <= 12:
+        return None
+    return year * 100 + month
+
+
+def new_sale(owner_oid, product_oid, data):
+    """Builds a sales document from a posted {year, month, quantity, sku_price} dict."""
+    doc = {"owner": owner_oid, "product": product_oid}
+    for field in SALE_FIELDS:
+        doc[field] = data.get(field)
+    doc["period"] = sale_period(doc["year"], doc["month"])
+    return doc
+
+
+def sales_by_product(db, owner_oid, product_oids=None):
+    """Returns {product ObjectId: [sale docs in insertion order]}."""
+    query = {"owner": owner_oid}
+    if product_oids is not None:
+        query["product"] = {"$in": list(product_oids)}
+    grouped = defaultdict(list)
+    # (product, _id) is the owner_product_id index order, so Mongo doesn't sort in memory
+    cursor = db.sales.find(query, {"product": 1, "year": 1, "month": 1, "quantity": 1}) \
+        .sort([("product", 1), ("_id", 1)])
+    for sale in cursor:
+        grouped[sale["product"]].append(sale)
+    return grouped
+
+
+def with_sales(db, owner_oid, products, all_products=False):
+    """
+    Returns shallow copies of `products` with their `sales` list attached.
+    Pass all_products=True when `products` is the owner's whole catalog, so the
+    sales are read with a single owner-scoped query instead of an $in list.
+    """
+    grouped = sales_by_product(db, owner_oid, None if all_products else [p["_id"] for p in products])
+    return [{**p, "sales": grouped.get(p["_id"], [])} for p in products]
+
+
+def migrate_embedded_sales(db, owner_oid=None):
+    """
+    Moves products.sales arrays into the sales collection.
+    Each product is switched with a compare-and-unset on the exact array that was
+    copied; if a concurrent edit changed it, the copies are removed and the product
+    is reported as skipped so the command can simply be re-run.
+    """
+    query = {"sales.0": {"$exists": True}}
+    if owner_oid:
+        query["owner"] = owner_oid
+    migrated, skipped = 0, 0
+    for product in db.products.find(query, {"owner": 1, "sales": 1}):
+        docs = [new_sale(product["owner"], product["_id"], s) for s in product["sales"] if isinstance(s, dict)]
+        if docs:
+            db.sales.insert_many(docs, ordered=True)
+        result = db.products.update_one(
+            {"_id": product["_id"], "sales": product["sales"]},
+            {"$unset": {"sales": ""}}
+        )
+        if result.modified_count:
+            migrated += 1
+        else:
+            if docs:
+                db.sales.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+            skipped += 1
+    # Products created before the migration carry an empty array
+    db.products.update_many({"sales": {"$size": 0}}, {"$unset": {"sales": ""}})
+    return migrated, skipped
+
+
+def resolve_sale_ref(db, owner_oid, product_oid, sale_ref):
+    """
+    Maps the <sale_ref> URL segment to a sale _id.
+    product_sales.js sends the sale's own _id from /get_product_sales. A plain
+    integer is the list position older cached copies of the script still post;
+    it costs a skip() over the product's sales, so it is kept for them only.
+    """
+    if ObjectId.is_valid(sale_ref):
+        return ObjectId(sale_ref)
+    if sale_ref.isdigit():
+        cursor = db.sales.find({"owner": owner_oid, "product": product_oid}, {"_id": 1}) \
+            .sort("_id", 1).skip(int(sale_ref)).limit(1)
+        for sale in cursor:
+            return sale["_id"]
+    return None
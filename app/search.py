@@ -0,0 +1,194 @@
+# app/search.py
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from bson.objectid import ObjectId
+from flask import current_app
+from . import mongo
+from .data_version import read_version
+
+# Catalog search: one in-memory trigram index per tenant, built on first use
+# and kept in a TTL/LRU cache. Each index is stamped with the tenant's data
+# version (data_version.py), which every write moves on, so the other workers
+# rebuild on their next query too; catalog writes also drop the index of the
+# worker that served them (routes.py, after_request).
+
+# Searchable fields per hit type, most relevant first (earlier fields rank higher)
+SEARCH_TYPES = {
+    "product": ("products", ("product_code", "secondary_product_code", "product_description")),
+    "packaging": ("packagings", ("package_code", "material")),
+    "partner": ("partners", ("partner_name",)),
+}
+LABEL_FIELDS = {"product": "product_code", "packaging": "package_code", "partner": "partner_name"}
+_WORD_START = re.compile(r"[\s\-_/.,;:()]+")
+
+
+def normalize(text):
+    return " ".join(str(text).casefold().split())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _field_values(hit_type, doc):
+    """Yields (field, raw value) for the searchable fields of one document."""
+    for field in SEARCH_TYPES[hit_type][1]:
+        if field == "material":
+            for component in doc.get("materials") or []:
+                if isinstance(component, dict) and component.get("material"):
+                    yield field, component["material"]
+        elif doc.get(field):
+            yield field, doc[field]
+
+
+class TenantIndex:
+    """Trigram postings over one owner's products, packagings and partners."""
+
+    def __init__(self, docs_by_type):
+        self.entries = []  # (type, id, label, level)
+        self.values = []   # (entry, field rank, field, normalized value, raw value)
+        self.postings = defaultdict(set)  # trigram -> value positions
+        for hit_type, docs in docs_by_type.items():
+            fields = SEARCH_TYPES[hit_type][1]
+            for doc in docs:
+                entry = len(self.entries)
+                self.entries.append((hit_type, str(doc["_id"]), doc.get(LABEL_FIELDS[hit_type]), doc.get("level")))
+                for field, raw in _field_values(hit_type, doc):
+                    value = normalize(raw)
+                    if not value:
+                        continue
+                    position = len(self.values)
+                    self.values.append((entry, fields.index(field), field, value, str(raw)))
+                    for gram in _trigrams(value):
+                        self.postings[gram].add(position)
+
+    def _candidates(self, query):
+        if len(query) < 3:
+            return range(len(self.values))  # Too short for trigrams: check every value
+        lists = sorted((self.postings.get(gram, ()) for gram in _trigrams(query)), key=len)
+        if not lists[0]:
+            return ()
+        return set.intersection(*lists) if len(lists) > 1 else lists[0]
+
+    def search(self, query, types=None):
+        """Returns [(entry, field, value)] ranked: exact, prefix, word start, then substring."""
+        query = normalize(query)
+        if not query:
+            return []
+        best = {}
+        for position in self._candidates(query):
+            entry, rank, field, value, raw = self.values[position]
+            if types and self.entries[entry][0] not in types:
+                continue
+            index = value.find(query)
+            if index < 0:
+                continue
+            if value == query:
+                match = 0
+            elif index == 0:
+                match = 1
+            elif _WORD_START.fullmatch(value[index - 1]):
+                match = 2
+            else:
+                match = 3
+            key = (match, rank, len(value), value)
+            if entry not in best or key < best[entry][0]:
+                best[entry] = (key, field, raw)
+        ranked = sorted(best.items(), key=lambda item: (item[1][0], item[0]))
+        return [(entry, field, raw) for entry, (_, field, raw) in ranked]
+
+
+class SearchIndexCache:
+    """Per-owner TenantIndex cache with TTL and LRU eviction, like ReferenceCache."""
+
+    def __init__(self, ttl=300, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # owner -> (expires_at, data version, TenantIndex)
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "build_ms_max": 0.0}
+
+    @staticmethod
+    def _build(owner_oid):
+        docs_by_type = {}
+        for hit_type, (collection, fields) in SEARCH_TYPES.items():
+            projection = {f: 1 for f in fields if f != "material"}
+            projection[LABEL_FIELDS[hit_type]] = 1
+            if hit_type == "packaging":
+                projection.update({"materials.material": 1, "level": 1})
+            docs_by_type[hit_type] = mongo.db[collection].find({"owner": owner_oid}, projection)
+        return TenantIndex(docs_by_type)
+
+    def get(self, owner_oid):
+        # Read the version before the catalog, so a concurrent write is never missed
+        version, _ = read_version(mongo.db, owner_oid)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(owner_oid)
+            if entry and entry[0] > now and entry[1] == version:
+                self._entries.move_to_end(owner_oid)
+                self.stats["hits"] += 1
+                return entry[2]
+            self.stats["misses"] += 1
+            epoch = self._epoch
+
+        started = time.perf_counter()
+        index = self._build(owner_oid)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats["build_ms_max"] = max(self.stats["build_ms_max"], round(elapsed_ms, 3))
+            if self.ttl > 0 and epoch == self._epoch:
+                self._entries[owner_oid] = (now + self.ttl, version, index)
+                self._entries.move_to_end(owner_oid)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return index
+
+    def invalidate(self, owner_oid):
+        with self._lock:
+            self._entries.pop(owner_oid, None)
+            self._epoch += 1
+            self.stats["invalidations"] += 1
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
+
+
+def init_search_index(app):
+    app.extensions["search_index"] = SearchIndexCache(
+        ttl=app.config["SEARCH_INDEX_TTL"],
+        max_entries=app.config["SEARCH_INDEX_SIZE"],
+    )
+
+
+def search_index() -> SearchIndexCache:
+    return current_app.extensions["search_index"]
+
+
+def search_catalog(owner_oid, query, types=None, page=1, per_page=20):
+    """Ranked, paginated hits: {"total", "page", "per_page", "hits": [{type, id, label, level, field, match}]}."""
+    index = search_index().get(owner_oid)
+    ranked = index.search(query, types)
+    start = (page - 1) * per_page
+    hits = []
+    for entry, field, value in ranked[start:start + per_page]:
+        hit_type, entry_id, label, level = index.entries[entry]
+        hit = {"type": hit_type, "id": entry_id, "label": label, "field": field, "match": value}
+        if hit_type == "packaging":
+            hit["level"] = level
+        hits.append(hit)
+    return {"total": len(ranked), "page": page, "per_page": per_page, "hits": hits}
+
+
+def matching_ids(owner_oid, query, hit_type):
+    """ObjectIds of every `hit_type` entry matching `query`, best match first."""
+    index = search_index().get(owner_oid)
+    return [ObjectId(index.entries[entry][1]) for entry, _, _ in index.search(query, {hit_type})]
@@ -0,0 +1,147 @@
+// Modal option lists loaded on open from /options/<source> (see app/options.py)
+// instead of being rendered into every page. A list is declared on its element:
+//
+//   <select data-options-source="packagings" data-options-level="Primary">
+//   <div data-options-source="products" data-options-name="product_ids">  (checkboxes)
+//
+// Other data-options-* attributes become query args (data-options-partner-type
+// -> partner_type). An <input data-options-search="<list id>"> filters the list
+// on the server; the current selection is always kept in the list.
+(function () {
+    const DEBOUNCE_MS = 250;
+    const RESERVED = ['optionsSource', 'optionsName', 'optionsItemClass'];
+    const inFlight = new Map(); // Same URL requested twice at once -> one request
+
+    function fetchOptions(url) {
+        if (!inFlight.has(url)) {
+            const request = fetch(url)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! status: ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .finally(() => inFlight.delete(url));
+            inFlight.set(url, request);
+        }
+        return inFlight.get(url);
+    }
+
+    function optionsUrl(el, selected) {
+        const params = new URLSearchParams();
+        Object.entries(el.dataset).forEach(([key, value]) => {
+            if (key.startsWith('options') && !RESERVED.includes(key) && value) {
+                const arg = key.slice('options'.length).replace(/[A-Z]/g, c => `_${c.toLowerCase()}`).slice(1);
+                params.set(arg, value);
+            }
+        });
+        const search = el.id && document.querySelector(`[data-options-search="${el.id}"]`);
+        if (search && search.value.trim()) {
+            params.set('q', search.value.trim());
+        }
+        if (selected.length) {
+            params.set('selected', selected.join(','));
+        }
+        return `/options/${el.dataset.optionsSource}?${params}`;
+    }
+
+    function currentSelection(el) {
+        if (el.tagName === 'SELECT') {
+            return Array.from(el.selectedOptions).map(option => option.value).filter(Boolean);
+        }
+        return Array.from(el.querySelectorAll('input:checked')).map(input => input.value);
+    }
+
+    function fillSelect(select, data, selected) {
+        // Placeholder options ("-- Select --") stay at the top
+        Array.from(select.options).forEach(option => {
+            if (option.value) option.remove();
+        });
+        data.options.forEach(item => {
+            const option = new Option(item.label, item.value);
+            option.selected = selected.includes(item.value);
+            select.add(option);
+        });
+        if (data.more) {
+            const more = new Option('More items: refine the search', '');
+            more.disabled = true;
+            select.add(more);
+        }
+    }
+
+    function fillChecklist(container, data, selected) {
+        container.innerHTML = '';
+        const prefix = container.id || container.dataset.optionsName;
+        data.options.forEach(item => {
+            const check = document.createElement('div');
+            check.className = 'form-check';
+            const input = document.createElement('input');
+            input.className = 'form-check-input';
+            input.type = 'checkbox';
+            input.name = container.dataset.optionsName;
+            input.value = item.value;
+            input.id = `${prefix}_${item.value}`;
+            input.checked = selected.includes(item.value);
+            const label = document.createElement('label');
+            label.className = 'form-check-label';
+            label.htmlFor = input.id;
+            label.textContent = item.label;
+            check.append(input, label);
+            if (container.dataset.optionsItemClass) {
+                const wrapper = document.createElement('div');
+                wrapper.className = container.dataset.optionsItemClass;
+                wrapper.appendChild(check);
+                container.appendChild(wrapper);
+            } else {
+                container.appendChild(check);
+            }
+        });
+        if (!data.options.length) {
+            container.innerHTML = '<div class="text-muted small">No items found.</div>';
+        } else if (data.more) {
+            container.insertAdjacentHTML('beforeend', '<div class="text-muted small">More items: refine the search.</div>');
+        }
+    }
+
+    // Loads one list; `selected` (ids or values) defaults to the current selection
+    function load(el, selected) {
+        selected = (selected || currentSelection(el)).filter(Boolean);
+        return fetchOptions(optionsUrl(el, selected)).then(data => {
+            if (el.tagName === 'SELECT') {
+                fillSelect(el, data, selected);
+            } else {
+                fillChecklist(el, data, selected);
+            }
+            return data;
+        });
+    }
+
+    // Loads every declared list inside `root`
+    function loadAll(root) {
+        return Promise.all(Array.from(root.querySelectorAll('[data-options-source]')).map(el => load(el)));
+    }
+
+    // Empties the search boxes of the lists inside `root` (on modal open)
+    function resetSearch(root) {
+        root.querySelectorAll('[data-options-search]').forEach(input => {
+            input.value = '';
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('[data-options-search]').forEach(input => {
+            let timer = null;
+            input.addEventListener('input', () => {
+                clearTimeout(timer);
+                timer = setTimeout(() => {
+                    const el = document.getElementById(input.dataset.optionsSearch);
+                    if (el) {
+                        load(el).catch(error => console.error('Error loading options:', error));
+                    }
+                }, DEBOUNCE_MS);
+            });
+        });
+    });
+
+    window.lazyOptions = { load, loadAll, resetSearch };
+})();
@@ -0,0 +1,135 @@
+// Server-side paginated tables on the products page (see app/tables.py).
+// The page renders the first page of each table; "Load more" appends the
+// next keyset page, and sorting, filters and search reload from page one.
+// The page is streamed, so the first page's cursor follows its rows in a
+// hidden <div data-next>.
+document.addEventListener('DOMContentLoaded', function () {
+    const LOAD_MORE_CLASS = 'paged-table-more';
+
+    class PagedTable {
+        constructor(table, bodyId, headerId, emptyText) {
+            this.table = table;
+            this.body = document.getElementById(bodyId);
+            this.header = document.getElementById(headerId);
+            this.emptyText = emptyText;
+            this.params = {};
+            this.requestId = 0;
+            if (!this.body) {
+                return;
+            }
+            const marker = this.body.querySelector(':scope > [data-next]');
+            if (marker) {
+                marker.remove();
+            }
+            this.renderMore(marker ? marker.dataset.next || null : null);
+            this.bindSorting();
+        }
+
+        url(after) {
+            const params = new URLSearchParams();
+            Object.entries(this.params).forEach(([key, value]) => {
+                if (value) {
+                    params.set(key, value);
+                }
+            });
+            if (after) {
+                params.set('after', after);
+            }
+            return `/get_table_page/${this.table}?${params}`;
+        }
+
+        // Replaces the filter/sort params and reloads from the first page
+        update(params) {
+            Object.assign(this.params, params);
+            const requestId = ++this.requestId;
+            return this.fetchPage(null).then(data => {
+                if (requestId !== this.requestId) {
+                    return; // A newer reload is in flight
+                }
+                this.body.innerHTML = data.html || `<div class="text-muted" style="padding: 12px;">${this.emptyText}</div>`;
+                this.renderMore(data.next);
+            });
+        }
+
+        fetchPage(after) {
+            return fetch(this.url(after)).then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                return response.json();
+            });
+        }
+
+        renderMore(next) {
+            const old = this.body.querySelector(`.${LOAD_MORE_CLASS}`);
+            if (old) {
+                old.remove();
+            }
+            if (!next) {
+                return;
+            }
+            const button = document.createElement('button');
+            button.type = 'button';
+            button.className = `btn btn-sm btn-light w-100 ${LOAD_MORE_CLASS}`;
+            button.textContent = 'Load more';
+            button.addEventListener('click', () => {
+                button.disabled = true;
+                button.textContent = 'Loading...';
+                const requestId = this.requestId;
+                this.fetchPage(next).then(data => {
+                    if (requestId !== this.requestId) {
+                        return;
+                    }
+                    button.insertAdjacentHTML('beforebegin', data.html);
+                    this.renderMore(data.next);
+                }).catch(error => {
+                    console.error('Error loading rows:', error);
+                    button.disabled = false;
+                    button.textContent = 'Load more';
+                });
+            });
+            this.body.appendChild(button);
+        }
+
+        bindSorting() {
+            if (!this.header) {
+                return;
+            }
+            const headers = this.header.querySelectorAll('.sortable-header[data-sort-by]');
+            headers.forEach(header => {
+                header.addEventListener('click', () => {
+                    const nextDirection = header.dataset.sortDirection === 'asc' ? 'desc' : 'asc';
+                    headers.forEach(h => {
+                        h.dataset.sortDirection = '';
+                        const icon = h.querySelector('i');
+                        if (icon) {
+                            icon.className = 'bi bi-arrow-down-up';
+                        }
+                    });
+                    header.dataset.sortDirection = nextDirection;
+                    const icon = header.querySelector('i');
+                    if (icon) {
+                        icon.className = nextDirection === 'asc' ? 'bi bi-arrow-up' : 'bi bi-arrow-down';
+                    }
+                    this.update({ sort: header.dataset.sortBy, dir: nextDirection })
+                        .catch(error => console.error('Error sorting table:', error));
+                });
+            });
+        }
+    }
+
+    window.pagedTables = {
+        product: new PagedTable('products', 'product-list-body', 'product-list-header', 'No products found.'),
+        packaging: new PagedTable('packagings', 'packaging-list-body', 'packaging-list-header', 'No packaging found.'),
+        partner: new PagedTable('partners', 'partner-list-body', 'partner-list-header', 'No partners found.'),
+    };
+
+    // Filter selects: <select data-table-filter="product" name="status">
+    document.querySelectorAll('[data-table-filter]').forEach(select => {
+        select.addEventListener('change', () => {
+            const table = window.pagedTables[select.dataset.tableFilter];
+            table.update({ [select.name]: select.value })
+                .catch(error => console.error('Error filtering table:', error));
+        });
+    });
+});
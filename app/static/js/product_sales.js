@@ -1,7 +1,7 @@
 // app/static/js/product_sales.js
 
 let currentProductSalesId = null;
-let currentProductSalesEditIndex = null;
+let currentProductSalesEditId = null;
 let currentProductSalesData = [];
 
 // Helper to get month name
@@ -17,9 +17,10 @@ function renderProductSalesRows(sales) {
   currentProductSalesData = sales || [];
   tbody.innerHTML = "";
 
-  (sales || []).forEach((sale, index) => {
+  (sales || []).forEach((sale) => {
     const tr = document.createElement("tr");
-    const isEditing = index === currentProductSalesEditIndex;
+    // Rows are addressed by sale id; list positions shift when another row is removed
+    const isEditing = sale._id === currentProductSalesEditId;
 
     const monthName = sale.month ? MONTHS[parseInt(sale.month, 10) - 1] : "";
 
@@ -30,9 +31,9 @@ function renderProductSalesRows(sales) {
         <td><input type="number" class="form-control form-control-sm edit-qty" value="${sale.quantity ?? ""}"></td>
         <td><input type="number" step="0.01" class="form-control form-control-sm edit-sku" value="${sale.sku_price ?? ""}"></td>
         <td class="d-flex">
-          <button class="btn btn-sm btn-success me-2 product-sale-save" data-index="${index}">Save</button>
+          <button class="btn btn-sm btn-success me-2 product-sale-save" data-sale-id="${sale._id}">Save</button>
           <button class="btn btn-sm btn-secondary me-2 product-sale-cancel">Cancel</button>
-          <button class="btn btn-sm btn-danger product-sale-delete" data-index="${index}">Delete</button>
+          <button class="btn btn-sm btn-danger product-sale-delete" data-sale-id="${sale._id}">Delete</button>
         </td>
       `;
     } else {
@@ -42,8 +43,8 @@ function renderProductSalesRows(sales) {
         <td>${sale.quantity ?? ""}</td>
         <td>${sale.sku_price ?? "—"}</td>
         <td>
-          <button class="btn btn-sm btn-outline-secondary me-2 product-sale-edit" data-index="${index}">Edit</button>
-          <button class="btn btn-sm btn-danger product-sale-delete" data-index="${index}">Delete</button>
+          <button class="btn btn-sm btn-outline-secondary me-2 product-sale-edit" data-sale-id="${sale._id}">Edit</button>
+          <button class="btn btn-sm btn-danger product-sale-delete" data-sale-id="${sale._id}">Delete</button>
         </td>
       `;
     }
@@ -94,7 +95,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
       document.getElementById("productSalesProductCode").textContent = code;
 
-      currentProductSalesEditIndex = null;
+      currentProductSalesEditId = null;
 
       // inputları temizle
       const priceInput = document.getElementById("productSalesSkuPrice");
@@ -164,19 +165,19 @@ document.addEventListener("DOMContentLoaded", () => {
     const deleteBtn = e.target.closest(".product-sale-delete");
 
     if (editBtn) {
-      currentProductSalesEditIndex = parseInt(editBtn.getAttribute("data-index"), 10);
+      currentProductSalesEditId = editBtn.getAttribute("data-sale-id");
       renderProductSalesRows(currentProductSalesData);
       return;
     }
 
     if (cancelBtn) {
-      currentProductSalesEditIndex = null;
+      currentProductSalesEditId = null;
       renderProductSalesRows(currentProductSalesData);
       return;
     }
 
     if (saveBtn) {
-      const index = parseInt(saveBtn.getAttribute("data-index"), 10);
+      const saleId = saveBtn.getAttribute("data-sale-id");
       const row = saveBtn.closest("tr");
 
       const payload = {
@@ -186,7 +187,7 @@ document.addEventListener("DOMContentLoaded", () => {
         sku_price: row.querySelector(".edit-sku")?.value || null,
       };
 
-      const res = await fetch(`/update_product_sales/${currentProductSalesId}/${index}`, {
+      const res = await fetch(`/update_product_sales/${currentProductSalesId}/${saleId}`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(payload),
@@ -198,15 +199,15 @@ document.addEventListener("DOMContentLoaded", () => {
       }
 
       const sales = await fetchSales(currentProductSalesId);
-      currentProductSalesEditIndex = null;
+      currentProductSalesEditId = null;
       renderProductSalesRows(sales);
       return;
     }
 
     if (deleteBtn) {
-      const index = deleteBtn.getAttribute("data-index");
+      const saleId = deleteBtn.getAttribute("data-sale-id");
 
-      const res = await fetch(`/delete_product_sales/${currentProductSalesId}/${index}`, {
+      const res = await fetch(`/delete_product_sales/${currentProductSalesId}/${saleId}`, {
         method: "POST",
       });
 
@@ -216,7 +217,7 @@ document.addEventListener("DOMContentLoaded", () => {
       }
 
       const sales = await fetchSales(currentProductSalesId);
-      currentProductSalesEditIndex = null;
+      currentProductSalesEditId = null;
       renderProductSalesRows(sales);
     }
   });
@@ -0,0 +1,40 @@
+// Recyclability questionnaires for the modal. All forms come in one
+// versioned JSON bundle (/recyclability_forms.json?v=...), which the browser
+// caches for good, so opening the modal again costs no request at all.
+(function () {
+    let bundle = null;
+
+    function loadBundle() {
+        if (!bundle) {
+            bundle = fetch(window.RECYCLABILITY_FORMS_URL)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error('Forms not found');
+                    }
+                    return response.json();
+                })
+                .catch(error => {
+                    bundle = null; // Retry on the next modal open
+                    throw error;
+                });
+        }
+        return bundle;
+    }
+
+    // Lowercased first material of a comma-separated list
+    function normalizeMaterial(material) {
+        if (!material) return '';
+        return material.toLowerCase().trim().split(',')[0].trim();
+    }
+
+    window.recyclabilityForms = {
+        // Resolves to {name, html} for the material, or null when no form matches
+        find(material) {
+            const normalized = normalizeMaterial(material);
+            return loadBundle().then(data => {
+                const match = data.materials.find(([patterns]) => patterns.some(p => normalized.includes(p)));
+                return match ? { name: match[1], html: data.forms[match[1]] } : null;
+            });
+        },
+    };
+})();
@@ -0,0 +1,45 @@
+# app/streaming.py
+from flask import current_app, g, get_flashed_messages, stream_template, stream_with_context
+
+# Streamed pages. Flask's stream_template yields one small string per
+# template event; stream_page() groups them into chunks of about
+# STREAM_BUFFER_SIZE characters, and sends what it holds at every
+# {{ stream_flush() }} in the templates (base.html has one after the sidebar),
+# so the browser gets the head and sidebar before the page's queries run.
+# Data handed to a streamed page should therefore be lazy (tables.StreamedPage,
+# callables) so it is read while the page is being sent.
+#
+# The status and headers, session cookie included, leave with the first
+# chunk: anything that writes the session has to happen before, which is why
+# flashed messages are read up front. An error past that point can only
+# truncate the page.
+
+
+def stream_flush():
+    """Template global: send the buffered output now (before a slow step)."""
+    g.stream_flush = True
+    return ""
+
+
+def _buffered(events, size):
+    buffer, buffered = [], 0
+    for event in events:
+        buffer.append(event)
+        buffered += len(event)
+        if buffered >= size or g.pop("stream_flush", False):
+            yield "".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_page(template_name, **context):
+    """A streamed HTML response for `template_name`; used like render_template."""
+    get_flashed_messages(with_categories=True)  # Pops them while the session can still be saved
+    events = stream_template(template_name, **context)
+    size = current_app.config["STREAM_BUFFER_SIZE"]
+    return current_app.response_class(stream_with_context(_buffered(events, size)), mimetype="text/html")
+
+
+def init_streaming(app):
+    app.jinja_env.globals["stream_flush"] = stream_flush
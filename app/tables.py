@@ -0,0 +1,137 @@
+# app/tables.py
+import base64
+from bson import json_util
+from bson.objectid import ObjectId
+
+# Keyset-paginated, server-sorted queries for the products page tables.
+#
+# Each table sorts on one of its `sorts` fields with _id as tie-breaker, and
+# every (owner, field, _id) pair has a matching index (indexes.py), so a page
+# is an index range scan of `limit` rows wherever it starts. A cursor is the
+# last row's (sort value, _id), encoded as an opaque URL-safe string.
+
+TABLES = {
+    "products": {
+        "collection": "products",
+        "sorts": ("product_code", "secondary_product_code", "product_category"),
+        "default_sort": "product_code",
+    },
+    "packagings": {
+        "collection": "packagings",
+        "sorts": ("level", "package_code", "recyclability"),
+        "default_sort": "level",
+    },
+    "partners": {
+        "collection": "partners",
+        "sorts": ("partner_name", "partner_type", "country"),
+        "default_sort": "partner_name",
+    },
+}
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(value, oid):
+    raw = json_util.dumps([value, oid]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (value, ObjectId), or raises ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, oid = json_util.loads(raw)
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(oid, ObjectId) or not (value is None or isinstance(value, (str, int, float))):
+        raise ValueError("invalid cursor")
+    return value, oid
+
+
+def _after(field, direction, value, oid):
+    """
+    Rows strictly after (value, oid) in (field, _id) order. Mongo sorts null
+    and missing values before strings, and range operators don't cross types,
+    so nulls get their own branch.
+    """
+    if direction == 1:
+        if value is None:
+            return {"$or": [{field: None, "_id": {"$gt": oid}}, {field: {"$ne": None}}]}
+        return {"$or": [{field: {"$gt": value}}, {field: value, "_id": {"$gt": oid}}]}
+    if value is None:
+        return {field: None, "_id": {"$lt": oid}}
+    return {"$or": [{field: {"$lt": value}}, {field: value, "_id": {"$lt": oid}}, {field: None}]}
+
+
+def parse_table_args(table, args, default_limit):
+    """
+    Reads ?sort=&dir=asc|desc&after=&limit= for `table`.
+    Returns (sort field, direction, cursor or None, limit); raises ValueError.
+    """
+    spec = TABLES[table]
+    sort = args.get("sort") or spec["default_sort"]
+    if sort not in spec["sorts"]:
+        raise ValueError(f"Cannot sort by {sort}")
+    direction = -1 if args.get("dir") == "desc" else 1
+    after = decode_cursor(args["after"]) if args.get("after") else None
+    limit = min(max(int(args.get("limit", default_limit)), 1), MAX_PAGE_SIZE)
+    return sort, direction, after, limit
+
+
+def _page_cursor(db, table, query, sort, direction, after, limit, projection):
+    if after is not None:
+        query = {"$and": [query, _after(sort, direction, *after)]}
+    return (
+        db[TABLES[table]["collection"]]
+        .find(query, projection)
+        .sort([(sort, direction), ("_id", direction)])
+        .limit(limit + 1)
+    )
+
+
+def table_page(db, table, query, sort, direction=1, after=None, limit=50, projection=None):
+    """Returns (docs, next cursor or None)."""
+    docs = list(_page_cursor(db, table, query, sort, direction, after, limit, projection))
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        return docs, encode_cursor(last.get(sort), last["_id"])
+    return docs, None
+
+
+class StreamedPage:
+    """
+    A table page read while a streamed template renders it. Iterating runs the
+    query and yields rows as the cursor delivers them, passed through
+    `convert` (docs -> rows) `batch_size` docs at a time so per-page lookups
+    stay batched. `next` and `count` are set once the rows are consumed.
+    Iterate once.
+    """
+
+    def __init__(self, db, table, query, sort, direction=1, after=None, limit=50, projection=None,
+                 convert=list, batch_size=50):
+        self._args = (db, table, query, sort, direction, after, limit, projection)
+        self.sort = sort
+        self.limit = limit
+        self.convert = convert
+        self.batch_size = batch_size
+        self.next = None
+        self.count = 0
+
+    def __iter__(self):
+        cursor = _page_cursor(*self._args).batch_size(self.batch_size)
+        batch, last = [], None
+        try:
+            for doc in cursor:
+                if self.count == self.limit:
+                    self.next = encode_cursor(last.get(self.sort), last["_id"])
+                    break
+                self.count += 1
+                last = doc
+                batch.append(doc)
+                if len(batch) == self.batch_size:
+                    yield from self.convert(batch)
+                    batch = []
+        finally:
+            cursor.close()
+        if batch:
+            yield from self.convert(batch)
@@ -0,0 +1,110 @@
+# app/user_cache.py
+import threading
+import time
+from collections import OrderedDict
+from bson.objectid import ObjectId
+from flask import current_app, session
+from . import mongo
+
+# Only what the User model needs; anything else is read from Mongo by the view itself
+USER_FIELDS = {"_id": 1, "username": 1}
+SESSION_KEY = "_user_cache"  # {"id", "username", "expires"} in the signed session cookie
+
+
+class UserCache:
+    """
+    TTL/LRU cache in front of the Flask-Login user_loader.
+
+    Entries hold the projected user doc, never a User instance, so requests
+    don't share mutable state. With `in_session` on, the username also rides in
+    the signed session cookie and is trusted until it expires, which skips the
+    lookup even on workers that haven't seen the user yet.
+    """
+
+    def __init__(self, ttl=60, max_entries=1024, in_session=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.in_session = in_session
+        self._entries = OrderedDict()  # user_id -> (expires_at, doc)
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.stats = {"hits": 0, "session_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, user_id):
+        """Returns the projected user doc for a string id, or None if the user doesn't exist."""
+        if self.ttl <= 0:
+            return self._load(user_id)
+
+        if self.in_session:
+            cached = session.get(SESSION_KEY)
+            if cached and cached.get("id") == user_id and cached.get("expires", 0) > time.time():
+                with self._lock:
+                    self.stats["session_hits"] += 1
+                return {"_id": user_id, "username": cached.get("username")}
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+            epoch = self._epoch
+
+        doc = self._load(user_id)
+        if doc is not None:
+            self.prime(doc, epoch=epoch)
+        return doc
+
+    @staticmethod
+    def _load(user_id):
+        return mongo.db.users.find_one({"_id": ObjectId(user_id)}, USER_FIELDS)
+
+    def prime(self, user, epoch=None):
+        """Stores a user doc already read elsewhere (e.g. by the login view)."""
+        if self.ttl <= 0:
+            return
+        user_id = str(user["_id"])
+        doc = {key: user.get(key) for key in USER_FIELDS}
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return  # Invalidated while we were loading
+            self._entries[user_id] = (time.monotonic() + self.ttl, doc)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        if self.in_session:
+            session[SESSION_KEY] = {"id": user_id, "username": doc.get("username"), "expires": time.time() + self.ttl}
+
+    def invalidate(self, user_id):
+        """
+        Call on logout and after any change to the user's username or password.
+        Other workers keep their copy for at most `ttl` seconds.
+        """
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+            self._epoch += 1
+            self.stats["invalidations"] += 1
+        if self.in_session:
+            session.pop(SESSION_KEY, None)
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries), in_session=self.in_session)
+        lookups = stats["hits"] + stats["session_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["session_hits"]) / lookups, 4) if lookups else None
+        return stats
+
+
+def init_user_cache(app):
+    app.extensions["user_cache"] = UserCache(
+        ttl=app.config["USER_CACHE_TTL"],
+        max_entries=app.config["USER_CACHE_SIZE"],
+        in_session=app.config["USER_CACHE_IN_SESSION"],
+    )
+
+
+def user_cache() -> UserCache:
+    return current_app.extensions["user_cache"]
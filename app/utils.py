@@ -0,0 +1,7 @@
+# app/utils.py
+
+def _safe_float(value):
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
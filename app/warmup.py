@@ -0,0 +1,146 @@
+# app/warmup.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g
+from jinja2 import FileSystemBytecodeCache
+from . import mongo
+
+# Startup warm-up, so a freshly started worker doesn't make its first users
+# wait (rolling restarts, deploys).
+#
+# Compiled templates go to a Jinja bytecode cache on disk (JINJA_CACHE_DIR),
+# so only the first worker after a template change compiles them;
+# `flask compile-templates` fills it at deploy time. With WARMUP on,
+# create_app() also loads every template, opens MONGO_MIN_POOL_SIZE pooled
+# connections (pinging the server) and sends one request to the login page
+# through the whole stack (routing, sessions, Flask-Login, rendering).
+# The timings, and the latency of the first real request, are logged and
+# shown in /stats.
+
+TEMPLATE_EXTENSIONS = ("html",)  # The templates folder also holds stray files (.DS_Store)
+
+
+def cache_dir(app):
+    """JINJA_CACHE_DIR, or instance/jinja_cache when only WARMUP is on; None when off."""
+    if app.config["JINJA_CACHE_DIR"]:
+        return app.config["JINJA_CACHE_DIR"]
+    if app.config["WARMUP"]:
+        return os.path.join(app.instance_path, "jinja_cache")
+    return None
+
+
+def init_template_cache(app):
+    """Persistent bytecode cache; call before the first template is loaded."""
+    directory = cache_dir(app)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """Loads every template once (compiling it into the bytecode cache). Returns the count."""
+    names = app.jinja_env.list_templates(extensions=TEMPLATE_EXTENSIONS)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def open_mongo_pool(connections):
+    """Pings the server from `connections` threads at once so the pool opens that many connections."""
+    def ping(_):
+        mongo.db.command("ping")
+
+    with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+        list(pool.map(ping, range(max(1, connections))))
+
+
+class StartupReport:
+    """Startup and warm-up timings of this worker (milliseconds), plus its first request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"warm": False, "startup_ms": None, "templates": None, "templates_ms": None,
+                      "mongo_ms": None, "warmup_request_ms": None, "first_request_ms": None}
+
+    def record(self, **values):
+        with self._lock:
+            self.stats.update(values)
+
+    def first_request(self, elapsed_ms):
+        """Records the first request's latency; True only for the first call."""
+        with self._lock:
+            if self.stats["first_request_ms"] is not None:
+                return False
+            self.stats["first_request_ms"] = elapsed_ms
+            return True
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def warm_up(app, report):
+    """Templates, Mongo pool and one login page request; failures are logged, not raised."""
+    started = time.perf_counter()
+    report.record(templates=compile_templates(app), templates_ms=_ms(started))
+
+    started = time.perf_counter()
+    try:
+        open_mongo_pool(app.config["MONGO_MIN_POOL_SIZE"])
+        report.record(mongo_ms=_ms(started))
+    except Exception as e:
+        app.logger.warning("Warm-up: Mongo ping failed: %s", e)
+
+    started = time.perf_counter()
+    try:
+        status = app.test_client().get("/").status_code
+        report.record(warmup_request_ms=_ms(started))
+        if status != 200:
+            app.logger.warning("Warm-up: login page answered %s", status)
+    except Exception as e:
+        app.logger.warning("Warm-up: login page request failed: %s", e)
+    report.record(warm=True)
+
+
+def _track_first_request(app, report):
+    def start():
+        if report.stats["first_request_ms"] is None:
+            g.warmup_request_started = time.perf_counter()
+
+    def finish(response):
+        started = g.pop("warmup_request_started", None)
+        if started is not None and report.first_request(_ms(started)):
+            app.logger.info("First request: %s ms (%s)", report.stats["first_request_ms"], response.status_code)
+        return response
+
+    app.before_request(start)
+    app.after_request(finish)
+
+
+def init_startup(app, started):
+    """Runs the warm-up when WARMUP is on and reports the startup; `started` is create_app's perf_counter()."""
+    report = StartupReport()
+    app.extensions["startup"] = report
+    if app.config["WARMUP"]:
+        warm_up(app, report)
+    report.record(startup_ms=_ms(started))
+    stats = report.snapshot_stats()
+    if stats["warm"]:
+        app.logger.info(
+            "Startup: %s ms (warm-up: %s templates in %s ms, Mongo %s ms, login page %s ms)",
+            stats["startup_ms"], stats["templates"], stats["templates_ms"],
+            stats["mongo_ms"], stats["warmup_request_ms"],
+        )
+    else:
+        app.logger.info("Startup: %s ms (no warm-up)", stats["startup_ms"])
+    _track_first_request(app, report)
+
+
+def startup_report() -> StartupReport:
+    return current_app.extensions["startup"]
@@ -0,0 +1,142 @@
+# tests/test_dashboard_engines.py
+import os
+import random
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from app import dashboard_numpy
+from app.dashboard_metrics import LEVELS, compute_metrics_pipeline, compute_metrics_python, same_metrics
+from app.rollups import compute_metrics_rollup, rebuild_rollups
+from app.sales import new_sale, with_sales
+
+# Every dashboard engine must return what the Python reference engine returns.
+# Runs against the mongod in MONGO_URI (the pipeline engine needs a real server,
+# MongoDB 5.0+) on a throwaway database, and is skipped when none is reachable:
+#   MONGO_URI=mongodb://localhost:27017 python -m pytest tests
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+FILTERS = [
+    {},
+    {"start_date": datetime(2023, 3, 1), "end_date": datetime(2024, 2, 1)},
+    {"packaging_levels": ["Primary", "Tertiary"]},
+    {"start_date": datetime(2024, 1, 1), "packaging_levels": ["Secondary"]},
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        info = client.server_info()
+    except PyMongoError as e:
+        pytest.skip(f"No mongod reachable at MONGO_URI: {e}")
+    client.server_version = tuple(info["versionArray"][:2])
+    yield client
+    client.close()
+
+
+@pytest.fixture(scope="module")
+def seeded(client):
+    """A throwaway database with two owners' catalogs, including the odd values the engines must agree on."""
+    db = client[f"ecopacknav_test_{ObjectId()}"]
+    rnd = random.Random(7)
+    owners = [ObjectId(), ObjectId()]
+    for owner in owners:
+        packages = {}
+        for level in LEVELS:
+            docs = []
+            for i in range(6):
+                doc = {
+                    "owner": owner, "level": level, "package_code": f"{level[0]}{i}",
+                    "recyclability": rnd.choice(["A", "B", "C", "D", " b ", "", None, "N/A", 3]),
+                    "materials": [
+                        {"package_component": "Body", "weight_grams": rnd.choice([1.5, "2", None, 10, "x"])},
+                        {"package_component": "Lid", "weight_grams": rnd.choice([0.25, 4, None])},
+                    ],
+                }
+                if level == "Secondary":
+                    doc["quantity_primary_in_secondary_unit"] = rnd.choice([6, 12, 0, 2.5])
+                elif level == "Tertiary":
+                    doc["quantity_secondary_in_tertiary_unit"] = rnd.choice([10, 3, 1])
+                docs.append(doc)
+            # No pack ratio field at all (counts as 1), and an explicit null (skips the product's sales)
+            docs[0].pop("quantity_primary_in_secondary_unit", None)
+            if level == "Secondary":
+                docs[1]["quantity_primary_in_secondary_unit"] = None
+            db.packagings.insert_many(docs)
+            packages[level] = [str(d["_id"]) for d in docs]
+
+        for i in range(40):
+            connections = {
+                f"{level.lower()}_package": rnd.choice(packages[level] + ["", "", "not-an-id", str(ObjectId())])
+                for level in LEVELS
+            }
+            product_oid = db.products.insert_one(
+                {"owner": owner, "product_code": f"P{i:03d}", "connections": connections}
+            ).inserted_id
+            sales = []
+            for month in range(30):
+                year, month = 2022 + month // 12, month % 12 + 1
+                sales.append(new_sale(owner, product_oid, {
+                    "year": str(year), "month": rnd.choice([str(month), month]),
+                    "quantity": rnd.choice(["0", "5", "17", "100", "33.5", 12, "", None, "abc"]),
+                }))
+            sales.append(new_sale(owner, product_oid, {"year": "2023", "month": "13", "quantity": "9"}))
+            db.sales.insert_many(sales)
+    yield db, owners
+    client.drop_database(db.name)
+
+
+def _catalog(db, owner, product_oids=None):
+    query = {"owner": owner}
+    if product_oids is not None:
+        query["_id"] = {"$in": product_oids}
+    products = list(db.products.find(query, {"connections": 1}))
+    products = with_sales(db, owner, products, all_products=product_oids is None)
+    packages = {str(p["_id"]): p for p in db.packagings.find({"owner": owner})}
+    return products, packages
+
+
+def _expected(db, owner, product_oids=None, **filters):
+    products, packages = _catalog(db, owner, product_oids)
+    return compute_metrics_python(products, packages, **filters)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_pipeline_matches_python(client, seeded, filters):
+    if client.server_version < (5, 0):
+        pytest.skip("The pipeline engine needs MongoDB 5.0+")
+    db, owners = seeded
+    for owner in owners:
+        assert same_metrics(compute_metrics_pipeline(db, owner, **filters), _expected(db, owner, **filters))
+
+
+def test_pipeline_matches_python_for_selected_products(client, seeded):
+    if client.server_version < (5, 0):
+        pytest.skip("The pipeline engine needs MongoDB 5.0+")
+    db, owners = seeded
+    product_oids = [p["_id"] for p in db.products.find({"owner": owners[0]}, {"_id": 1}).limit(7)]
+    actual = compute_metrics_pipeline(db, owners[0], [str(oid) for oid in product_oids])
+    assert same_metrics(actual, _expected(db, owners[0], product_oids))
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_rollups_match_python(seeded, filters):
+    db, owners = seeded
+    for owner in owners:
+        rebuild_rollups(db, owner)
+        assert same_metrics(compute_metrics_rollup(db, owner, **filters), _expected(db, owner, **filters))
+
+
+@pytest.mark.skipif(not dashboard_numpy.available(), reason="numpy is not installed")
+@pytest.mark.parametrize("filters", FILTERS)
+def test_numpy_matches_python(seeded, filters):
+    db, owners = seeded
+    for owner in owners:
+        products, packages = _catalog(db, owner)
+        actual = dashboard_numpy.load_and_compute(db, owner, products, packages, all_products=True, **filters)
+        assert same_metrics(actual, _expected(db, owner, **filters))